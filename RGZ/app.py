@@ -1,65 +1,301 @@
 from flask import Flask, request, jsonify
-import re
-from collections import Counter
+import atexit
+import codecs
+import os
 import sys
 import json
+from concurrent.futures.process import BrokenProcessPool
+
+from batch import analyze_batch
+from corpus import INDEX_SIZE, Corpus
+from result_cache import ResultCache
+from wordcount import (TOP_N, WordCounter, count_words, iter_ndjson, iter_text,
+                       text_digest)
 
 app = Flask(__name__)
 
 app.config['JSON_AS_ASCII'] = False  # Для корректного отображения кириллицы
 
-def analyze_text(text: str):
+# Типы тела запроса, которые /analyze читает потоком, не целиком
+STREAM_TYPES = {'text/plain', 'application/x-ndjson'}
+
+# Сколько документов принимает /analyze/batch за один запрос
+BATCH_MAX_DOCUMENTS = int(os.getenv('RGZ_BATCH_MAX_DOCUMENTS', '10000'))
+
+# Приблизительный режим /analyze?approximate=1: сколько слов
+# отслеживать (память фиксирована, погрешность не больше
+# word_count / capacity) и верхняя граница для ?capacity=
+APPROX_CAPACITY = int(os.getenv('RGZ_APPROX_CAPACITY', '10000'))
+APPROX_MAX_CAPACITY = 1000000
+MAX_TOP_K = 1000
+
+# Кэш готовых ответов /analyze для JSON-запросов: бюджет в памяти
+# процесса (0 — кэш выключен) и необязательный общий каталог на диске
+# для всех процессов сервера со своим бюджетом
+CACHE_MAX_BYTES = int(os.getenv('RGZ_CACHE_MAX_BYTES', str(32 * 2 ** 20)))
+CACHE_DIR = os.getenv('RGZ_CACHE_DIR', '')
+CACHE_DIR_MAX_BYTES = int(os.getenv('RGZ_CACHE_DIR_MAX_BYTES',
+                                    str(256 * 2 ** 20)))
+# Меняется вместе с форматом ответа, чтобы старые записи на диске
+# не отдавались после обновления
+CACHE_FORMAT = 1
+
+result_cache = ResultCache(CACHE_MAX_BYTES, CACHE_DIR or None,
+                           CACHE_DIR_MAX_BYTES)
+
+# Корпусный режим (/corpus): длина окна и корзины скользящего окна
+# в секундах, файл снимка (пустая строка — без снимков) и как часто
+# его писать. Корпус хранится в памяти процесса, а снимок пишет один
+# процесс, поэтому prefork запускает приложение со снимком только
+# одним процессом на одном порту (--workers 1) и сохраняет корпус
+# при штатном выходе процесса (atexit)
+CORPUS_WINDOW_SECONDS = int(os.getenv('RGZ_CORPUS_WINDOW_SECONDS', '3600'))
+CORPUS_BUCKET_SECONDS = int(os.getenv('RGZ_CORPUS_BUCKET_SECONDS', '60'))
+CORPUS_SNAPSHOT = os.getenv(
+    'RGZ_CORPUS_SNAPSHOT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 'corpus_snapshot.json')
+)
+CORPUS_SNAPSHOT_SECONDS = int(os.getenv('RGZ_CORPUS_SNAPSHOT_SECONDS', '30'))
+
+corpus = Corpus(CORPUS_WINDOW_SECONDS, CORPUS_BUCKET_SECONDS,
+                CORPUS_SNAPSHOT or None, CORPUS_SNAPSHOT_SECONDS)
+atexit.register(corpus.close)
+PREFORK_SINGLE_PROCESS = bool(CORPUS_SNAPSHOT)
+
+def analyze_text(text: str, top_n: int = TOP_N, capacity: int = None):
     """
     Анализирует текст:
     - подсчитывает количество слов,
-    - определяет топ-3 самых частых слов.
+    - определяет топ-3 (top_n) самых частых слов.
+    Текст разбирается кусками, так что копия в нижнем регистре и
+    список слов не создаются для всего текста сразу. С capacity
+    частоты приблизительные (Space-Saving), в ответе — их границы.
     """
-    if not text or not text.strip():
-        return {"word_count": 0, "most_frequent_words": []}
-    
-    # Извлекаем только слова, игнорируя пунктуацию, и приводим к нижнему регистру
-    words = re.findall(r'\b\w+\b', text.lower())
-    word_count = len(words)
-    
-    if word_count == 0:
-        return {"word_count": 0, "most_frequent_words": []}
-    
-    # Определяем топ-3 самых частых слов
-    freq = Counter(words)
-    most_common = freq.most_common(3)
-    
-    # Форматируем результат: список кортежей [("слово", частота), ...]
-    formatted_common = [[word, count] for word, count in most_common]
-    
-    return {
-        "word_count": word_count,
-        "most_frequent_words": formatted_common
-    }
+    return count_words(text, capacity).result(top_n)
+
+def analysis_options():
+    """
+    Параметры /analyze из строки запроса: ?k=10 — сколько слов в топе,
+    ?approximate=1 и ?capacity=N — приблизительный подсчёт.
+    Возвращает (top_n, capacity или None); ValueError при ошибке.
+    """
+    args = request.args
+    try:
+        top_n = int(args.get('k', TOP_N))
+        capacity = args.get('capacity')
+        if capacity is not None:
+            capacity = int(capacity)
+        elif args.get('approximate', '').lower() in ('1', 'true', 'yes'):
+            capacity = APPROX_CAPACITY
+    except ValueError:
+        raise ValueError("'k' and 'capacity' must be integers")
+    if not 1 <= top_n <= MAX_TOP_K:
+        raise ValueError(f"'k' must be between 1 and {MAX_TOP_K}")
+    if capacity is not None and not top_n <= capacity <= APPROX_MAX_CAPACITY:
+        raise ValueError(f"'capacity' must be between k and "
+                         f"{APPROX_MAX_CAPACITY}")
+    return top_n, capacity
+
+def json_body(data) -> bytes:
+    # Используем json.dumps для полного контроля над кодировкой
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+def json_response(data, status=200):
+    return app.response_class(
+        response=json_body(data),
+        status=status,
+        mimetype='application/json; charset=utf-8'
+    )
+
+def cached_analysis(text: str, top_n: int, capacity: int = None):
+    """
+    Ответ /analyze для текста целиком через кэш: при попадании
+    отдаются готовые байты, без анализа и сериализации.
+    Заголовок X-Cache — HIT или MISS.
+    """
+    if not CACHE_MAX_BYTES:
+        return json_response(analyze_text(text, top_n, capacity))
+    key = text_digest(text, CACHE_FORMAT, top_n, capacity)
+    body = result_cache.get(key)
+    status = 'HIT'
+    if body is None:
+        body = json_body(analyze_text(text, top_n, capacity))
+        result_cache.put(key, body)
+        status = 'MISS'
+    response = app.response_class(
+        response=body,
+        mimetype='application/json; charset=utf-8'
+    )
+    response.headers['X-Cache'] = status
+    return response
+
+def read_stream(capacity=None) -> WordCounter:
+    """
+    Потоковое чтение тела (text/plain или NDJSON): тело читается
+    кусками, счётчики обновляются по ходу чтения, память ограничена
+    словарём, а не размером текста. ValueError, если тело некорректно.
+    """
+    encoding = request.mimetype_params.get('charset', 'utf-8')
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        raise ValueError(f"Unknown charset '{encoding}'")
+
+    if request.mimetype == 'application/x-ndjson':
+        chunks = iter_ndjson(request.stream, encoding)
+    else:
+        chunks = iter_text(request.stream, encoding)
+
+    counter = WordCounter(capacity)
+    for chunk in chunks:   # в том числе UnicodeDecodeError
+        counter.feed(chunk)
+    return counter
+
+def analyze_stream(top_n, capacity):
+    """Потоковый анализ, см. read_stream."""
+    try:
+        counter = read_stream(capacity)
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    return json_response(counter.result(top_n))
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    """Эндпоинт для анализа текста."""
+    """
+    Эндпоинт для анализа текста. Формат тела — по Content-Type:
+    - application/json: {"text": "..."}, текст целиком;
+    - text/plain: сырой текст, читается потоком;
+    - application/x-ndjson: строки {"text": "кусок"}, куски — подряд
+      идущие части одного текста (слово может быть разрезано между
+      строками), читаются потоком.
+    Параметры строки запроса — см. analysis_options.
+    """
+    try:
+        top_n, capacity = analysis_options()
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+
+    if request.mimetype in STREAM_TYPES:
+        return analyze_stream(top_n, capacity)
+
     data = request.get_json()
     
-    if not data or 'text' not in data:
+    if not isinstance(data, dict) or not isinstance(data.get('text'), str):
         return jsonify({
             "error": "Expected JSON with 'text' field",
             "example": {"text": "ваш текст для анализа"}
         }), 400
     
-    result = analyze_text(data['text'])
-    
-    # Используем json.dumps для полного контроля над кодировкой
-    return app.response_class(
-        response=json.dumps(result, ensure_ascii=False, indent=2),
-        status=200,
-        mimetype='application/json; charset=utf-8'
-    )
+    return cached_analysis(data['text'], top_n, capacity)
+
+def batch_documents(data):
+    """
+    Документы пакета: (id или None, текст) для каждого элемента
+    'documents' — строки или объекта {"id": ..., "text": "..."}.
+    ValueError с описанием, если пакет некорректен.
+    """
+    documents = data.get('documents') if isinstance(data, dict) else None
+    if not isinstance(documents, list):
+        raise ValueError("Expected JSON with 'documents' list")
+    if len(documents) > BATCH_MAX_DOCUMENTS:
+        raise ValueError(f"Too many documents (max {BATCH_MAX_DOCUMENTS})")
+    parsed = []
+    for number, document in enumerate(documents):
+        if isinstance(document, dict):
+            doc_id, text = document.get('id'), document.get('text')
+        else:
+            doc_id, text = None, document
+        if not isinstance(text, str):
+            raise ValueError(f"Document {number}: expected text string")
+        parsed.append((doc_id, text))
+    return parsed
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch_endpoint():
+    """
+    Пакетный анализ: {"documents": ["текст", {"id": 1, "text": "..."}],
+    "top_k": 10}. Документы разбираются пулом процессов, результаты —
+    в порядке документов; с top_k добавляется общий топ корпуса.
+    """
+    data = request.get_json(silent=True)
+    try:
+        documents = batch_documents(data)
+    except ValueError as exc:
+        return json_response({
+            "error": str(exc),
+            "example": {"documents": ["первый текст", {"id": 2, "text": "второй"}],
+                        "top_k": 10}
+        }, 400)
+    top_k = data.get('top_k')
+    if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+        return json_response({"error": "'top_k' must be a positive integer"}, 400)
+
+    try:
+        results, corpus = analyze_batch([text for _, text in documents], top_k)
+    except BrokenProcessPool:
+        return json_response({"error": "Worker pool failed, retry later"}, 503)
+
+    response_data = {
+        "count": len(results),
+        "results": [
+            {"id": doc_id, **result} if doc_id is not None else result
+            for (doc_id, _), result in zip(documents, results)
+        ],
+    }
+    if corpus is not None:
+        response_data["corpus"] = corpus
+    return json_response(response_data)
+
+@app.route('/corpus', methods=['POST'])
+def corpus_add():
+    """
+    Добавляет текст в корпус. Тело — как у /analyze: JSON {"text": ...}
+    или поток text/plain / NDJSON. В ответе — анализ самого текста
+    и число документов в корпусе.
+    """
+    if request.mimetype in STREAM_TYPES:
+        try:
+            counter = read_stream()
+        except ValueError as exc:
+            return json_response({"error": str(exc)}, 400)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('text'), str):
+            return json_response({
+                "error": "Expected JSON with 'text' field",
+                "example": {"text": "ваш текст для корпуса"}
+            }, 400)
+        counter = count_words(data['text'])
+
+    result = counter.result(TOP_N)
+    result["corpus_documents"] = corpus.add(counter.counts, counter.word_count)
+    return json_response(result)
+
+@app.route('/corpus/top', methods=['GET'])
+def corpus_top():
+    """
+    Топ-k слов корпуса из поддерживаемого индекса, без пересчёта:
+    ?k=10&window=all|sliding|tumbling|previous.
+    """
+    try:
+        top_n = int(request.args.get('k', TOP_N))
+    except ValueError:
+        return json_response({"error": "'k' must be an integer"}, 400)
+    if not 1 <= top_n <= INDEX_SIZE:
+        return json_response(
+            {"error": f"'k' must be between 1 and {INDEX_SIZE}"}, 400)
+    try:
+        result = corpus.top(top_n, request.args.get('window', 'all'))
+    except ValueError as exc:
+        return json_response({"error": str(exc)}, 400)
+    return json_response(result)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Эндпоинт для проверки работоспособности сервиса."""
-    return jsonify({"status": "healthy", "service": "text-analyzer"})
+    return jsonify({"status": "healthy", "service": "text-analyzer",
+                    "cache": result_cache.stats()})
 
 @app.route('/')
 def index():
@@ -76,20 +312,34 @@ def index():
                     "word_count": "число",
                     "most_frequent_words": "[['слово', частота], ...]"
                 }
-            }
+            },
+            "POST /analyze (поток)": "Тело text/plain или "
+                                     "application/x-ndjson со строками "
+                                     "{\"text\": \"кусок\"}",
+            "POST /analyze?k=10&approximate=1": "Топ-k; приблизительно, "
+                                                "в фиксированной памяти, "
+                                                "с границами погрешности",
+            "POST /analyze/batch": {
+                "request": {"documents": ["текст", {"id": 2, "text": "..."}],
+                            "top_k": 10},
+                "response": {"count": "число", "results": "[...]",
+                             "corpus": "общий топ-k (если задан top_k)"}
+            },
+            "POST /corpus": "Добавить текст в корпус (тело как у /analyze)",
+            "GET /corpus/top?k=10&window=sliding": "Топ-k корпуса: all, "
+                                                   "sliding, tumbling "
+                                                   "или previous"
         },
         "nginx_balancing": "Распределение между портами 5001, 5002, 5003"
     }
     
     # Возвращаем с правильной кодировкой
-    return app.response_class(
-        response=json.dumps(response_data, ensure_ascii=False, indent=2),
-        status=200,
-        mimetype='application/json; charset=utf-8'
-    )
+    return json_response(response_data)
 
 if __name__ == '__main__':
     # Поддержка запуска с указанием порта: python app.py 5001
+    # Для нагрузки — несколько процессов и сразу все порты nginx:
+    # python ../lab6/servers/prefork.py app.py --ports 5001-5003 --workers 4
     port = 5000
     if len(sys.argv) > 1:
         try:
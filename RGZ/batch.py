@@ -0,0 +1,147 @@
+import atexit
+import heapq
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from wordcount import TOP_N, count_words
+
+# Процессов в пуле пакетного анализа (по умолчанию — по числу ядер)
+BATCH_WORKERS = int(os.getenv('RGZ_BATCH_WORKERS', '0')) or os.cpu_count() or 1
+
+# Пакет меньше стольких символов разбирается в потоке запроса:
+# передача текстов в процессы обошлась бы дороже самого разбора
+BATCH_MIN_PARALLEL_CHARS = int(os.getenv('RGZ_BATCH_MIN_PARALLEL_CHARS',
+                                         '262144'))
+
+# Кусков на процесс: с несколькими кусками процесс, которому
+# достались короткие тексты, успевает взять следующий
+CHUNKS_PER_WORKER = 4
+
+
+def balance_chunks(sizes, count):
+    """
+    Раскладывает индексы документов по count кускам примерно равного
+    суммарного размера: от длинных к коротким, каждый — в самый
+    лёгкий кусок. Пустые куски отбрасываются.
+    """
+    heap = [(0, n) for n in range(count)]
+    chunks = [[] for _ in range(count)]
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        total, n = heapq.heappop(heap)
+        chunks[n].append(index)
+        heapq.heappush(heap, (total + sizes[index], n))
+    return [chunk for chunk in chunks if chunk]
+
+
+def analyze_chunk(texts, with_counts):
+    """
+    Выполняется в процессе пула: результаты analyze_text для каждого
+    текста куска и, если нужно, общие частоты слов куска.
+    """
+    results = []
+    corpus = Counter() if with_counts else None
+    for text in texts:
+        counter = count_words(text)
+        results.append(counter.result(TOP_N))
+        if corpus is not None:
+            corpus.update(counter.counts)
+    return results, corpus
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class BatchPool:
+    """
+    Пул процессов, живущий между запросами. Создаётся при первом
+    пакете (в каждом процессе сервера свой, так что prefork не
+    наследует чужой пул) и сразу запускает все процессы.
+    Процессы стартуют через spawn: fork из многопоточного сервера
+    может унести в потомка захваченные замки.
+    """
+
+    def __init__(self, workers=BATCH_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                # Все процессы стартуют сейчас, а не по мере нагрузки
+                for future in [self._executor.submit(_warm_up)
+                               for _ in range(self.workers)]:
+                    future.result()
+            return self._executor
+
+    def reset(self):
+        """Пул сломан (процесс упал): следующий пакет создаст новый."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+pool = BatchPool()
+atexit.register(pool.shutdown)
+
+
+def analyze_batch(texts, top_k=None):
+    """
+    Анализирует тексты; возвращает (результаты в порядке texts,
+    общий топ-top_k слов корпуса или None). В общем топе слова
+    с равной частотой идут по алфавиту, так что он не зависит
+    от того, как тексты разошлись по процессам.
+    """
+    with_counts = bool(top_k)
+    sizes = [len(text) for text in texts]
+    if pool.workers <= 1 or sum(sizes) < BATCH_MIN_PARALLEL_CHARS:
+        chunks = [list(range(len(texts)))] if texts else []
+        outputs = [analyze_chunk(texts, with_counts)] if texts else []
+    else:
+        chunks = balance_chunks(sizes, pool.workers * CHUNKS_PER_WORKER)
+        executor = pool.executor()
+        futures = [
+            executor.submit(analyze_chunk, [texts[i] for i in chunk],
+                            with_counts)
+            for chunk in chunks
+        ]
+        try:
+            outputs = [future.result() for future in futures]
+        except BrokenProcessPool:
+            pool.reset()
+            raise
+
+    results = [None] * len(texts)
+    corpus = Counter()
+    for chunk, (chunk_results, chunk_counts) in zip(chunks, outputs):
+        for index, result in zip(chunk, chunk_results):
+            results[index] = result
+        if chunk_counts:
+            corpus.update(chunk_counts)
+
+    if not with_counts:
+        return results, None
+    return results, {
+        "word_count": sum(r["word_count"] for r in results),
+        "most_frequent_words": [
+            [word, count] for word, count in heapq.nsmallest(
+                top_k, corpus.items(), key=lambda item: (-item[1], item[0])
+            )
+        ],
+    }
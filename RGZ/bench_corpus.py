@@ -0,0 +1,79 @@
+"""
+Корпусный режим: время добавления документа и ответа топ-k из индекса
+против пересчёта по всем частотам (Counter.most_common).
+
+Корпус — --documents документов по --words слов из словаря
+в --vocabulary слов с распределением Ципфа; документы добавляются
+в Corpus по одному, затем --queries раз запрашивается топ-k каждого
+окна. Для сравнения — тот же топ пересчётом частот за всё время.
+
+Запуск: python bench_corpus.py [--documents 2000] [--words 500]
+        [--vocabulary 200000] [--k 10] [--queries 1000]
+"""
+import argparse
+import itertools
+import random
+import statistics
+import time
+from collections import Counter
+
+from corpus import Corpus
+
+
+def make_documents(documents, words, vocabulary, seed=1):
+    rng = random.Random(seed)
+    names = [f"слово{i}" for i in range(vocabulary)]
+    cum_weights = list(itertools.accumulate(
+        1 / rank for rank in range(1, vocabulary + 1)
+    ))
+    return [Counter(rng.choices(names, cum_weights=cum_weights, k=words))
+            for _ in range(documents)]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=500)
+    parser.add_argument("--vocabulary", type=int, default=200000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents, args.words, args.vocabulary)
+    corpus = Corpus()
+    start = time.perf_counter()
+    for counts in documents:
+        corpus.add(counts, args.words)
+    ingest = (time.perf_counter() - start) / args.documents
+
+    print(f"Корпус: {args.documents} документов по {args.words} слов, "
+          f"{len(corpus.all.counts)} разных слов, топ-{args.k}")
+    print(f"Добавление документа: {ingest * 1000:.3f} мс")
+    print(f"{'запрос':22} {'p50, мс':>9} {'p99, мс':>9}")
+    print("-" * 42)
+
+    for window in Corpus.WINDOWS[:3]:
+        samples = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            corpus.top(args.k, window)
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{'индекс, ' + window:22} {statistics.median(samples):>9.4f} "
+              f"{percentile(samples, 0.99):>9.4f}")
+
+    samples = []
+    for _ in range(max(1, args.queries // 100)):
+        start = time.perf_counter()
+        corpus.all.counts.most_common(args.k)
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f"{'пересчёт, all':22} {statistics.median(samples):>9.4f} "
+          f"{percentile(samples, 0.99):>9.4f}")
+
+
+if __name__ == "__main__":
+    main()
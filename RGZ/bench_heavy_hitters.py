@@ -0,0 +1,96 @@
+"""
+Точный подсчёт слов (Counter) против приблизительного (Space-Saving)
+на синтетическом корпусе с распределением Ципфа.
+
+Корпус — --words слов из словаря в --vocabulary слов, частота слова
+ранга r пропорциональна 1 / r^--zipf; он заранее нарезан на куски,
+как при потоковом чтении, и в замер не входит. Для каждого режима
+печатаются время разбора, пик памяти (tracemalloc, отдельным
+прогоном), совпадение топ-k с точным, наибольшая ошибка оценки
+в топ-k, граница погрешности max_error и признак guaranteed.
+
+Запуск: python bench_heavy_hitters.py [--words 3000000]
+        [--vocabulary 1000000] [--zipf 1.0] [--k 10]
+        [--capacities 1000,10000,100000]
+"""
+import argparse
+import itertools
+import random
+import time
+import tracemalloc
+
+from wordcount import CHUNK_SIZE, WordCounter
+
+
+def make_corpus(words, vocabulary, exponent, seed=1):
+    """Корпус кусками по ~CHUNK_SIZE символов."""
+    rng = random.Random(seed)
+    names = [f"слово{i}" for i in range(vocabulary)]
+    cum_weights = list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, vocabulary + 1)
+    ))
+    per_chunk = CHUNK_SIZE // 10
+    chunks = []
+    for start in range(0, words, per_chunk):
+        sample = rng.choices(names, cum_weights=cum_weights,
+                             k=min(per_chunk, words - start))
+        chunks.append(" ".join(sample) + " ")
+    return chunks
+
+
+def analyze(chunks, capacity, k):
+    counter = WordCounter(capacity)
+    for chunk in chunks:
+        counter.feed(chunk)
+    return counter.result(k)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--words", type=int, default=3000000)
+    parser.add_argument("--vocabulary", type=int, default=1000000)
+    parser.add_argument("--zipf", type=float, default=1.0)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--capacities", default="1000,10000,100000")
+    args = parser.parse_args()
+
+    chunks = make_corpus(args.words, args.vocabulary, args.zipf)
+    print(f"Корпус: {args.words} слов, словарь {args.vocabulary}, "
+          f"Ципф s={args.zipf:g}, топ-{args.k}")
+    print(f"{'режим':20} {'время, с':>9} {'память, МБ':>11} "
+          f"{'топ-k верно':>12} {'ошибка в топ':>13} {'max_error':>10} "
+          f"{'гарантия':>9}")
+    print("-" * 90)
+
+    exact = None
+    modes = [None] + [int(c) for c in args.capacities.split(",")]
+    for capacity in modes:
+        start = time.perf_counter()
+        result = analyze(chunks, capacity, args.k)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        analyze(chunks, capacity, args.k)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        top = result["most_frequent_words"]
+        if exact is None:
+            exact = dict(top)
+            name, same, worst, bound, guaranteed = "точный", "-", "-", "-", "-"
+        else:
+            name = f"space-saving {capacity}"
+            same = f"{len(set(exact) & {w for w, _ in top})}/{len(exact)}"
+            # Ошибка оценки относительно точной частоты, если слово
+            # есть в точном топе
+            errors = [abs(count - exact[word]) / exact[word]
+                      for word, count in top if word in exact]
+            worst = f"{max(errors, default=0):.2%}"
+            bound = str(result["approximate"]["max_error"])
+            guaranteed = "да" if result["approximate"]["guaranteed"] else "нет"
+        print(f"{name:20} {elapsed:>9.2f} {peak / 2 ** 20:>11.1f} "
+              f"{same:>12} {worst:>13} {bound:>10} {guaranteed:>9}")
+
+
+if __name__ == "__main__":
+    main()
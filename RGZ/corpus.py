@@ -0,0 +1,306 @@
+import bisect
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+
+# ------------------------------------------------------
+# Корпусный режим: частоты слов всех присланных текстов
+#
+# Три таблицы частот:
+# - all      — за всё время;
+# - sliding  — скользящее окно: последние window секунд, собранные
+#              из корзин по bucket секунд (старая корзина вычитается,
+#              когда выходит из окна);
+# - tumbling — текущий период длины window, выровненный по времени
+#              (с 12:00 до 13:00 и т. д.); закончившийся период
+#              остаётся доступен как previous.
+# Для каждой таблицы поддерживается индекс — INDEX_SIZE самых частых
+# слов в отсортированном списке, так что топ-k отдаётся срезом,
+# без пересчёта. Полный пересчёт индекса нужен только скользящему
+# окну, когда из него выходит корзина (раз в bucket секунд).
+#
+# Состояние живёт в памяти процесса и периодически сохраняется
+# в JSON-файл (атомарно: временный файл + rename); при старте
+# файл читается, и счётчики продолжаются с сохранённых.
+# ------------------------------------------------------
+
+# Сколько слов держит индекс топа (наибольшее k для /corpus/top)
+INDEX_SIZE = 1000
+
+SNAPSHOT_VERSION = 1
+
+
+class FrequencyTable:
+    """
+    Частоты слов и индекс топа. Пока частоты только растут, индекс
+    обновляется по словам каждого документа: слово вне индекса может
+    попасть в него, только обогнав последнее. Уменьшение частот
+    (remove) требует rebuild().
+    """
+
+    def __init__(self, index_size=INDEX_SIZE):
+        self.index_size = index_size
+        self.counts = Counter()
+        self.word_count = 0
+        self.documents = 0
+        # (-частота, слово) по возрастанию: самые частые впереди,
+        # при равной частоте — по алфавиту
+        self._top = []
+        self._members = {}
+
+    def add(self, counts, word_count, documents=1):
+        self.word_count += word_count
+        self.documents += documents
+        for word, count in counts.items():
+            total = self.counts[word] + count
+            self.counts[word] = total
+            self._reindex(word, total)
+
+    def _reindex(self, word, count):
+        top, members = self._top, self._members
+        old = members.get(word)
+        if old is not None:
+            del top[bisect.bisect_left(top, (-old, word))]
+        elif len(top) >= self.index_size and (-count, word) > top[-1]:
+            return
+        bisect.insort(top, (-count, word))
+        members[word] = count
+        if len(top) > self.index_size:
+            _, dropped = top.pop()
+            del members[dropped]
+
+    def remove(self, counts, word_count, documents):
+        """Вычитает частоты; после — rebuild()."""
+        self.word_count -= word_count
+        self.documents -= documents
+        for word, count in counts.items():
+            left = self.counts[word] - count
+            if left > 0:
+                self.counts[word] = left
+            else:
+                del self.counts[word]
+
+    def rebuild(self):
+        self._top = heapq.nsmallest(
+            self.index_size,
+            ((-count, word) for word, count in self.counts.items())
+        )
+        self._members = {word: -count for count, word in self._top}
+
+    def top(self, k):
+        return [[word, -count] for count, word in self._top[:k]]
+
+    def dump(self):
+        """Копия состояния для снимка (частоты копируются)."""
+        return {"word_count": self.word_count, "documents": self.documents,
+                "counts": dict(self.counts)}
+
+    @classmethod
+    def restore(cls, data, index_size=INDEX_SIZE):
+        table = cls(index_size)
+        table.counts = Counter(data["counts"])
+        table.word_count = data["word_count"]
+        table.documents = data["documents"]
+        table.rebuild()
+        return table
+
+
+class Corpus:
+    """
+    Частоты корпуса за всё время и по окнам. Потокобезопасен; clock —
+    источник времени (подменяется в тестах).
+    """
+
+    WINDOWS = ("all", "sliding", "tumbling", "previous")
+
+    def __init__(self, window=3600, bucket=60, snapshot_path=None,
+                 snapshot_interval=30, clock=time.time):
+        if window < bucket or window % bucket:
+            raise ValueError('window must be a multiple of bucket')
+        self.window = window
+        self.bucket = bucket
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Сохранения идут по одному, иначе старый снимок мог бы
+        # записаться поверх нового
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saver = None
+        self._stop = threading.Event()
+
+        self.all = FrequencyTable()
+        self.sliding = FrequencyTable()
+        # Корзины скользящего окна: [начало, частоты, слов, документов]
+        self._buckets = deque()
+        self.tumbling = FrequencyTable()
+        self.previous = FrequencyTable()
+        self._period = self._period_start(clock())
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load()
+
+    def _period_start(self, now):
+        return int(now // self.window * self.window)
+
+    def _horizon(self, now):
+        """Начало самой старой корзины, ещё входящей в скользящее окно."""
+        return int(now // self.bucket * self.bucket) - self.window + self.bucket
+
+    def _advance(self, now):
+        """Выводит из окон всё, что в них уже не попадает."""
+        horizon = self._horizon(now)
+        expired = False
+        while self._buckets and self._buckets[0][0] < horizon:
+            _, counts, word_count, documents = self._buckets.popleft()
+            self.sliding.remove(counts, word_count, documents)
+            expired = True
+        if expired:
+            self.sliding.rebuild()
+
+        period = self._period_start(now)
+        if period != self._period:
+            # Между периодами мог пройти целый период без текстов
+            consecutive = period == self._period + self.window
+            self.previous = self.tumbling if consecutive else FrequencyTable()
+            self.tumbling = FrequencyTable()
+            self._period = period
+
+    def add(self, counts, word_count):
+        """Добавляет частоты одного документа; возвращает, сколько
+        документов в корпусе."""
+        with self._lock:
+            now = self.clock()
+            self._advance(now)
+            start = int(now // self.bucket * self.bucket)
+            if not self._buckets or self._buckets[-1][0] != start:
+                self._buckets.append([start, Counter(), 0, 0])
+            bucket = self._buckets[-1]
+            bucket[1].update(counts)
+            bucket[2] += word_count
+            bucket[3] += 1
+            for table in (self.all, self.sliding, self.tumbling):
+                table.add(counts, word_count)
+            self._dirty = True
+            documents = self.all.documents
+        self._start_saver()
+        return documents
+
+    def top(self, k, window="all"):
+        """Топ-k слов таблицы window (см. WINDOWS) со сводкой."""
+        if window not in self.WINDOWS:
+            raise ValueError(f"window must be one of {', '.join(self.WINDOWS)}")
+        with self._lock:
+            now = self.clock()
+            self._advance(now)
+            table = getattr(self, window)
+            result = {
+                "window": window,
+                "documents": table.documents,
+                "word_count": table.word_count,
+                "most_frequent_words": table.top(k),
+            }
+            if window == "sliding":
+                result["from"] = self._horizon(now)
+                result["to"] = now
+            elif window == "tumbling":
+                result["from"] = self._period
+                result["to"] = self._period + self.window
+            elif window == "previous":
+                result["from"] = self._period - self.window
+                result["to"] = self._period
+            return result
+
+    # --- снимки на диск ---
+
+    def _start_saver(self):
+        if not self.snapshot_path or self._saver is not None:
+            return
+        with self._lock:
+            if self._saver is not None:
+                return
+            self._saver = threading.Thread(target=self._save_loop,
+                                           daemon=True)
+            self._saver.start()
+
+    def _save_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.save()
+
+    def close(self):
+        """Останавливает сохранение по таймеру и сохраняет последний раз."""
+        self._stop.set()
+        self.save()
+
+    def save(self):
+        """Пишет снимок, если с прошлого что-то добавилось."""
+        if not self.snapshot_path:
+            return
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        # Под блокировкой только копируется состояние; сериализация
+        # в JSON идёт без неё и не задерживает add и top
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {
+                "version": SNAPSHOT_VERSION,
+                "saved_at": self.clock(),
+                "window": self.window,
+                "bucket": self.bucket,
+                "all": self.all.dump(),
+                "buckets": [[start, dict(counts), word_count, documents]
+                            for start, counts, word_count, documents
+                            in self._buckets],
+                "period": self._period,
+                "tumbling": self.tumbling.dump(),
+                "previous": self.previous.dump(),
+            }
+            self._dirty = False
+        data = json.dumps(state, ensure_ascii=False)
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, self.snapshot_path)
+        except OSError:
+            os.unlink(tmp)
+            with self._lock:
+                self._dirty = True
+            raise
+
+    def load(self):
+        """Восстанавливает счётчики из снимка snapshot_path."""
+        with open(self.snapshot_path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported corpus snapshot version "
+                             f"{data.get('version')}")
+        with self._lock:
+            self.all = FrequencyTable.restore(data["all"])
+            self.sliding = FrequencyTable()
+            self._buckets = deque()
+            # Окна считаются по текущим настройкам: корзины другого
+            # размера в скользящее окно не переносятся
+            if data["bucket"] == self.bucket:
+                for start, counts, word_count, documents in data["buckets"]:
+                    counts = Counter(counts)
+                    self._buckets.append([start, counts, word_count,
+                                          documents])
+                    self.sliding.counts.update(counts)
+                    self.sliding.word_count += word_count
+                    self.sliding.documents += documents
+                self.sliding.rebuild()
+            if data["window"] == self.window:
+                self.tumbling = FrequencyTable.restore(data["tumbling"])
+                self.previous = FrequencyTable.restore(data["previous"])
+                self._period = data["period"]
+            self._advance(self.clock())
@@ -0,0 +1,107 @@
+import heapq
+from collections import Counter
+
+
+class SpaceSaving:
+    """
+    Приблизительные частоты самых частых слов в фиксированной памяти
+    (алгоритм Space-Saving, Metwally и др.):
+    - отслеживается не больше capacity слов;
+    - новое слово при полной таблице вытесняет самое редкое и
+      наследует его счётчик как погрешность;
+    - оценка count слова завышена не больше чем на его error:
+      count - error <= истинная частота <= count;
+    - любое слово с частотой больше N / capacity (N — всего слов)
+      гарантированно есть в таблице.
+    Интерфейс — как у Counter для WordCounter: update() и most_common().
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        # Куча (счётчик, слово) строится при первом вытеснении;
+        # счётчики в ней могут отставать от _counts и обновляются,
+        # когда устаревшая запись оказывается наверху
+        self._heap = None
+
+    def __len__(self):
+        return len(self._counts)
+
+    def update(self, words):
+        """Добавляет слова куска: сначала точно считаются внутри куска."""
+        chunk = Counter(words)
+        self.total += sum(chunk.values())
+        counts = self._counts
+        # Уже отслеживаемые слова — просто прибавить
+        for word in chunk.keys() & counts.keys():
+            counts[word] += chunk.pop(word)
+        for word, count in chunk.items():
+            self._insert(word, count)
+
+    def add(self, word: str, count: int = 1):
+        self.total += count
+        if word in self._counts:
+            self._counts[word] += count
+        else:
+            self._insert(word, count)
+
+    def _insert(self, word, count):
+        counts = self._counts
+        if len(counts) < self.capacity:
+            counts[word] = count
+            if self._heap is not None:
+                heapq.heappush(self._heap, (count, word))
+            return
+
+        heap = self._heap
+        if heap is None:
+            heap = self._heap = [(c, w) for w, c in counts.items()]
+            heapq.heapify(heap)
+        while True:
+            low, victim = heap[0]
+            actual = counts[victim]
+            if actual == low:
+                break
+            heapq.heapreplace(heap, (actual, victim))
+        heapq.heapreplace(heap, (low + count, word))
+        del counts[victim]
+        self._errors.pop(victim, None)
+        counts[word] = low + count
+        self._errors[word] = low
+
+    def max_error(self) -> int:
+        """На сколько может быть завышена любая оценка; частота
+        неотслеживаемого слова тоже не больше этого числа."""
+        if len(self._counts) < self.capacity or self._heap is None:
+            return 0
+        return min(self._counts.values())
+
+    def error(self, word: str) -> int:
+        return self._errors.get(word, 0)
+
+    def most_common(self, n: int):
+        return heapq.nlargest(n, self._counts.items(),
+                              key=lambda item: item[1])
+
+    def summary(self, n: int) -> dict:
+        """
+        Границы для топ-n: [слово, не меньше, не больше] и признак
+        guaranteed — топ-n точно тот же, что у точного подсчёта
+        (нижняя граница каждого не меньше оценки любого другого слова).
+        """
+        top = self.most_common(n + 1)
+        rest = top[n][1] if len(top) > n else self.max_error()
+        top = top[:n]
+        bounds = [[word, count - self.error(word), count]
+                  for word, count in top]
+        return {
+            "algorithm": "space-saving",
+            "capacity": self.capacity,
+            "max_error": self.max_error(),
+            "bounds": bounds,
+            "guaranteed": all(low >= rest for _, low, _ in bounds),
+        }
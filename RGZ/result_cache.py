@@ -0,0 +1,196 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# ------------------------------------------------------
+# Кэш готовых ответов /analyze
+#
+# Ключ — text_digest: хэш текста, приведённого к виду, в котором его
+# разбирает анализ, и параметров запроса. Значение — уже
+# сериализованное тело ответа (bytes), так что при попадании не нужны
+# ни анализ, ни json.dumps.
+#
+# Первый уровень — LRU в памяти процесса с ограничением по байтам.
+# Второй, необязательный, — каталог на диске, общий для всех
+# процессов сервера (например, запущенных через prefork): файл на
+# ключ, запись атомарная (временный файл + rename), время изменения
+# файла обновляется при чтении и служит для вытеснения старых.
+# ------------------------------------------------------
+
+
+class MemoryLRU:
+    """Тела ответов по ключу, не больше max_bytes в сумме."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, oldest = self._entries.popitem(last=False)
+                self._bytes -= len(oldest)
+                self.evicted += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "evicted": self.evicted}
+
+
+class DiskCache:
+    """
+    Каталог с телами ответов, общий для процессов. Размер проверяется
+    не при каждой записи, а когда этот процесс записал ещё десятую
+    часть max_bytes: тогда самые давно читанные файлы удаляются, пока
+    каталог не станет меньше 90% max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(("hits", "misses", "stored", "evicted",
+                                     "errors"), 0)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except OSError:
+            self._count("errors")
+            return None
+        self._count("hits")
+        return body
+
+    def put(self, key, body):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        except OSError:
+            self._count("errors")
+            return
+        self._count("stored")
+        with self._lock:
+            self._written += len(body)
+            if self._written < self.max_bytes // 10:
+                return
+            self._written = 0
+        self.trim()
+
+    def trim(self):
+        """Удаляет самые давно читанные файлы сверх 90% max_bytes."""
+        files = []
+        total = 0
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass   # уже удалил другой процесс
+            total -= size
+            self._count("evicted")
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {"directory": self.directory,
+                    "max_bytes": self.max_bytes, **self.counts}
+
+
+class ResultCache:
+    """Память процесса, за ней — общий каталог (если задан)."""
+
+    def __init__(self, max_bytes, directory=None, directory_max_bytes=0):
+        self.memory = MemoryLRU(max_bytes)
+        self.disk = (DiskCache(directory, directory_max_bytes)
+                     if directory else None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        body = self.memory.get(key)
+        if body is None and self.disk is not None:
+            body = self.disk.get(key)
+            if body is not None:
+                self.memory.put(key, body)
+        with self._lock:
+            if body is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return body
+
+    def put(self, key, body):
+        self.memory.put(key, body)
+        if self.disk is not None:
+            self.disk.put(key, body)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                **self.memory.stats(),
+            }
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
@@ -1,6 +1,18 @@
 import pytest
+import io
 import json
+import random
+import threading
+import tracemalloc
+from collections import Counter
+
+import batch
 from app import app, analyze_text
+from batch import balance_chunks
+from corpus import Corpus, FrequencyTable
+from heavy_hitters import SpaceSaving
+from result_cache import DiskCache, MemoryLRU, ResultCache
+from wordcount import WordCounter, count_words, iter_text, text_digest
 
 
 def test_word_count():
@@ -88,7 +100,417 @@ def test_analyze_endpoint_missing_text(client):
     assert response.status_code == 400
 
 
+@pytest.mark.parametrize("body", [
+    {"text": 123},
+    {"text": None},
+    {"text": ["слово"]},
+    ["text"],
+    "text",
+])
+def test_analyze_endpoint_text_not_string(client, body):
+    """Поле text не строкой — 400, как и у /corpus."""
+    response = client.post("/analyze", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Expected JSON with 'text' field"
+
+
 def test_bandit_security_check():
     """Дополнительный тест для проверки, что код безопасен."""
     # Этот тест будет "проходить" если bandit не найдёт уязвимостей
-    assert True  # Placeholder для bandit проверки
\ No newline at end of file
+    assert True  # Placeholder для bandit проверки
+
+SAMPLE = ("Привет, мир! Мир — это круто. ΟΔΟΣ и Straße; snake_case "
+          "слово123 ёжик Ёжик " * 20)
+
+
+def test_word_counter_matches_whole_text():
+    """Разрезание текста в любом месте не меняет результат."""
+    expected = analyze_text(SAMPLE)
+    for size in (1, 2, 3, 7, 50):
+        counter = WordCounter()
+        for start in range(0, len(SAMPLE), size):
+            counter.feed(SAMPLE[start:start + size])
+        assert counter.result() == expected
+
+
+def test_iter_text_splits_multibyte_chars():
+    """Кириллица, разрезанная посреди UTF-8 символа, декодируется."""
+    data = io.BytesIO(SAMPLE.encode("utf-8"))
+
+    class SmallReads:
+        def read(self, size):
+            return data.read(5)
+
+    counter = WordCounter()
+    for chunk in iter_text(SmallReads()):
+        counter.feed(chunk)
+    assert counter.result() == analyze_text(SAMPLE)
+
+
+class RepeatStream:
+    """Поток, отдающий text повторённым times раз, не держа всё в памяти."""
+
+    def __init__(self, text, times):
+        self.data = text.encode("utf-8")
+        self.left = times
+
+    def read(self, size):
+        if not self.left:
+            return b""
+        self.left -= 1
+        return self.data
+
+
+def test_streaming_memory_bounded_by_vocabulary():
+    """~4 МБ текста с небольшим словарём — пик памяти порядка куска."""
+    text = " ".join(f"слово{i % 500}" for i in range(8000)) + " "
+    stream = RepeatStream(text, 50)
+    tracemalloc.start()
+    counter = WordCounter()
+    for chunk in iter_text(stream):
+        counter.feed(chunk)
+    result = counter.result()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert result["word_count"] == 8000 * 50
+    assert result["most_frequent_words"][0][1] == 16 * 50
+    assert peak < 2 * 1024 * 1024
+
+
+def test_analyze_endpoint_plain_text_stream(client):
+    """text/plain читается потоком, результат как у JSON."""
+    response = client.post(
+        "/analyze",
+        data=SAMPLE.encode("utf-8"),
+        content_type="text/plain; charset=utf-8",
+    )
+    assert response.status_code == 200
+    assert json.loads(response.data) == analyze_text(SAMPLE)
+
+
+def test_analyze_endpoint_ndjson_stream(client):
+    """Слово, разрезанное между строками NDJSON, склеивается."""
+    lines = [json.dumps({"text": "Привет, м"}, ensure_ascii=False),
+             json.dumps({"text": "ир! Мир"}, ensure_ascii=False),
+             "",
+             json.dumps(" привет", ensure_ascii=False)]
+    response = client.post(
+        "/analyze",
+        data="\n".join(lines).encode("utf-8"),
+        content_type="application/x-ndjson",
+    )
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        "word_count": 4,
+        "most_frequent_words": [["привет", 2], ["мир", 2]],
+    }
+
+
+def test_analyze_endpoint_ndjson_invalid_line(client):
+    """Некорректная строка NDJSON — 400 с её номером."""
+    response = client.post(
+        "/analyze",
+        data=b'{"text": "ok"}\n{"text": 1}\n',
+        content_type="application/x-ndjson",
+    )
+    assert response.status_code == 400
+    assert "Строка 2" in json.loads(response.data)["error"]
+
+
+def test_balance_chunks_by_size():
+    """Куски примерно равны по суммарному размеру, документы не теряются."""
+    sizes = [100, 1, 50, 50, 30, 20, 2, 47]
+    chunks = balance_chunks(sizes, 3)
+    assert sorted(i for chunk in chunks for i in chunk) == list(range(8))
+    totals = [sum(sizes[i] for i in chunk) for chunk in chunks]
+    assert max(totals) - min(totals) <= 2
+    assert balance_chunks([5], 4) == [[0]]
+
+
+@pytest.fixture
+def batch_pool(monkeypatch):
+    """Пакеты любого размера уходят в пул из двух процессов."""
+    pool = batch.BatchPool(workers=2)
+    monkeypatch.setattr(batch, "pool", pool)
+    monkeypatch.setattr(batch, "BATCH_MIN_PARALLEL_CHARS", 0)
+    yield pool
+    pool.shutdown()
+
+
+def test_analyze_batch_endpoint(client, batch_pool):
+    """Результаты в порядке документов и совпадают с /analyze."""
+    texts = [SAMPLE * (i % 5 + 1) for i in range(12)] + ["", "один два два"]
+    documents = [{"id": f"doc{i}", "text": t} for i, t in enumerate(texts)]
+    documents[3] = texts[3]  # строка без id
+    response = client.post("/analyze/batch",
+                           json={"documents": documents, "top_k": 2})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+
+    assert data["count"] == len(texts)
+    for i, (text, result) in enumerate(zip(texts, data["results"])):
+        expected = analyze_text(text)
+        if i != 3:
+            expected = {"id": f"doc{i}", **expected}
+        assert result == expected
+
+    total = sum(analyze_text(t)["word_count"] for t in texts)
+    assert data["corpus"]["word_count"] == total
+    counts = Counter()
+    for text in texts:
+        counts.update(count_words(text).counts)
+    top = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:2]
+    assert data["corpus"]["most_frequent_words"] == [list(t) for t in top]
+
+    # Пул остаётся тем же между запросами
+    executor = batch_pool.executor()
+    client.post("/analyze/batch", json={"documents": texts})
+    assert batch_pool.executor() is executor
+
+
+def test_analyze_batch_endpoint_invalid(client):
+    """Без списка документов, с не-строкой или плохим top_k — 400."""
+    for body in ({"text": "x"}, {"documents": ["ok", 5]},
+                 {"documents": ["ok"], "top_k": 0}):
+        response = client.post("/analyze/batch", json=body)
+        assert response.status_code == 400
+
+
+def zipf_words(count, vocabulary, seed=1):
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, vocabulary + 1)]
+    return [f"w{i}" for i in rng.choices(range(vocabulary), weights,
+                                          k=count)]
+
+
+def test_space_saving_exact_when_vocabulary_fits():
+    """Пока слов не больше capacity, частоты точные, погрешность 0."""
+    words = zipf_words(5000, 200)
+    sketch = SpaceSaving(200)
+    sketch.update(words)
+    assert sketch.most_common(5) == Counter(words).most_common(5)
+    assert sketch.max_error() == 0
+
+
+def test_space_saving_error_bounds():
+    """Истинная частота — в [count - error, count]; частые слова не теряются."""
+    words = zipf_words(50000, 20000)
+    exact = Counter(words)
+    sketch = SpaceSaving(500)
+    for start in range(0, len(words), 1000):
+        sketch.update(words[start:start + 1000])
+
+    assert len(sketch) == 500
+    assert sketch.max_error() <= len(words) / 500
+    for word, count in sketch.most_common(500):
+        assert count - sketch.error(word) <= exact[word] <= count
+    for word, count in exact.items():
+        if count > len(words) / 500:
+            assert word in dict(sketch.most_common(500))
+
+    summary = sketch.summary(5)
+    assert summary["guaranteed"]
+    assert [w for w, _, _ in summary["bounds"]] == \
+        [w for w, _ in exact.most_common(5)]
+
+
+def test_analyze_endpoint_approximate(client):
+    """?approximate=1&k=N — топ с границами погрешности."""
+    text = " ".join(zipf_words(20000, 5000))
+    response = client.post("/analyze?approximate=1&capacity=300&k=4",
+                           data=text.encode(), content_type="text/plain")
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    exact = analyze_text(text, top_n=4)
+
+    assert data["word_count"] == exact["word_count"]
+    approximate = data["approximate"]
+    assert approximate["capacity"] == 300
+    assert approximate["guaranteed"]
+    assert [w for w, _ in data["most_frequent_words"]] == \
+        [w for w, _ in exact["most_frequent_words"]]
+    for (word, true_count), (_, low, high) in zip(
+            exact["most_frequent_words"], approximate["bounds"]):
+        assert low <= true_count <= high
+
+
+def test_analyze_endpoint_options_invalid(client):
+    """Некорректные k и capacity — 400."""
+    for query in ("k=0", "k=abc", "k=5&capacity=2"):
+        response = client.post(f"/analyze?{query}", json={"text": "a b"})
+        assert response.status_code == 400
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """Свой кэш на каждый тест, чтобы попадания не переходили между ними."""
+    fresh = ResultCache(2 ** 20)
+    monkeypatch.setattr("app.result_cache", fresh)
+    return fresh
+
+
+def test_text_digest_normalizes_case_only():
+    text = "Кошка " * 20000 + "ПёС"
+    assert text_digest(text, 3) == text_digest(text.upper(), 3)
+    assert text_digest(text, 3) != text_digest(text, 4)
+    assert text_digest("a b", 3) != text_digest("ab", 3)
+    assert text_digest("a-b", 3) != text_digest("a b", 3)
+
+
+def test_analyze_endpoint_cache(client, cache):
+    first = client.post("/analyze", json={"text": "Кот и кот, и пёс"})
+    again = client.post("/analyze", json={"text": "КОТ И КОТ, И ПЁС"})
+    other_k = client.post("/analyze?k=1", json={"text": "Кот и кот, и пёс"})
+    assert first.headers["X-Cache"] == "MISS"
+    assert again.headers["X-Cache"] == "HIT"
+    assert again.data == first.data
+    assert json.loads(again.data) == analyze_text("кот и кот, и пёс")
+    assert other_k.headers["X-Cache"] == "MISS"
+
+    # Потоковое тело в кэш не попадает
+    stream = client.post("/analyze", data="кот и кот",
+                         content_type="text/plain")
+    assert "X-Cache" not in stream.headers
+
+    stats = json.loads(client.get("/health").data)["cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["entries"] == 2
+
+
+def test_memory_lru_evicts_by_bytes():
+    lru = MemoryLRU(10)
+    lru.put("a", b"1234")
+    lru.put("b", b"1234")
+    lru.get("a")              # "b" становится самым старым
+    lru.put("c", b"1234")
+    lru.put("big", b"x" * 11)  # больше бюджета — не сохраняется
+    assert lru.get("b") is None
+    assert lru.get("a") == b"1234"
+    assert lru.get("big") is None
+    assert lru.stats()["bytes"] == 8
+    assert lru.stats()["evicted"] == 1
+
+
+def test_disk_cache_shared_and_trimmed(tmp_path):
+    # Два процесса сервера — два ResultCache над одним каталогом
+    first = ResultCache(2 ** 20, str(tmp_path), 10000)
+    second = ResultCache(2 ** 20, str(tmp_path), 10000)
+    first.put("ab" * 20, b"{}")
+    assert second.get("ab" * 20) == b"{}"
+    assert second.stats()["disk"]["hits"] == 1
+
+    disk = DiskCache(str(tmp_path), 10000)
+    for n in range(30):
+        disk.put(f"{n:040x}", b"x" * 1000)
+    disk.trim()
+    total = sum(f.stat().st_size for f in tmp_path.rglob("*") if f.is_file())
+    assert total <= 10000
+    assert disk.get(f"{29:040x}") is not None
+    assert disk.get(f"{0:040x}") is None
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_frequency_table_index_matches_recount():
+    rng = random.Random(3)
+    table = FrequencyTable(index_size=20)
+    exact = Counter()
+    for _ in range(300):
+        counts = Counter(zipf_words(rng.randint(1, 50), 200,
+                                    seed=rng.random()))
+        table.add(counts, sum(counts.values()))
+        exact.update(counts)
+        expected = sorted(exact.items(), key=lambda item: (-item[1], item[0]))
+        assert table.top(20) == [list(item) for item in expected[:20]]
+
+
+def test_corpus_windows():
+    clock = FakeClock(3600 * 10)
+    corpus = Corpus(window=600, bucket=60, clock=clock)
+    corpus.add(Counter({"старое": 5}), 5)
+    clock.now += 300
+    corpus.add(Counter({"новое": 2, "старое": 1}), 3)
+
+    assert corpus.top(5, "sliding")["most_frequent_words"] == [
+        ["старое", 6], ["новое", 2]]
+    # Первая корзина выходит из скользящего окна, период сменился
+    clock.now += 400
+    sliding = corpus.top(5, "sliding")
+    assert sliding["most_frequent_words"] == [["новое", 2], ["старое", 1]]
+    assert sliding["documents"] == 1
+    assert corpus.top(5, "tumbling")["most_frequent_words"] == []
+    assert corpus.top(5, "previous")["word_count"] == 8
+    assert corpus.top(5, "all")["most_frequent_words"] == [
+        ["старое", 6], ["новое", 2]]
+    with pytest.raises(ValueError):
+        corpus.top(5, "weekly")
+
+
+def test_corpus_snapshot_restores_counts(tmp_path):
+    path = str(tmp_path / "corpus.json")
+    clock = FakeClock(1000.0)
+    corpus = Corpus(window=600, bucket=60, snapshot_path=path, clock=clock)
+    corpus.add(Counter({"кот": 3, "пёс": 1}), 4)
+    corpus.close()
+
+    restored = Corpus(window=600, bucket=60, snapshot_path=path, clock=clock)
+    for window in ("all", "sliding", "tumbling"):
+        assert restored.top(2, window) == corpus.top(2, window)
+
+
+def test_corpus_save_serializes_outside_lock(tmp_path, monkeypatch):
+    """Пока снимок пишется в JSON, add не ждёт."""
+    path = str(tmp_path / "corpus.json")
+    corpus = Corpus(window=600, bucket=60, snapshot_path=path,
+                    snapshot_interval=3600, clock=lambda: 1000.0)
+    corpus.add(Counter({"кот": 1}), 1)
+    started, release = threading.Event(), threading.Event()
+    dumps = json.dumps
+
+    def slow_dumps(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return dumps(*args, **kwargs)
+
+    monkeypatch.setattr("corpus.json.dumps", slow_dumps)
+    saver = threading.Thread(target=corpus.save)
+    saver.start()
+    assert started.wait(5)
+    assert corpus.add(Counter({"пёс": 1}), 1) == 2
+    release.set()
+    saver.join()
+    monkeypatch.undo()
+
+    # В снимке — состояние на момент копирования, следующий save
+    # допишет добавленное после
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["all"]["counts"] == {"кот": 1}
+    corpus.close()
+    restored = Corpus(window=600, bucket=60, snapshot_path=path,
+                      clock=lambda: 1000.0)
+    assert restored.top(2)["documents"] == 2
+
+
+def test_corpus_endpoints(client, monkeypatch):
+    monkeypatch.setattr("app.corpus", Corpus(window=600, bucket=60))
+    first = client.post("/corpus", json={"text": "Кот и пёс"})
+    assert json.loads(first.data)["corpus_documents"] == 1
+    second = client.post("/corpus", data="кот, кот",
+                         content_type="text/plain")
+    assert json.loads(second.data)["corpus_documents"] == 2
+
+    top = json.loads(client.get("/corpus/top?k=2&window=sliding").data)
+    assert top["most_frequent_words"] == [["кот", 3], ["и", 1]]
+    assert top["word_count"] == 5
+
+    assert client.post("/corpus", json={"text": 1}).status_code == 400
+    assert client.get("/corpus/top?k=0").status_code == 400
+    assert client.get("/corpus/top?window=year").status_code == 400
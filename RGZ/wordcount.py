@@ -0,0 +1,137 @@
+import codecs
+import hashlib
+import json
+import re
+from collections import Counter
+
+from heavy_hitters import SpaceSaving
+
+# Слово — последовательность символов \w (как r'\b\w+\b' в analyze_text)
+WORD_RE = re.compile(r'\w+')
+
+# Сколько байт читать из потока за раз и сколько символов
+# строки разбирать за раз
+CHUNK_SIZE = 64 * 1024
+
+# Сколько самых частых слов возвращать
+TOP_N = 3
+
+
+def _is_word_char(char: str) -> bool:
+    # То же множество символов, что \w в re для str
+    return char.isalnum() or char == '_'
+
+
+def _word_boundary(text: str) -> int:
+    """Начало незаконченного слова в конце text (len(text), если его нет)."""
+    cut = len(text)
+    while cut and _is_word_char(text[cut - 1]):
+        cut -= 1
+    return cut
+
+
+class WordCounter:
+    """
+    Инкрементальный подсчёт слов:
+    - текст подаётся кусками через feed(), в любом месте разрезанный;
+    - незаконченное слово в конце куска откладывается и склеивается
+      с началом следующего;
+    - в памяти только частоты слов и один кусок, а не весь текст;
+      с capacity частоты приблизительные (SpaceSaving), и память
+      не зависит даже от размера словаря.
+    """
+
+    def __init__(self, capacity: int = None):
+        self.counts = SpaceSaving(capacity) if capacity else Counter()
+        self.word_count = 0
+        self._tail = ''
+
+    def feed(self, chunk: str):
+        text = self._tail + chunk
+        cut = _word_boundary(text)
+        self._tail = text[cut:]
+        self._count(text[:cut])
+
+    def _count(self, text: str):
+        # Кусок кончается не на букве, поэтому регистр понижается так же,
+        # как для всего текста целиком
+        words = WORD_RE.findall(text.lower())
+        self.word_count += len(words)
+        self.counts.update(words)
+
+    def result(self, top_n: int = TOP_N) -> dict:
+        """Итог в формате analyze_text; отложенное слово засчитывается."""
+        if self._tail:
+            self._count(self._tail)
+            self._tail = ''
+        result = {
+            "word_count": self.word_count,
+            "most_frequent_words": [
+                [word, count] for word, count in self.counts.most_common(top_n)
+            ],
+        }
+        if isinstance(self.counts, SpaceSaving):
+            result["approximate"] = self.counts.summary(top_n)
+        return result
+
+
+def count_words(text: str, capacity: int = None) -> WordCounter:
+    """WordCounter по готовой строке, разобранной кусками."""
+    counter = WordCounter(capacity)
+    for start in range(0, len(text or ''), CHUNK_SIZE):
+        counter.feed(text[start:start + CHUNK_SIZE])
+    return counter
+
+
+def text_digest(text: str, *params) -> str:
+    """
+    Ключ кэша результатов: blake2b от текста в том виде, в каком его
+    разбирает WordCounter (куски до границы слова в нижнем регистре),
+    и параметров. Тексты, различающиеся только регистром, получают
+    один ключ, а тексты с разным результатом — никогда.
+    """
+    digest = hashlib.blake2b(repr(params).encode(), digest_size=20)
+    tail = ''
+    for start in range(0, len(text), CHUNK_SIZE):
+        piece = tail + text[start:start + CHUNK_SIZE]
+        cut = _word_boundary(piece)
+        tail = piece[cut:]
+        digest.update(piece[:cut].lower().encode('utf-8', 'surrogatepass'))
+    digest.update(tail.lower().encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def iter_text(stream, encoding: str = 'utf-8'):
+    """
+    Куски текста из бинарного потока; многобайтный символ,
+    разрезанный границей чтения, декодируется целиком.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_ndjson(stream, encoding: str = 'utf-8'):
+    """
+    Куски текста из NDJSON: каждая непустая строка — {"text": "..."}
+    или JSON-строка. Куски — подряд идущие части одного текста.
+    ValueError с номером строки, если строка некорректна.
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line.decode(encoding))
+        except ValueError as exc:
+            raise ValueError(f'Строка {number}: некорректный JSON ({exc})')
+        if isinstance(record, dict):
+            record = record.get('text')
+        if not isinstance(record, str):
+            raise ValueError(f"Строка {number}: ожидалось поле 'text' "
+                             f"со строкой")
+        yield record
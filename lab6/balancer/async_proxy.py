@@ -0,0 +1,487 @@
+"""
+Асинхронный движок проксирования для балансировщика.
+
+Данные идут через asyncio: одно событийное ядро держит тысячи
+одновременных запросов без потока на каждый. Выбор инстанса,
+стратегии, предохранители, проверки /health и ключи хеширования —
+общие с balancer.py (тот же модуль, те же объекты), так что всё,
+что меняется через web UI, сразу действует и здесь.
+
+Запуск: python async_proxy.py — web UI (Flask) на BALANCER_UI_PORT,
+прокси на BALANCER_ASYNC_PORT. Кэш ответов и хеджирование остаются
+в пути Flask; здесь — повтор на другом инстансе после ошибки
+соединения (из того же бюджета повторов).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from flask import jsonify
+from werkzeug.serving import make_server
+
+import balancer
+from proxy import CHUNK_SIZE, HOP_BY_HOP, forwarded_headers
+
+ASYNC_HOST = os.getenv("BALANCER_ASYNC_HOST", "127.0.0.1")
+ASYNC_PORT = int(os.getenv("BALANCER_ASYNC_PORT", "8000"))
+UI_PORT = int(os.getenv("BALANCER_UI_PORT", "5000"))
+
+# Свободных keep-alive соединений на инстанс; занятых — сколько нужно
+ASYNC_POOL_IDLE = int(os.getenv("BALANCER_ASYNC_POOL_IDLE", "256"))
+# Очередь неразобранных подключений (listen backlog)
+ASYNC_BACKLOG = int(os.getenv("BALANCER_ASYNC_BACKLOG", "4096"))
+
+# Предел размера строки запроса с заголовками
+HEAD_LIMIT = 64 * 1024
+
+# Ошибки соединения и разбора ответа (таймауты — тоже OSError,
+# обрыв посреди readuntil — EOFError)
+UPSTREAM_ERRORS = (
+    OSError, EOFError, ValueError, asyncio.LimitOverrunError,
+)
+
+REASONS = {
+    400: "Bad Request", 431: "Request Header Fields Too Large",
+    502: "Bad Gateway", 503: "Service Unavailable",
+}
+
+
+class Headers(dict):
+    """Заголовки с поиском без учёта регистра (ключи — в нижнем)."""
+
+    def __init__(self, pairs):
+        super().__init__((name.lower(), value) for name, value in pairs)
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+def parse_head(block):
+    """Стартовая строка и заголовки (список пар) из блока до \\r\\n\\r\\n."""
+    lines = block.decode("latin-1").split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise ValueError(f"Некорректный заголовок: {line!r}")
+        headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def render_head(start_line, headers):
+    lines = [start_line] + [f"{name}: {value}" for name, value in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+# ------------------------------------------------------
+# Пересылка тел
+# ------------------------------------------------------
+
+class WriteError(ConnectionError):
+    """Не удалось отправить данные принимающей стороне."""
+
+
+async def _drain(writer):
+    try:
+        await writer.drain()
+    except OSError as e:
+        raise WriteError(str(e)) from e
+
+
+async def _read(reader, size, timeout):
+    data = await asyncio.wait_for(reader.read(size), timeout)
+    if not data:
+        raise EOFError("соединение закрыто посреди тела")
+    return data
+
+
+async def relay_body(reader, writer, length=0, chunked=False,
+                     until_eof=False, timeout=None):
+    """
+    Пересылает тело из reader в writer кусками, не собирая его
+    в памяти: по Content-Length, chunked (как есть, с разметкой)
+    или до закрытия соединения. Ошибка записи в writer — WriteError,
+    так что её можно отличить от ошибки чтения из reader.
+    """
+    if chunked:
+        while True:
+            line = await asyncio.wait_for(reader.readuntil(b"\r\n"), timeout)
+            writer.write(line)
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                # Трейлеры — до пустой строки
+                while line != b"\r\n":
+                    line = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n"), timeout
+                    )
+                    writer.write(line)
+                break
+            remaining = size + 2
+            while remaining:
+                data = await _read(reader, min(CHUNK_SIZE, remaining), timeout)
+                writer.write(data)
+                remaining -= len(data)
+                await _drain(writer)
+    elif until_eof:
+        while True:
+            data = await asyncio.wait_for(reader.read(CHUNK_SIZE), timeout)
+            if not data:
+                break
+            writer.write(data)
+            await _drain(writer)
+    else:
+        remaining = length
+        while remaining:
+            data = await _read(reader, min(CHUNK_SIZE, remaining), timeout)
+            writer.write(data)
+            remaining -= len(data)
+            await _drain(writer)
+    await _drain(writer)
+
+
+# ------------------------------------------------------
+# Пул соединений к инстансам
+# ------------------------------------------------------
+
+class AsyncPool:
+    """Keep-alive соединения asyncio к одному инстансу."""
+
+    def __init__(self, url, max_idle, idle_timeout, timeout):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.netloc = parts.netloc
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = deque()  # (reader, writer, время возврата)
+        self.closed = False
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    async def acquire(self):
+        """(reader, writer, было ли соединение переиспользовано)."""
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, returned = self._idle.pop()
+            if (now - returned > self.idle_timeout or reader.at_eof()
+                    or writer.is_closing()):
+                writer.close()
+                self.discarded += 1
+                continue
+            self.in_use += 1
+            self.reused += 1
+            return reader, writer, True
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=HEAD_LIMIT),
+            self.timeout,
+        )
+        self.in_use += 1
+        self.created += 1
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable):
+        self.in_use -= 1
+        if (reusable and not self.closed
+                and len(self._idle) < self.max_idle
+                and self.url in balancer.instance_status):
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+            self.discarded += 1
+
+    def close(self):
+        """Закрывает свободные соединения; занятые закроются в release."""
+        self.closed = True
+        while self._idle:
+            _, writer, _ = self._idle.pop()
+            writer.close()
+            self.discarded += 1
+
+    def stats(self):
+        return {
+            "in_use": self.in_use,
+            "idle": len(self._idle),
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+        }
+
+
+pools = {}
+# Цикл событий прокси (задаётся в serve): пулы закрываются в нём
+loop = None
+
+
+def get_pool(url):
+    pool = pools.get(url)
+    if pool is None:
+        pool = pools[url] = AsyncPool(
+            url, ASYNC_POOL_IDLE, balancer.POOL_IDLE_TIMEOUT,
+            balancer.BACKEND_TIMEOUT,
+        )
+    return pool
+
+
+def remove_pool(url):
+    """
+    Забывает и закрывает пул удалённого инстанса. Вызывается из потока
+    web UI, а соединения asyncio закрываются только в своём цикле.
+    """
+    pool = pools.pop(url, None)
+    if pool is None:
+        return
+    if loop is not None and loop.is_running():
+        loop.call_soon_threadsafe(pool.close)
+    else:
+        pool.close()
+
+
+balancer.unregister_callbacks.append(remove_pool)
+
+
+# ------------------------------------------------------
+# Обработка запроса
+# ------------------------------------------------------
+
+async def send_error(writer, status, message, keep_alive):
+    body = json.dumps({"error": message}, ensure_ascii=False).encode()
+    writer.write(render_head(
+        f"HTTP/1.1 {status} {REASONS[status]}",
+        [("Content-Type", "application/json"),
+         ("Content-Length", str(len(body))),
+         ("Connection", "keep-alive" if keep_alive else "close")],
+    ) + body)
+    await writer.drain()
+
+
+async def exchange(pool, method, target, headers, body_reader, length,
+                   chunked):
+    """
+    Отправляет запрос инстансу и читает заголовки ответа.
+    Возвращает (reader, writer, стартовая строка, заголовки).
+    Запрос без тела на переиспользованном соединении, которое инстанс
+    успел закрыть, повторяется на новом.
+    """
+    framing = []
+    if chunked:
+        framing = [("Transfer-Encoding", "chunked")]
+    elif length is not None:
+        framing = [("Content-Length", str(length))]
+    head = render_head(
+        f"{method} {target} HTTP/1.1",
+        [("Host", pool.netloc)] + headers + framing,
+    )
+    while True:
+        reader, writer, reused = await pool.acquire()
+        try:
+            writer.write(head)
+            if chunked or length:
+                await relay_body(body_reader, writer, length or 0, chunked,
+                                 timeout=pool.timeout)
+            await writer.drain()
+            block = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), pool.timeout
+            )
+            status_line, response_headers = parse_head(block)
+            return reader, writer, status_line, response_headers
+        except UPSTREAM_ERRORS:
+            pool.release(reader, writer, reusable=False)
+            if reused and not length and not chunked:
+                continue
+            raise
+
+
+async def serve_request(reader, writer, method, target, version, headers,
+                        client_ip):
+    """Проксирует один запрос; возвращает, держать ли соединение."""
+    route = balancer.route_label(target.partition("?")[0])
+    start = time.perf_counter()
+    balancer.route_started(route)
+    status = 500
+    try:
+        keep_alive, status = await _serve_request(
+            reader, writer, method, target, version, headers, client_ip
+        )
+        return keep_alive
+    finally:
+        balancer.route_finished(route, method, status, start)
+
+
+async def _serve_request(reader, writer, method, target, version, headers,
+                         client_ip):
+    """Возвращает (держать ли соединение, код ответа клиенту)."""
+    request_headers = Headers(headers)
+    connection = request_headers.get("connection", "").lower()
+    keep_alive = (
+        "close" not in connection if version == "HTTP/1.1"
+        else "keep-alive" in connection
+    )
+    chunked = (
+        request_headers.get("transfer-encoding", "").lower() == "chunked"
+    )
+    length = request_headers.get("content-length")
+    if length is not None and not chunked:
+        if not (length.isascii() and length.isdigit()):
+            # Где кончается тело, неизвестно — соединение закрывается
+            await send_error(writer, 400, "Некорректный Content-Length",
+                             False)
+            return False, 400
+        length = int(length)
+    else:
+        length = None
+    has_body = chunked or bool(length)
+    idempotent = (
+        method in balancer.IDEMPOTENT_METHODS and not has_body
+    )
+
+    path, _, query = target.partition("?")
+    key = balancer.request_key(path, request_headers, query)
+    forwarded = forwarded_headers(
+        headers, client_ip, request_headers.get("host", "")
+    )
+
+    if idempotent:
+        balancer.retry_budget.deposit()
+
+    tried = []
+    while True:
+        inst = balancer.get_next_instance(exclude=tried, key=key)
+        if inst is None:
+            # Тело запроса не прочитано — соединение не переиспользовать
+            await send_error(writer, 503, "Нет доступных инстансов",
+                             keep_alive and not has_body)
+            return keep_alive and not has_body, 503
+
+        tried.append(inst)
+        pool = get_pool(inst)
+        start = time.perf_counter()
+        try:
+            up_reader, up_writer, status_line, response_headers = \
+                await exchange(pool, method, target, forwarded, reader,
+                               length, chunked)
+            break
+        except UPSTREAM_ERRORS:
+            balancer.finish_request(inst, start, False)
+            # Жетон на повтор берётся, только если есть другой инстанс
+            if (idempotent and balancer.available_instances(exclude=tried)
+                    and balancer.retry_budget.withdraw()):
+                balancer.hedge_stats.add("retries")
+                continue
+            await send_error(writer, 502, f"Ошибка соединения с {inst}",
+                             keep_alive and not has_body)
+            return keep_alive and not has_body, 502
+
+    if len(tried) > 1:
+        balancer.hedge_stats.add("retry_wins")
+
+    _, status, reason = (status_line.split(" ", 2) + [""])[:3]
+    status = int(status)
+    upstream = Headers(response_headers)
+    no_body = method == "HEAD" or status in (204, 304) or status < 200
+    up_chunked = (
+        "chunked" in upstream.get("transfer-encoding", "").lower()
+    )
+    up_length = upstream.get("content-length")
+    until_eof = not no_body and not up_chunked and up_length is None
+    reusable = (
+        "close" not in upstream.get("connection", "").lower()
+        and status_line.startswith("HTTP/1.1") and not until_eof
+    )
+    keep_alive = keep_alive and not until_eof
+
+    out = [(name, value) for name, value in response_headers
+           if name.lower() not in HOP_BY_HOP]
+    if up_chunked and not no_body:
+        out.append(("Transfer-Encoding", "chunked"))
+    out.append(("X-Routed-To", inst))
+    out.append(("Connection", "keep-alive" if keep_alive else "close"))
+
+    # True — ответ передан целиком, False — ошибка чтения из инстанса,
+    # None — клиент ушёл (ошибка записи ему): инстанс не виноват
+    outcome = False
+    try:
+        writer.write(render_head(f"HTTP/1.1 {status} {reason}", out))
+        if not no_body:
+            await relay_body(
+                up_reader, writer, int(up_length or 0), up_chunked,
+                until_eof, timeout=pool.timeout,
+            )
+        await _drain(writer)
+        outcome = True
+    except WriteError:
+        outcome = None
+        raise
+    finally:
+        pool.release(up_reader, up_writer, reusable and outcome is True)
+        balancer.finish_request(inst, start, status < 500 and outcome)
+    return keep_alive, status
+
+
+async def handle_client(reader, writer):
+    peer = writer.get_extra_info("peername")
+    client_ip = peer[0] if peer else ""
+    try:
+        while True:
+            try:
+                block = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.IncompleteReadError:
+                break
+            except asyncio.LimitOverrunError:
+                await send_error(writer, 431, "Слишком длинные заголовки",
+                                 False)
+                break
+            try:
+                request_line, headers = parse_head(block)
+                method, target, version = request_line.split(" ", 2)
+            except ValueError:
+                await send_error(writer, 400, "Некорректный запрос", False)
+                break
+            if not await serve_request(reader, writer, method, target,
+                                       version, headers, client_ip):
+                break
+    except UPSTREAM_ERRORS:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host=ASYNC_HOST, port=ASYNC_PORT, ready=None):
+    """Запускает прокси; ready() вызывается, когда порт открыт."""
+    global loop
+    loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(
+        handle_client, host, port, limit=HEAD_LIMIT, backlog=ASYNC_BACKLOG,
+    )
+    if ready is not None:
+        ready()
+    async with server:
+        await server.serve_forever()
+
+
+def pool_stats():
+    return {url: pool.stats() for url, pool in list(pools.items())}
+
+
+@balancer.app.route("/async_pool_stats")
+def async_pool_stats():
+    """Состояние пулов asyncio-движка."""
+    return jsonify(pool_stats())
+
+
+if __name__ == "__main__":
+    ui = make_server("127.0.0.1", UI_PORT, balancer.app, threaded=True)
+    threading.Thread(target=ui.serve_forever, daemon=True).start()
+    print(f"Web UI: http://127.0.0.1:{UI_PORT}")
+    print(f"Асинхронный прокси: http://{ASYNC_HOST}:{ASYNC_PORT}")
+    asyncio.run(serve())
@@ -1,13 +1,111 @@
 from flask import (
-    Flask, request, jsonify, redirect,
-    url_for, render_template_string
+    Flask, Response, request, jsonify, redirect,
+    url_for, render_template_string, make_response
 )
-import requests
-import threading
+import json
+import os
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cache import CacheEntry, ResponseCache, parse_route_ttls
+from hashing import make_key_extractor
+from health import CircuitBreakers, HealthChecker
+from hedging import HedgeStats, LatencyWindow, RetryBudget
+from metrics import Metrics
+from pool import PoolManager, PoolTimeout
+from proxy import (
+    UpstreamBody, forwarded_headers, open_upstream, response_headers
+)
+from strategies import STRATEGIES, BackendStats, make_strategy
 
 app = Flask(__name__)
 
+# Пулы keep-alive соединений к инстансам: не больше POOL_SIZE
+# соединений на инстанс, свободные закрываются через POOL_IDLE_TIMEOUT с
+POOL_SIZE = int(os.getenv("BALANCER_POOL_SIZE", "10"))
+POOL_IDLE_TIMEOUT = float(os.getenv("BALANCER_POOL_IDLE_TIMEOUT", "30"))
+BACKEND_TIMEOUT = float(os.getenv("BALANCER_BACKEND_TIMEOUT", "2"))
+# Задержка, с которой в peak-EWMA учитывается отказ инстанса: быстрый
+# отказ не должен делать инстанс «быстрым» и привлекать к нему запросы
+FAILURE_PENALTY = float(
+    os.getenv("BALANCER_FAILURE_PENALTY", str(BACKEND_TIMEOUT))
+)
+
+# Отладочный режим: ответ инстанса читается целиком и оборачивается
+# в JSON {"balancer", "routed_to", "status", "instance_response"}.
+# По умолчанию запрос и ответ передаются прозрачно и потоком.
+ENVELOPE = os.getenv("BALANCER_ENVELOPE", "0") == "1"
+
+# Кэш ответов на GET (только в прозрачном режиме, без конверта):
+# не больше CACHE_MAX_BYTES байт тел, ответы крупнее
+# CACHE_MAX_ENTRY_BYTES не кэшируются. Время жизни — max-age из
+# Cache-Control ответа, иначе TTL из CACHE_ROUTES (префикс=секунды
+# через запятую), иначе CACHE_TTL.
+CACHE = os.getenv("BALANCER_CACHE", "0") == "1"
+CACHE_MAX_BYTES = int(os.getenv("BALANCER_CACHE_MAX_BYTES", "67108864"))
+CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("BALANCER_CACHE_MAX_ENTRY_BYTES", "1048576")
+)
+CACHE_TTL = float(os.getenv("BALANCER_CACHE_TTL", "0"))
+CACHE_ROUTES = parse_route_ttls(
+    os.getenv("BALANCER_CACHE_ROUTES", "/health=1")
+)
+
+# Маршруты (первый сегмент пути), которые получают свою метку route
+# в метриках; остальные пути считаются под route="other", чтобы
+# случайные URL не плодили временные ряды
+METRIC_ROUTES = frozenset(
+    route.strip() for route in
+    os.getenv("BALANCER_METRIC_ROUTES", "/process,/health").split(",")
+    if route.strip()
+)
+
+# Методы, которые балансировщик передаёт инстансам
+PROXY_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+# Методы, запрос которых (без тела) можно отправить дважды
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Хеджирование идемпотентных запросов: если инстанс не ответил за
+# HEDGE_PERCENTILE-й перцентиль времени ответа (но не раньше
+# HEDGE_MIN_DELAY с), запрос дублируется на другой инстанс.
+# Хеджи и повторы после ошибок соединения берут жетоны из общего
+# бюджета: RETRY_BUDGET_RATIO жетона с каждого запроса плюс
+# RETRY_BUDGET_MIN_PER_SECOND жетонов в секунду.
+# По умолчанию выключено: дубли добавляют нагрузку на инстансы,
+# включается явно через BALANCER_HEDGING=1.
+HEDGING = os.getenv("BALANCER_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("BALANCER_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("BALANCER_HEDGE_MIN_DELAY", "0.005"))
+RETRY_BUDGET_RATIO = float(os.getenv("BALANCER_RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(
+    os.getenv("BALANCER_RETRY_BUDGET_MIN_PER_SECOND", "10")
+)
+# Потоки, в которых идут попытки идемпотентных запросов
+UPSTREAM_WORKERS = int(os.getenv("BALANCER_UPSTREAM_WORKERS", "256"))
+
+# Стратегия балансировки при старте; меняется на лету через UI или
+# POST /strategy: round_robin | weighted_round_robin |
+# least_outstanding | peak_ewma | p2c | consistent_hash | rendezvous
+STRATEGY = os.getenv("BALANCER_STRATEGY", "round_robin")
+
+# Ключ запроса для consistent_hash и rendezvous: path, path:N
+# (N-й сегмент пути), header:Имя или query:имя
+HASH_KEY = os.getenv("BALANCER_HASH_KEY", "path")
+
+# Активные проверки /health: раз в HEALTH_INTERVAL с, не больше
+# HEALTH_PARALLELISM одновременно, каждая ждёт HEALTH_TIMEOUT с
+HEALTH_INTERVAL = float(os.getenv("BALANCER_HEALTH_INTERVAL", "5"))
+HEALTH_TIMEOUT = float(os.getenv("BALANCER_HEALTH_TIMEOUT", "1"))
+HEALTH_PARALLELISM = int(os.getenv("BALANCER_HEALTH_PARALLELISM", "16"))
+
+# Предохранитель: после BREAKER_THRESHOLD отказов подряд инстанс
+# выводится из ротации на BREAKER_BACKOFF с, удваивая время при
+# каждом неудачном пробном запросе (но не больше BREAKER_MAX_BACKOFF)
+BREAKER_THRESHOLD = int(os.getenv("BALANCER_BREAKER_THRESHOLD", "3"))
+BREAKER_BACKOFF = float(os.getenv("BALANCER_BREAKER_BACKOFF", "1"))
+BREAKER_MAX_BACKOFF = float(os.getenv("BALANCER_BREAKER_MAX_BACKOFF", "30"))
+
 # Список всех инстансов (что мы добавили в пул)
 instances = [
     "http://127.0.0.1:5001",
@@ -18,52 +116,462 @@ instances = [
 # Состояние инстансов: True - доступен, False - недоступен
 instance_status = {url: True for url in instances}
 
-# Индекс для алгоритма Round Robin
-current_index = 0
+# Веса инстансов для weighted_round_robin
+instance_weights = {url: 1 for url in instances}
 
+# Незавершённые запросы и задержки инстансов — для стратегий
+backend_stats = BackendStats()
+strategy = make_strategy(STRATEGY, instance_weights)
+request_key = make_key_extractor(HASH_KEY)
 
-def health_check():
-    """
-    Фоновая проверка состояния всех инстансов каждые 5 секунд.
-    
-    
-    """
-    while True:
-        for inst in list(instances):
-            try:
-                resp = requests.get(f"{inst}/health", timeout=1)
-                instance_status[inst] = (resp.status_code == 200)
-            except Exception:
-                instance_status[inst] = False   
+breakers = CircuitBreakers(
+    threshold=BREAKER_THRESHOLD,
+    backoff=BREAKER_BACKOFF,
+    max_backoff=BREAKER_MAX_BACKOFF,
+    trial_timeout=BACKEND_TIMEOUT,
+)
 
-        time.sleep(5)
+pools = PoolManager(POOL_SIZE, POOL_IDLE_TIMEOUT, BACKEND_TIMEOUT)
+for url in instances:
+    pools.add(url)
+
+# Время ответа инстансов (до заголовков) — для hedge-задержки
+upstream_latency = LatencyWindow()
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND)
+hedge_stats = HedgeStats()
+
+# Счётчики и гистограммы для /metrics (запись без замков)
+metrics = Metrics()
+metrics.describe("balancer_requests_total", "counter",
+                 "Запросы клиентов по маршруту, методу и коду ответа")
+metrics.describe("balancer_requests_in_flight", "gauge",
+                 "Запросы клиентов в обработке по маршруту")
+metrics.describe("balancer_request_duration_seconds", "histogram",
+                 "Время ответа клиенту по маршруту (в пути Flask — "
+                 "до заголовков, в asyncio — до конца тела)")
+metrics.describe("balancer_backend_requests_total", "counter",
+                 "Запросы к инстансам: outcome=ok|error")
+metrics.describe("balancer_backend_request_duration_seconds", "histogram",
+                 "Время запроса к инстансу")
+metrics.describe("balancer_backend_in_flight", "gauge",
+                 "Незавершённые запросы к инстансу")
+metrics.describe("balancer_backend_up", "gauge",
+                 "1 — инстанс в ротации (health и предохранитель)")
+metrics.describe("balancer_hedging_events_total", "counter",
+                 "Хеджи и повторы: отправлено, выиграло, нет бюджета")
+metrics.describe("balancer_cache_events_total", "counter",
+                 "Кэш ответов: попадания, промахи, схлопывания и т. д.")
+
+response_cache = ResponseCache(
+    max_bytes=CACHE_MAX_BYTES,
+    max_entry_bytes=CACHE_MAX_ENTRY_BYTES,
+    default_ttl=CACHE_TTL,
+    route_ttls=CACHE_ROUTES,
+    wait_timeout=BACKEND_TIMEOUT * 2,
+) if CACHE and not ENVELOPE else None
+upstream_executor = ThreadPoolExecutor(
+    max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream"
+)
 
 
+def register_instance(url, weight=1):
+    """Добавляет инстанс в пул балансировщика."""
+    instance_weights[url] = weight
+    if url in instances:
+        return
+    instances.append(url)
+    # По умолчанию считаем, что он недоступен,
+    # пока health_check не проверит.
+    instance_status[url] = False
+    pools.add(url)
+
+
+# Вызываются с URL удалённого инстанса — так другие движки
+# (async_proxy) закрывают свои соединения к нему
+unregister_callbacks = []
+
+
+def unregister_instance(url):
+    """Убирает инстанс и закрывает его соединения."""
+    if url in instances:
+        instances.remove(url)
+    instance_status.pop(url, None)
+    instance_weights.pop(url, None)
+    backend_stats.forget(url)
+    breakers.forget(url)
+    pools.remove(url)
+    for callback in unregister_callbacks:
+        callback(url)
+
+
+def set_strategy(name, hash_key=None):
+    """
+    Переключает стратегию балансировки и, если задан, ключ запроса
+    для хеширования; ValueError для неизвестных.
+    """
+    global strategy, request_key, HASH_KEY
+    new_strategy = make_strategy(name, instance_weights)
+    if hash_key:
+        request_key = make_key_extractor(hash_key)
+        HASH_KEY = hash_key
+    strategy = new_strategy
+
+
+def set_health(url, ok):
+    """Результат активной проверки; удалённый инстанс не возвращается."""
+    if url in instance_status:
+        instance_status[url] = ok
+
+
+health_checker = HealthChecker(
+    lambda: list(instances),
+    set_health,
+    interval=HEALTH_INTERVAL,
+    timeout=HEALTH_TIMEOUT,
+    parallelism=HEALTH_PARALLELISM,
+)
 # Запускаем health-check в отдельном потоке
-thread = threading.Thread(target=health_check, daemon=True)
-thread.start()
+health_checker.start()
+
+
+def available_instances(exclude=()):
+    """
+    ДОСТУПНЫЕ инстансы: прошли последнюю проверку /health, не выведены
+    из ротации предохранителем и не входят в exclude (туда запрос
+    уже отправлен).
+    """
+    return [inst for inst in list(instances)
+            if inst not in exclude and instance_status.get(inst)
+            and breakers.available(inst)]
 
 
-def get_next_instance():
+def get_next_instance(exclude=(), key=None, candidates=None):
     """
-    Алгоритм Round Robin:
-    выбираем следующий ДОСТУПНЫЙ инстанс по кругу.
+    Выбираем доступный инстанс текущей стратегией и отмечаем начало
+    запроса к нему — после ответа нужно вызвать finish_request().
+    candidates — уже найденные available_instances(exclude).
+    key — ключ запроса для стратегий с привязкой.
     Если доступных нет — вернём None.
     """
-    global current_index
+    if candidates is None:
+        candidates = available_instances(exclude)
+    if not candidates:
+        return None
+
+    inst = backend_stats.acquire(strategy, candidates, key)
+    breakers.on_start(inst)
+    return inst
+
+
+OUTCOMES = {True: "ok", False: "error", None: "aborted"}
 
-    if not instances:
+
+def finish_request(inst, start, ok):
+    """
+    Учитывает запрос к инстансу в статистике, метриках, предохранителе.
+    ok=None — запрос прерван не по вине инстанса (клиент ушёл, не
+    дочитав ответ, или в пуле балансировщика не нашлось соединения):
+    предохранитель его не учитывает.
+    """
+    latency = time.perf_counter() - start
+    backend_stats.release(
+        inst, max(latency, FAILURE_PENALTY) if ok is False else latency
+    )
+    backend = (("backend", inst),)
+    metrics.inc("balancer_backend_requests_total",
+                backend + (("outcome", OUTCOMES[ok]),))
+    metrics.observe("balancer_backend_request_duration_seconds", backend,
+                    latency)
+    if ok is None:
+        breakers.on_cancel(inst)
+    elif ok:
+        breakers.record_success(inst)
+    else:
+        breakers.record_failure(inst)
+
+
+def hedge_delay():
+    """Через сколько секунд дублировать запрос; None — не дублировать."""
+    if not HEDGING:
         return None
+    delay = upstream_latency.percentile(HEDGE_PERCENTILE / 100)
+    return None if delay is None else max(HEDGE_MIN_DELAY, delay)
+
+
+def hedging_snapshot():
+    delay = hedge_delay()
+    return {
+        "enabled": HEDGING,
+        "delay_ms": None if delay is None else round(delay * 1000, 3),
+        "budget_tokens": retry_budget.balance(),
+        **hedge_stats.snapshot(),
+    }
+
+
+def _attempt(inst, method, target, headers):
+    """Одна попытка запроса без тела; возвращает (инстанс, начало, пул,
+    соединение, ответ) — тело ответа ещё не прочитано."""
+    start = time.perf_counter()
+    pool = pools.get(inst)
+    try:
+        conn, resp = open_upstream(pool, method, target, headers)
+    except PoolTimeout:
+        # Переполнен пул балансировщика, а не инстанс
+        finish_request(inst, start, None)
+        raise
+    except Exception:
+        finish_request(inst, start, False)
+        raise
+    upstream_latency.add(time.perf_counter() - start)
+    return inst, start, pool, conn, resp
+
+
+def _discard(future):
+    """Ответ проигравшей попытки не нужен: закрываем её соединение."""
+    if future.exception() is not None:
+        return
+    inst, start, pool, conn, resp = future.result()
+    pool.release(conn, reusable=False)
+    finish_request(inst, start, resp.status < 500)
+
+
+def race_upstream(inst, method, target, headers, key=None):
+    """
+    Идемпотентный запрос с хеджированием и повторами. Первая попытка
+    идёт на inst; если ответа нет дольше hedge_delay() — дубль на
+    другой инстанс, после ошибки соединения — повтор на другом.
+    Возвращает результат первой успешной попытки (как _attempt)
+    или бросает исключение последней неудачной.
+    """
+    hedge_stats.add("requests")
+    retry_budget.deposit()
+
+    tried = [inst]
+    win_counters = {}
+    pending = {upstream_executor.submit(_attempt, inst, method, target,
+                                        headers)}
+    delay = hedge_delay()
+    error = None
+
+    def launch(counter, win_counter):
+        # Жетон берётся, только если есть куда отправить запрос
+        candidates = available_instances(exclude=tried)
+        if not candidates:
+            return
+        if not retry_budget.withdraw():
+            hedge_stats.add("budget_exhausted")
+            return
+        other = get_next_instance(key=key, candidates=candidates)
+        tried.append(other)
+        future = upstream_executor.submit(_attempt, other, method, target,
+                                          headers)
+        win_counters[future] = win_counter
+        pending.add(future)
+        hedge_stats.add(counter)
+
+    while pending:
+        done, pending = wait(pending, timeout=delay,
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            # Хедж отправляется один раз, дальше ждём любой ответ
+            delay = None
+            launch("hedges", "hedge_wins")
+            continue
+
+        winner = next((f for f in done if f.exception() is None), None)
+        if winner is None:
+            error = next(iter(done)).exception()
+            if not pending:
+                launch("retries", "retry_wins")
+            continue
+
+        for future in done - {winner}:
+            _discard(future)
+        for future in pending:
+            future.add_done_callback(_discard)
+        if winner in win_counters:
+            hedge_stats.add(win_counters[winner])
+        return winner.result()
+
+    raise error
+
+
+def cached_response(entry, state):
+    """Ответ клиенту из записи кэша; state — HIT / MISS / COALESCED."""
+    response = Response(entry.body, status=entry.status,
+                        headers=entry.headers)
+    response.headers["Age"] = str(int(entry.age()))
+    response.headers["X-Cache"] = state
+    response.headers["X-Routed-To"] = entry.routed_to
+    return response
+
+
+def route_label(path):
+    """Маршрут для метрик — первый сегмент пути (/users/42 -> /users),
+    если он есть в METRIC_ROUTES, иначе "other"."""
+    route = "/" + path.lstrip("/").split("/", 1)[0]
+    return route if route in METRIC_ROUTES else "other"
+
+
+def route_started(route):
+    metrics.inc("balancer_requests_in_flight", (("route", route),))
+
+
+def route_finished(route, method, status, start):
+    """Учитывает ответ клиенту в метриках маршрута."""
+    labels = (("route", route),)
+    metrics.inc("balancer_requests_in_flight", labels, -1)
+    metrics.inc("balancer_requests_total",
+                labels + (("method", method), ("code", str(status))))
+    metrics.observe("balancer_request_duration_seconds", labels,
+                    time.perf_counter() - start)
+
+
+def proxy(path):
+    """
+    Передаёт запрос клиента на выбранный инстанс: любой метод,
+    тела запроса и ответа — потоком, статус и заголовки — как есть.
+    Инстанс, обработавший запрос, указан в заголовке X-Routed-To.
+    """
+    route = route_label(path)
+    start = time.perf_counter()
+    route_started(route)
+    status = 500
+    try:
+        response = make_response(cached_or_forward(path))
+        status = response.status_code
+        return response
+    finally:
+        route_finished(route, request.method, status, start)
+
+
+def cached_or_forward(path):
+    """
+    GET без тела и авторизации сначала ищется в кэше ответов
+    (если он включён); одновременные промахи ждут одного ответа.
+    Остальное уходит на инстанс (forward).
+    """
+    query = request.query_string.decode("latin-1")
+    target = f"{path}?{query}" if query else path
+
+    flight = None
+    if (response_cache is not None and request.method == "GET"
+            and not request.content_length
+            and "Transfer-Encoding" not in request.headers
+            and "Authorization" not in request.headers):
+        state, entry, flight = response_cache.lookup(
+            target, request.headers.get("Cache-Control", "")
+        )
+        if entry is not None:
+            return cached_response(entry, state)
 
-    n = len(instances)
-    for _ in range(n):
-        inst = instances[current_index]
-        current_index = (current_index + 1) % n
+    try:
+        return forward(path, query, target, flight)
+    finally:
+        # Ответ не попал в кэш — ждущие промахи идут к инстансам сами
+        if flight is not None and not flight.done.is_set():
+            response_cache.complete(target, flight)
+
+
+def pool_busy(inst):
+    """Ответ, когда все соединения балансировщика к inst заняты."""
+    return jsonify(
+        {"error": f"Нет свободных соединений с {inst}"}
+    ), 503
+
+
+def forward(path, query, target, flight=None):
+    """
+    Отправляет запрос на инстанс. Идемпотентные запросы без тела
+    хеджируются и повторяются на других инстансах (race_upstream).
+    flight — промах кэша, который этот запрос должен заполнить.
+    """
+    key = request_key(path, request.headers, query)
+    inst = get_next_instance(key=key)
 
-        if instance_status.get(inst):
-            return inst
+    if not inst:
+        return jsonify({"error": "Нет доступных инстансов"}), 503
 
-    return None
+    headers = forwarded_headers(
+        request.headers.items(), request.remote_addr, request.host
+    )
+    chunked = (
+        request.headers.get("Transfer-Encoding", "").lower() == "chunked"
+    )
+    idempotent = (
+        request.method in IDEMPOTENT_METHODS
+        and not request.content_length and not chunked
+    )
+
+    if idempotent:
+        try:
+            inst, start, pool, conn, resp = race_upstream(
+                inst, request.method, target, headers, key
+            )
+        except PoolTimeout:
+            return pool_busy(inst)
+        except Exception:
+            return jsonify(
+                {"error": f"Ошибка соединения с {inst}"}
+            ), 500
+    else:
+        start = time.perf_counter()
+        pool = pools.get(inst)
+        try:
+            conn, resp = open_upstream(
+                pool,
+                request.method,
+                target,
+                headers,
+                body=request.stream,
+                length=request.content_length,
+                chunked=chunked,
+            )
+        except PoolTimeout:
+            finish_request(inst, start, None)
+            return pool_busy(inst)
+        except Exception:
+            finish_request(inst, start, False)
+            return jsonify(
+                {"error": f"Ошибка соединения с {inst}"}
+            ), 500
+
+    ok = resp.status < 500
+    body = UpstreamBody(
+        pool, conn, resp,
+        # Ответ 5xx — отказ инстанса, даже если клиент ушёл раньше
+        lambda outcome: finish_request(inst, start, ok and outcome),
+    )
+
+    if flight is not None:
+        stored_headers = response_headers(resp)
+        ttl = response_cache.cacheable(path, resp.status, stored_headers)
+        if ttl > 0:
+            entry = CacheEntry(resp.status, stored_headers,
+                               b"".join(body), ttl, inst)
+            response_cache.complete(target, flight, entry)
+            return cached_response(entry, "MISS")
+
+    if ENVELOPE:
+        content = b"".join(body)
+        try:
+            instance_response = json.loads(content)
+        except ValueError:
+            instance_response = content.decode("utf-8", "replace")
+        return jsonify({
+            "balancer": "OK",
+            "routed_to": inst,
+            "status": resp.status,
+            "instance_response": instance_response,
+        })
+
+    response = Response(
+        body, status=resp.status, headers=response_headers(resp)
+    )
+    response.headers["X-Routed-To"] = inst
+    if flight is not None:
+        response.headers["X-Cache"] = "MISS"
+    return response
 
 
 @app.route("/")
@@ -74,10 +582,44 @@ def index():
     1) Форма добавления нового инстанса (IP + порт).
     2) Список текущих инстансов с состоянием (доступен/недоступен).
     3) Кнопки удаления инстансов из списка (по индексу).
+    4) Выбор стратегии балансировки.
+    5) Перцентили задержки инстансов, обновляемые на лету.
     """
     html = """
     <h2>Балансировщик нагрузки</h2>
 
+    <h3>Стратегия балансировки</h3>
+    <form action="{{ url_for('change_strategy') }}" method="post">
+        <select name="name">
+        {% for name in strategies %}
+            <option value="{{ name }}"
+                {% if name == strategy %}selected{% endif %}>
+                {{ name }}
+            </option>
+        {% endfor %}
+        </select>
+        ключ для consistent_hash / rendezvous:
+        <input name="hash_key" value="{{ hash_key }}"
+               placeholder="path, path:N, header:Имя, query:имя">
+        <button type="submit">Применить</button>
+    </form>
+
+    <p>
+        Хеджирование: {{ "включено" if hedging.enabled else "выключено" }},
+        задержка {{ hedging.delay_ms if hedging.delay_ms is not none
+                   else "—" }} мс;
+        хеджей {{ hedging.hedges }} (выиграло {{ hedging.hedge_wins }}),
+        повторов {{ hedging.retries }} (выиграло {{ hedging.retry_wins }}),
+        жетонов в бюджете {{ hedging.budget_tokens }}
+    </p>
+    {% if cache %}
+    <p>
+        Кэш ответов: {{ cache.entries }} записей, {{ cache.bytes }} байт;
+        попаданий {{ cache.hits }}, промахов {{ cache.misses }},
+        схлопнуто {{ cache.coalesced }} (доля из кэша {{ cache.hit_ratio }})
+    </p>
+    {% endif %}
+
     <h3>Текущие инстансы:</h3>
     <ul>
     {% for inst in instances %}
@@ -88,6 +630,30 @@ def index():
             {% else %}
                 <span style="color: red;">недоступен</span>
             {% endif %}
+            вес {{ instance_weights.get(inst, 1) }},
+            {% set breaker = breaker_stats.get(inst) %}
+            {% if breaker and breaker.state != "closed" %}
+                <span style="color: orange;">
+                    предохранитель: {{ breaker.state }}
+                    {% if breaker.retry_in %}
+                        (проба через {{ breaker.retry_in }} с)
+                    {% endif %}
+                </span>,
+            {% endif %}
+            {% set load = load_stats.get(inst) %}
+            {% if load %}
+                в работе {{ load.outstanding }},
+                задержка {{ load.latency_ms }} мс
+            {% endif %}
+            {% set q = latency_stats.get(inst) %}
+            (<span data-latency="{{ inst }}">{% if q %}p50 {{ q.p50_ms }} /
+            p95 {{ q.p95_ms }} / p99 {{ q.p99_ms }} мс{% else %}нет
+            замеров{% endif %}</span>)
+            {% set pool = pool_stats.get(inst) %}
+            {% if pool %}
+                (соединения: занято {{ pool.in_use }},
+                свободно {{ pool.idle }}, создано {{ pool.created }})
+            {% endif %}
 
             <!-- Кнопка удаления по индексу -->
             <form action="{{ url_for('remove_instance') }}"
@@ -109,6 +675,9 @@ def index():
         <label>Порт:<br>
             <input name="port" placeholder="5004" required>
         </label><br><br>
+        <label>Вес (для weighted_round_robin):<br>
+            <input name="weight" placeholder="1">
+        </label><br><br>
         <button type="submit">Добавить</button>
     </form>
 
@@ -116,12 +685,36 @@ def index():
     <form action="{{ url_for('process') }}" method="get">
         <button type="submit">Отправить</button>
     </form>
+
+    <script>
+    // Перцентили задержки обновляются без перезагрузки страницы
+    setInterval(async () => {
+        const response = await fetch("{{ url_for('latency') }}");
+        const data = await response.json();
+        document.querySelectorAll("[data-latency]").forEach(el => {
+            const q = data[el.dataset.latency];
+            el.textContent = q
+                ? `p50 ${q.p50_ms} / p95 ${q.p95_ms} / p99 ${q.p99_ms} мс`
+                : "нет замеров";
+        });
+    }, 2000);
+    </script>
     """
 
     return render_template_string(
         html,
         instances=instances,
         instance_status=instance_status,
+        pool_stats=pools.stats(),
+        load_stats=backend_stats.snapshot(),
+        breaker_stats=breakers.snapshot(),
+        instance_weights=instance_weights,
+        latency_stats=latency_snapshot(),
+        strategies=STRATEGIES,
+        strategy=strategy.name,
+        hash_key=HASH_KEY,
+        hedging=hedging_snapshot(),
+        cache=response_cache.stats() if response_cache else None,
     )
 
 
@@ -129,18 +722,17 @@ def index():
 def add_instance():
     """
     Добавление нового инстанса по IP и порту.
-    Поля формы: ip, port.
+    Поля формы: ip, port, необязательный weight.
     """
     ip = request.form.get("ip", "").strip()
     port = request.form.get("port", "").strip()
+    weight = request.form.get("weight", "").strip()
 
     if ip and port:
-        url = f"http://{ip}:{port}"
-        if url not in instances:
-            instances.append(url)
-            # По умолчанию считаем, что он недоступен,
-            # пока health_check не проверит.
-            instance_status[url] = False
+        register_instance(
+            f"http://{ip}:{port}",
+            int(weight) if weight.isdigit() and int(weight) > 0 else 1,
+        )
 
     return redirect(url_for("index"))
 
@@ -149,8 +741,14 @@ def add_instance():
 def remove_instance():
     """
     Удаление инстанса из пула по индексу (как в методичке).
-    Индекс приходит из скрытого поля формы.
+    Индекс приходит из скрытого поля формы; скрипты могут вместо
+    него передать адрес инстанса в поле url.
     """
+    url = request.form.get("url", "").strip()
+    if url:
+        unregister_instance(url)
+        return redirect(url_for("index"))
+
     index_str = request.form.get("index", "").strip()
 
     if not index_str.isdigit():
@@ -159,58 +757,130 @@ def remove_instance():
     index = int(index_str)
 
     if 0 <= index < len(instances):
-        url = instances.pop(index)
-        instance_status.pop(url, None)
+        unregister_instance(instances[index])
 
     return redirect(url_for("index"))
 
 
-@app.route("/process")
-def process():
+@app.route("/strategy", methods=["GET", "POST"])
+def change_strategy():
     """
-    Отправляет запрос клиента на активный инстанс
-    по алгоритму Round Robin.
+    GET — текущая и доступные стратегии.
+    POST — смена стратегии (поле формы или JSON-ключ name)
+    и, необязательно, ключа хеширования (hash_key).
     """
-    inst = get_next_instance()
+    if request.method == "GET":
+        return jsonify({"strategy": strategy.name,
+                        "hash_key": HASH_KEY,
+                        "available": list(STRATEGIES)})
 
-    if not inst:
-        return jsonify({"error": "Нет доступных инстансов"}), 503
+    content = request.get_json(silent=True)
+    if not isinstance(content, dict):
+        content = request.form
+    name = content.get("name", "")
+    hash_key = content.get("hash_key", "").strip()
 
     try:
-        resp = requests.get(f"{inst}/process", timeout=2)
-        return jsonify({
-            "balancer": "OK",
-            "routed_to": inst,
-            "instance_response": resp.json(),
-        })
-    except Exception:
-        return jsonify(
-            {"error": f"Ошибка соединения с {inst}"}
-        ), 500
+        set_strategy(name, hash_key)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if request.form:
+        return redirect(url_for("index"))
+    return jsonify({"strategy": strategy.name, "hash_key": HASH_KEY})
 
 
-@app.route("/<path:path>", methods=["GET"])
+@app.route("/process", methods=PROXY_METHODS)
+def process():
+    """
+    Отправляет запрос клиента на активный инстанс,
+    выбранный текущей стратегией.
+    """
+    return proxy("/process")
+
+
+@app.route("/breakers")
+def breaker_stats():
+    """Состояние предохранителей: closed / open / half_open."""
+    return jsonify(breakers.snapshot())
+
+
+@app.route("/hedging")
+def hedging_stats():
+    """Хеджи и повторы: отправлено, выиграло, текущая задержка, бюджет."""
+    return jsonify(hedging_snapshot())
+
+
+def latency_snapshot():
+    """p50/p95/p99 запросов к каждому инстансу по гистограммам, в мс."""
+    _, histograms = metrics.collect()
+    result = {}
+    for inst in list(instances):
+        values = metrics.quantiles(
+            histograms, "balancer_backend_request_duration_seconds",
+            (("backend", inst),), (0.50, 0.95, 0.99),
+        )
+        if values:
+            result[inst] = {
+                f"p{round(q * 100)}_ms": round(v * 1000, 2)
+                for q, v in zip((0.50, 0.95, 0.99), values)
+            }
+    return result
+
+
+@app.route("/latency")
+def latency():
+    """Перцентили задержки инстансов для живого обновления UI."""
+    return jsonify(latency_snapshot())
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus."""
+    gauges = []
+    load = backend_stats.snapshot()
+    breaker_states = breakers.snapshot()
+    for inst in list(instances):
+        backend = (("backend", inst),)
+        gauges.append((("balancer_backend_in_flight", backend),
+                       load.get(inst, {}).get("outstanding", 0)))
+        up = instance_status.get(inst) and breaker_states.get(
+            inst, {}).get("state", "closed") == "closed"
+        gauges.append((("balancer_backend_up", backend), int(bool(up))))
+    for event, value in hedge_stats.snapshot().items():
+        gauges.append((("balancer_hedging_events_total",
+                        (("event", event),)), value))
+    if response_cache is not None:
+        for event, value in response_cache.stats().items():
+            if event in ("entries", "bytes", "max_bytes", "hit_ratio"):
+                continue
+            gauges.append((("balancer_cache_events_total",
+                            (("event", event),)), value))
+    return Response(metrics.render(gauges),
+                    mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache_stats")
+def cache_stats():
+    """Кэш ответов: записи, байты, попадания, промахи, схлопывания."""
+    if response_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **response_cache.stats()})
+
+
+@app.route("/pool_stats")
+def pool_stats():
+    """Состояние пулов соединений: занятые, свободные, созданные."""
+    return jsonify(pools.stats())
+
+
+@app.route("/<path:path>", methods=PROXY_METHODS)
 def catch_all(path):
     """
-    Перехватывает любые GET-запросы и перенаправляет их
-    на доступный инстанс по Round Robin.
+    Перехватывает любые запросы и перенаправляет их
+    на доступный инстанс текущей стратегией.
     """
-    inst = get_next_instance()
-
-    if not inst:
-        return jsonify({"error": "Нет доступных инстансов"}), 503
-
-    try:
-        resp = requests.get(f"{inst}/{path}", timeout=2)
-        return jsonify({
-            "balancer": "OK",
-            "routed_to": inst,
-            "instance_response": resp.json(),
-        })
-    except Exception:
-        return jsonify(
-            {"error": f"Ошибка соединения с {inst}"}
-        ), 500
+    return proxy(f"/{path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+"""
+Нагрузочный тест: asyncio-движок (async_proxy.py) против текущего
+пути Flask (многопоточный werkzeug, поток на соединение).
+
+Инстансы — минимальные asyncio-серверы с задержкой --delay мс, чтобы
+узким местом был балансировщик, а не они. Балансировщик каждого вида
+запускается отдельным процессом (этот же скрипт с --serve), клиенты —
+--connections одновременных соединений asyncio, каждое шлёт GET
+подряд --duration секунд (переподключаясь, если сервер закрыл
+соединение). Печатаются пропускная способность, p50/p99, ошибки,
+пиковый RSS процесса балансировщика и прирост RSS на соединение
+относительно простоя.
+
+Запуск: python bench_async.py [--connections 100,1000,2000]
+        [--delay 20] [--backends 2] [--duration 5]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from bench_strategies import free_port, percentile, wait_port
+
+RESPONSE_BODY = b'{"message": "ok"}'
+
+
+# ------------------------------------------------------
+# Процессы: инстанс и балансировщик
+# ------------------------------------------------------
+
+async def backend_main(port, delay):
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                if not head:
+                    break
+                await asyncio.sleep(delay)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\n\r\n%s"
+                    % (len(RESPONSE_BODY), RESPONSE_BODY)
+                )
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port,
+                                        backlog=4096)
+    async with server:
+        await server.serve_forever()
+
+
+def serve_balancer(engine, port, backend_urls):
+    import balancer
+
+    for url in list(balancer.instances):
+        balancer.unregister_instance(url)
+    for url in backend_urls:
+        balancer.register_instance(url)
+        balancer.instance_status[url] = True
+
+    if engine == "flask":
+        from werkzeug.serving import make_server
+        server = make_server("127.0.0.1", port, balancer.app, threaded=True)
+        server.serve_forever()
+    else:
+        import async_proxy
+        asyncio.run(async_proxy.serve("127.0.0.1", port))
+
+
+def spawn(*args, env=None):
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), *map(str, args)],
+        env=dict(os.environ, **(env or {})),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+# ------------------------------------------------------
+# Клиенты
+# ------------------------------------------------------
+
+REQUEST = (b"GET /process HTTP/1.1\r\nHost: bench\r\n"
+           b"Connection: keep-alive\r\n\r\n")
+
+
+async def client(port, deadline, latencies, errors):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(
+                    "127.0.0.1", port
+                )
+            start = time.perf_counter()
+            writer.write(REQUEST)
+            head = await reader.readuntil(b"\r\n\r\n")
+            lower = head.lower()
+            length = int(lower.split(b"content-length:")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            if not head.startswith(b"HTTP/1.1 200"):
+                errors[0] += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+            if b"connection: close" in lower:
+                writer.close()
+                writer = None
+        except (OSError, EOFError, IndexError, ValueError):
+            errors[0] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port, connections, duration, pid):
+    """Возвращает (время, отсортированные задержки, ошибки, пик RSS)."""
+    latencies, errors, peak = [], [0], [0.0]
+    deadline = time.perf_counter() + duration
+
+    async def sample_rss():
+        while time.perf_counter() < deadline:
+            peak[0] = max(peak[0], rss_mb(pid))
+            await asyncio.sleep(0.2)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        sample_rss(),
+        *(client(port, deadline, latencies, errors)
+          for _ in range(connections)),
+    )
+    return time.perf_counter() - start, sorted(latencies), errors[0], peak[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", default="100,1000,2000")
+    parser.add_argument("--delay", type=float, default=20,
+                        help="задержка инстанса, мс")
+    parser.add_argument("--backends", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--engines", default="flask,async")
+    parser.add_argument("--backend", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--serve", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        port, delay_ms = args.backend
+        asyncio.run(backend_main(int(port), float(delay_ms) / 1000))
+        return
+    if args.serve:
+        engine, port, *urls = args.serve
+        serve_balancer(engine, int(port), urls)
+        return
+
+    levels = [int(c) for c in args.connections.split(",")]
+    ports = [free_port() for _ in range(args.backends)]
+    backends = [spawn("--backend", port, args.delay) for port in ports]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    # Путь Flask: пул на все соединения, без хеджирования — как у async
+    env = {
+        "BALANCER_POOL_SIZE": str(max(levels) + 10),
+        "BALANCER_HEDGING": "0",
+        "BALANCER_BACKEND_TIMEOUT": "10",
+    }
+    try:
+        for port in ports:
+            wait_port(port)
+
+        print(f"Инстансов: {args.backends}, задержка {args.delay:g} мс, "
+              f"{args.duration:g} с на замер")
+        print(f"{'движок':7} {'соедин.':>8} {'зап/с':>7} {'p50, мс':>8} "
+              f"{'p99, мс':>8} {'ошибок':>7} {'RSS, МБ':>8} "
+              f"{'КБ/соед.':>9}")
+        print("-" * 70)
+        for engine in args.engines.split(","):
+            port = free_port()
+            server = spawn("--serve", engine, port, *urls, env=env)
+            try:
+                wait_port(port)
+                time.sleep(0.5)
+                idle = rss_mb(server.pid)
+                for connections in levels:
+                    elapsed, latencies, errors, peak = asyncio.run(
+                        run_load(port, connections, args.duration,
+                                 server.pid)
+                    )
+                    if latencies:
+                        p50 = percentile(latencies, 0.50) * 1000
+                        p99 = percentile(latencies, 0.99) * 1000
+                    else:
+                        p50 = p99 = float("nan")
+                    per_conn = (peak - idle) * 1024 / connections
+                    print(f"{engine:7} {connections:>8} "
+                          f"{len(latencies) / elapsed:>7.0f} "
+                          f"{p50:>8.1f} {p99:>8.1f} {errors:>7} "
+                          f"{peak:>8.1f} {per_conn:>9.1f}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        for backend in backends:
+            backend.terminate()
+            backend.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Хвостовая задержка с хеджированием и без.
+
+Поднимаются --backends быстрых app_instance.py (задержка --delay мс),
+один из них изредка «зависает»: с вероятностью --stall-rate запрос
+ждёт ещё --stall мс (INSTANCE_STALL_RATE / INSTANCE_STALL_MS).
+Стратегия — round_robin, чтобы зависающий инстанс получал свою долю
+запросов. Прогон повторяется без хеджирования и с hedge-задержкой
+на каждом из --percentiles; печатаются p50/p99/p99.9, доля запросов,
+получивших хедж, доля выигравших хеджей и сколько лишних запросов
+получили инстансы.
+
+Запуск: python bench_hedging.py [--backends 4] [--delay 5]
+        [--stall-rate 0.1] [--stall 500] [--percentiles 95,90]
+"""
+import argparse
+import threading
+
+from werkzeug.serving import make_server
+
+import balancer
+from bench_strategies import (
+    free_port, percentile, run_load, start_backend, wait_port
+)
+from hedging import HedgeStats, LatencyWindow, RetryBudget
+
+
+def reset(hedging, hedge_percentile):
+    balancer.HEDGING = hedging
+    balancer.HEDGE_PERCENTILE = hedge_percentile
+    balancer.upstream_latency = LatencyWindow()
+    balancer.retry_budget = RetryBudget(
+        balancer.RETRY_BUDGET_RATIO, balancer.RETRY_BUDGET_MIN_PER_SECOND
+    )
+    balancer.hedge_stats = HedgeStats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backends", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=5,
+                        help="обычная задержка инстанса, мс")
+    parser.add_argument("--stall-rate", type=float, default=0.1,
+                        help="доля зависающих запросов медленного инстанса")
+    parser.add_argument("--stall", type=float, default=500,
+                        help="длительность зависания, мс")
+    parser.add_argument("--percentiles", default="95,90")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=4000)
+    args = parser.parse_args()
+
+    ports = [free_port() for _ in range(args.backends)]
+    processes = [start_backend(port, args.delay, 0) for port in ports[1:]]
+    processes.append(start_backend(
+        ports[0], args.delay, 0,
+        INSTANCE_STALL_RATE=args.stall_rate, INSTANCE_STALL_MS=args.stall,
+    ))
+    try:
+        for port in ports:
+            wait_port(port)
+
+        for url in list(balancer.instances):
+            balancer.unregister_instance(url)
+        for port in ports:
+            url = f"http://127.0.0.1:{port}"
+            balancer.register_instance(url)
+            balancer.instance_status[url] = True
+        balancer.set_strategy("round_robin")
+
+        port = free_port()
+        server = make_server("127.0.0.1", port, balancer.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        print(f"Инстансов: {args.backends} по {args.delay:g} мс, один "
+              f"зависает на {args.stall:g} мс в {args.stall_rate:.0%} "
+              f"запросов")
+        print(f"{'режим':14} {'зап/с':>7} {'p50, мс':>8} {'p99, мс':>8} "
+              f"{'p99.9, мс':>10} {'хеджей':>7} {'выиграли':>9} "
+              f"{'лишних':>7}")
+        print("-" * 78)
+        modes = [("без хеджа", False, 95.0)] + [
+            (f"хедж p{p}", True, float(p))
+            for p in args.percentiles.split(",")
+        ]
+        for name, hedging, hedge_percentile in modes:
+            reset(hedging, hedge_percentile)
+            # Прогрев заполняет окно задержек для hedge-задержки
+            run_load(port, args.clients, args.clients * 20)
+            balancer.hedge_stats = HedgeStats()
+
+            elapsed, latencies, _ = run_load(
+                port, args.clients, args.requests
+            )
+            stats = balancer.hedge_stats.snapshot()
+            total = max(1, stats["requests"])
+            print(f"{name:14} {len(latencies) / elapsed:>7.0f} "
+                  f"{percentile(latencies, 0.50) * 1000:>8.1f} "
+                  f"{percentile(latencies, 0.99) * 1000:>8.1f} "
+                  f"{percentile(latencies, 0.999) * 1000:>10.1f} "
+                  f"{stats['hedges'] / total:>7.1%} "
+                  f"{stats['hedge_wins'] / max(1, stats['hedges']):>9.0%} "
+                  f"{(stats['hedges'] + stats['retries']) / total:>7.1%}")
+        server.shutdown()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Нагрузочный прогон балансировщика с отчётом в JSON.
+
+Поднимает --backends процессов app_instance.py на свободных портах
+с искусственной задержкой (--delay мс), отказами (--failure-rate,
+доля ответов 500) и зависаниями (--stall-rate / --stall мс),
+регистрирует их в балансировщике и подаёт нагрузку по открытой
+модели: запросы отправляются по расписанию с частотой --rps,
+не дожидаясь ответов на предыдущие. Задержка считается от
+запланированного момента отправки, поэтому очередь на стороне
+генератора (не хватило соединений, опоздал цикл событий) тоже
+попадает в перцентили, а не прячется, как в замкнутой модели.
+
+Балансировщик по умолчанию запускается отдельным процессом
+(--engine flask или async). С --balancer URL используется уже
+запущенный: инстансы добавляются через /add_instance, прогон
+начинается, когда /metrics покажет их доступными, а по окончании
+они удаляются через /remove_instance.
+
+Отчёт (пропускная способность, перцентили, доля и виды ошибок,
+параметры прогона, версия кода) печатается в stdout или пишется
+в --output. С --baseline отчёт сравнивается с прежним: если
+пропускная способность упала или p99 вырос больше чем на
+--tolerance, а доля ошибок — больше чем на --error-tolerance,
+регрессии перечисляются в отчёте и код выхода 1.
+
+Запуск: python bench_load.py [--backends 3] [--delay 10]
+        [--failure-rate 0.01] [--rps 300] [--duration 10]
+        [--engine flask|async | --balancer http://127.0.0.1:5000]
+        [--output report.json] [--baseline old.json]
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+from bench_async import spawn
+from bench_strategies import free_port, percentile, start_backend, wait_port
+
+# Перцентили в отчёте: подпись -> доля
+PERCENTILES = {"p50": 0.50, "p90": 0.90, "p99": 0.99, "p99.9": 0.999}
+
+
+def log(message):
+    print(message, file=sys.stderr)
+
+
+def code_version():
+    """Коммит, на котором сделан прогон (с пометкой о правках)."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# ------------------------------------------------------
+# Балансировщик: свой процесс или уже запущенный
+# ------------------------------------------------------
+
+def form_post(url, fields):
+    data = urllib.parse.urlencode(fields).encode()
+    with urllib.request.urlopen(url, data=data, timeout=5) as response:
+        response.read()
+
+
+def backends_up(balancer_url, urls):
+    with urllib.request.urlopen(f"{balancer_url}/metrics",
+                                timeout=5) as response:
+        text = response.read().decode()
+    return all(f'balancer_backend_up{{backend="{url}"}} 1' in text
+               for url in urls)
+
+
+def attach(balancer_url, urls, timeout=30):
+    """Регистрирует инстансы и ждёт, пока health check их примет."""
+    for url in urls:
+        parts = urllib.parse.urlsplit(url)
+        form_post(f"{balancer_url}/add_instance",
+                  {"ip": parts.hostname, "port": parts.port})
+    deadline = time.time() + timeout
+    while not backends_up(balancer_url, urls):
+        if time.time() > deadline:
+            raise TimeoutError("Балансировщик не принял инстансы")
+        time.sleep(0.5)
+
+
+def detach(balancer_url, urls):
+    for url in urls:
+        form_post(f"{balancer_url}/remove_instance", {"url": url})
+
+
+# ------------------------------------------------------
+# Генератор нагрузки (открытая модель)
+# ------------------------------------------------------
+
+class Connections:
+    """Свободные keep-alive соединения к балансировщику."""
+
+    def __init__(self, host, port, limit):
+        self.host = host
+        self.port = port
+        self.idle = []
+        self.slots = asyncio.Semaphore(limit)
+
+    async def get(self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return await asyncio.open_connection(self.host, self.port)
+
+    def put(self, conn):
+        self.idle.append(conn)
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+async def read_body(reader, head):
+    lower = head.lower()
+    if b"transfer-encoding: chunked" in lower:
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                return
+    if b"content-length:" in lower:
+        length = int(lower.split(b"content-length:")[1].split(b"\r\n")[0])
+        await reader.readexactly(length)
+        return
+    # Без длины тело идёт до закрытия соединения
+    await reader.read()
+
+
+async def exchange(conns, request):
+    """Один запрос; возвращает код ответа."""
+    reader, writer = await conns.get()
+    try:
+        writer.write(request)
+        head = await reader.readuntil(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        await read_body(reader, head)
+    except BaseException:
+        writer.close()
+        raise
+    if b"connection: close" in head.lower() or reader.at_eof():
+        writer.close()
+    else:
+        conns.put((reader, writer))
+    return status
+
+
+async def open_loop(host, port, path, rps, duration, warmup, timeout,
+                    max_connections):
+    """
+    Запросы с частотой rps в течение warmup + duration секунд.
+    Возвращает (задержки успешных, {ошибка: число}, отправлено,
+    наибольшее опоздание отправки) по запросам после прогрева.
+    """
+    request = (f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+               f"Connection: keep-alive\r\n\r\n").encode()
+    conns = Connections(host, port, max_connections)
+    loop = asyncio.get_running_loop()
+    latencies, errors = [], {}
+    lag = [0.0]
+
+    async def one(intended, measured):
+        try:
+            async with conns.slots:
+                if measured:
+                    lag[0] = max(lag[0], loop.time() - intended)
+                status = await asyncio.wait_for(exchange(conns, request),
+                                                timeout)
+            error = None if status < 500 else f"status_{status}"
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except (OSError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError, IndexError):
+            error = "connection"
+        if not measured:
+            return
+        if error is None:
+            latencies.append(loop.time() - intended)
+        else:
+            errors[error] = errors.get(error, 0) + 1
+
+    start = loop.time() + 0.05
+    measure_from = start + warmup
+    end = measure_from + duration
+    tasks = set()
+    sent = 0
+    i = 0
+    while True:
+        intended = start + i / rps
+        if intended >= end:
+            break
+        delay = intended - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        measured = intended >= measure_from
+        sent += measured
+        task = asyncio.create_task(one(intended, measured))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        i += 1
+    if tasks:
+        await asyncio.wait(tasks)
+    conns.close()
+    return sorted(latencies), errors, sent, lag[0]
+
+
+# ------------------------------------------------------
+# Отчёт
+# ------------------------------------------------------
+
+def build_report(args, latencies, errors, sent):
+    failed = sum(errors.values())
+    report = {
+        "version": code_version(),
+        "config": {
+            "balancer": args.balancer or args.engine,
+            "path": args.path,
+            "backends": args.backends,
+            "delay_ms": args.delay,
+            "failure_rate": args.failure_rate,
+            "stall_rate": args.stall_rate,
+            "stall_ms": args.stall,
+            "rps": args.rps,
+            "duration_s": args.duration,
+            "max_connections": args.max_connections,
+        },
+        "requests": sent,
+        "ok": len(latencies),
+        "errors": dict(sorted(errors.items())),
+        "error_rate": round(failed / sent, 5) if sent else 0.0,
+        "throughput_rps": round(len(latencies) / args.duration, 1),
+        "latency_ms": None,
+    }
+    if latencies:
+        report["latency_ms"] = {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2),
+            **{name: round(percentile(latencies, q) * 1000, 2)
+               for name, q in PERCENTILES.items()},
+            "max": round(latencies[-1] * 1000, 2),
+        }
+    return report
+
+
+def regressions(report, baseline, tolerance, error_tolerance):
+    """Что ухудшилось относительно прежнего отчёта."""
+    found = []
+    old, new = baseline["throughput_rps"], report["throughput_rps"]
+    if new < old * (1 - tolerance):
+        found.append(f"throughput_rps: {old} -> {new}")
+    if baseline["latency_ms"] and report["latency_ms"]:
+        old, new = baseline["latency_ms"]["p99"], report["latency_ms"]["p99"]
+        if new > old * (1 + tolerance):
+            found.append(f"latency_ms.p99: {old} -> {new}")
+    old, new = baseline["error_rate"], report["error_rate"]
+    if new > old + error_tolerance:
+        found.append(f"error_rate: {old} -> {new}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=10,
+                        help="задержка инстанса, мс")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="одновременных запросов на инстанс (0 — все)")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="доля ответов 500 от инстанса")
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall", type=float, default=0.0,
+                        help="длительность зависания, мс")
+    parser.add_argument("--rps", type=float, default=300,
+                        help="целевая частота запросов")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="длительность замера, с")
+    parser.add_argument("--warmup", type=float, default=2,
+                        help="прогрев перед замером, с")
+    parser.add_argument("--path", default="/process")
+    parser.add_argument("--timeout", type=float, default=5,
+                        help="таймаут запроса, с")
+    parser.add_argument("--max-connections", type=int, default=500,
+                        help="одновременных соединений генератора")
+    parser.add_argument("--engine", default="flask",
+                        choices=("flask", "async"))
+    parser.add_argument("--balancer",
+                        help="URL уже запущенного балансировщика")
+    parser.add_argument("--output", help="файл для отчёта")
+    parser.add_argument("--baseline", help="прежний отчёт для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="допустимое ухудшение rps и p99 (доля)")
+    parser.add_argument("--error-tolerance", type=float, default=0.01,
+                        help="допустимый прирост доли ошибок")
+    args = parser.parse_args()
+
+    ports = [free_port() for _ in range(args.backends)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    processes = [
+        start_backend(port, args.delay, args.workers,
+                      INSTANCE_FAILURE_RATE=args.failure_rate,
+                      INSTANCE_STALL_RATE=args.stall_rate,
+                      INSTANCE_STALL_MS=args.stall)
+        for port in ports
+    ]
+    try:
+        for port in ports:
+            wait_port(port)
+        if args.balancer:
+            balancer_url = args.balancer.rstrip("/")
+            attach(balancer_url, urls)
+        else:
+            port = free_port()
+            processes.append(spawn("--serve", args.engine, port, *urls, env={
+                "BALANCER_POOL_SIZE": str(args.max_connections),
+            }))
+            wait_port(port)
+            balancer_url = f"http://127.0.0.1:{port}"
+        parts = urllib.parse.urlsplit(balancer_url)
+
+        log(f"Прогон: {args.rps:g} зап/с, {args.duration:g} с "
+            f"(+{args.warmup:g} с прогрева) на {balancer_url}{args.path}")
+        latencies, errors, sent, lag = asyncio.run(open_loop(
+            parts.hostname, parts.port, args.path, args.rps, args.duration,
+            args.warmup, args.timeout, args.max_connections,
+        ))
+        if lag > 0.1:
+            log(f"Генератор опаздывал до {lag * 1000:.0f} мс: задержки "
+                f"включают очередь на его стороне")
+        if args.balancer:
+            detach(balancer_url, urls)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    report = build_report(args, latencies, errors, sent)
+    failed = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failed = regressions(report, baseline, args.tolerance,
+                             args.error_tolerance)
+        report["baseline"] = {
+            "version": baseline.get("version"),
+            "same_config": baseline.get("config") == report["config"],
+            "regressions": failed,
+        }
+        if not report["baseline"]["same_config"]:
+            log("Параметры прогона отличаются от прежнего отчёта: "
+                "сравнение может быть бессмысленным")
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log(f"Отчёт записан в {args.output}")
+    else:
+        print(text)
+    if failed:
+        log("Регрессии: " + "; ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Сравнение стратегий балансировки на неоднородных инстансах.
+
+Поднимаются локальные app_instance.py с разной задержкой и числом
+обработчиков (INSTANCE_DELAY_MS / INSTANCE_WORKERS), балансировщик
+запускается в этом же процессе. Для каждой стратегии --clients потоков
+шлют GET /process подряд; печатаются p50/p99 задержки, пропускная
+способность и доля запросов, ушедших на самый медленный инстанс.
+
+Веса для weighted_round_robin — пропускная способность инстанса
+(обработчики / задержка).
+
+Запуск: python bench_strategies.py [--backends 20:4,20:4,20:4,200:4]
+        [--clients 24] [--requests 2400]
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import balancer
+from strategies import STRATEGIES
+
+SERVERS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "servers"
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Порт {port} не открылся")
+
+
+def start_backend(port, delay_ms, workers, **env):
+    """app_instance.py на port; env — дополнительные INSTANCE_*."""
+    return subprocess.Popen(
+        [sys.executable, "app_instance.py", str(port)],
+        cwd=SERVERS_DIR,
+        env=dict(os.environ, INSTANCE_DELAY_MS=str(delay_ms),
+                 INSTANCE_WORKERS=str(workers),
+                 **{k: str(v) for k, v in env.items()}),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q))
+    return sorted_values[index]
+
+
+def run_load(port, clients, requests):
+    """Возвращает (время, отсортированные задержки, {инстанс: запросов})."""
+    latencies = []
+    routed = {}
+    lock = threading.Lock()
+    per_client = requests // clients
+
+    def client():
+        local, counts = [], {}
+        for _ in range(per_client):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            start = time.perf_counter()
+            conn.request("GET", "/process")
+            response = conn.getresponse()
+            response.read()
+            local.append(time.perf_counter() - start)
+            conn.close()
+            inst = response.getheader("X-Routed-To")
+            counts[inst] = counts.get(inst, 0) + 1
+        with lock:
+            latencies.extend(local)
+            for inst, n in counts.items():
+                routed[inst] = routed.get(inst, 0) + n
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies), routed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backends", default="20:4,20:4,20:4,200:4",
+                        help="задержка_мс:обработчики через запятую")
+    parser.add_argument("--clients", type=int, default=24)
+    parser.add_argument("--requests", type=int, default=2400)
+    # consistent_hash и rendezvous по умолчанию не сравниваются: все
+    # запросы здесь к /process, то есть с одним ключом
+    parser.add_argument("--strategies", default=",".join(
+        name for name in STRATEGIES
+        if name not in ("consistent_hash", "rendezvous")
+    ))
+    args = parser.parse_args()
+
+    backends = []
+    for spec in args.backends.split(","):
+        delay_ms, workers = spec.split(":")
+        backends.append((free_port(), float(delay_ms), int(workers)))
+
+    processes = [start_backend(*b) for b in backends]
+    try:
+        for port, _, _ in backends:
+            wait_port(port)
+
+        for url in list(balancer.instances):
+            balancer.unregister_instance(url)
+        for port, delay_ms, workers in backends:
+            url = f"http://127.0.0.1:{port}"
+            balancer.register_instance(
+                url, max(1, round(workers * 1000 / max(delay_ms, 1)))
+            )
+            balancer.instance_status[url] = True
+        slowest = "http://127.0.0.1:%d" % max(
+            backends, key=lambda b: b[1] / b[2]
+        )[0]
+
+        port = free_port()
+        server = make_server("127.0.0.1", port, balancer.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        print(f"Инстансы (задержка, обработчики): "
+              f"{[(d, w) for _, d, w in backends]}")
+        print(f"{'стратегия':22} {'зап/с':>7} {'p50, мс':>8} "
+              f"{'p99, мс':>8} {'на медленный':>13}")
+        print("-" * 62)
+        for name in args.strategies.split(","):
+            balancer.set_strategy(name)
+            run_load(port, args.clients, args.clients * 5)  # прогрев
+            elapsed, latencies, routed = run_load(
+                port, args.clients, args.requests
+            )
+            share = routed.get(slowest, 0) / max(1, len(latencies))
+            print(f"{name:22} {len(latencies) / elapsed:>7.0f} "
+                  f"{percentile(latencies, 0.50) * 1000:>8.1f} "
+                  f"{percentile(latencies, 0.99) * 1000:>8.1f} "
+                  f"{share:>12.1%}")
+        server.shutdown()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ------------------------------------------------------
+# Кэш ответов инстансов на GET
+#
+# Ключ — путь со строкой запроса. Ответ кэшируется, если инстанс
+# не запретил это в Cache-Control (no-store, no-cache, private),
+# ответ не ставит куки, не зависит от заголовков запроса (Vary) и
+# его тело известной длины не больше max_entry_bytes. Время жизни —
+# s-maxage / max-age из ответа, иначе TTL маршрута (самый длинный
+# подходящий префикс пути), иначе default_ttl; 0 — не кэшировать.
+#
+# Записи вытесняются по LRU, когда суммарный размер тел превышает
+# max_bytes. Одновременные промахи по одному ключу схлопываются:
+# к инстансу идёт только первый запрос («ведущий»), остальные ждут
+# его ответ (coalesced). Если ответ оказался некэшируемым, ждавшие
+# идут к инстансам сами.
+# ------------------------------------------------------
+
+# Коды ответов, которые можно кэшировать без явного разрешения
+CACHEABLE_STATUSES = {200, 203, 204, 300, 301, 404, 410}
+
+
+def parse_cache_control(value):
+    """'max-age=60, no-cache' -> {'max-age': '60', 'no-cache': None}."""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _seconds(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def parse_route_ttls(spec):
+    """'/health=1,/static/=300' -> {'/health': 1.0, '/static/': 300.0}."""
+    ttls = {}
+    for part in spec.split(","):
+        prefix, _, ttl = part.strip().partition("=")
+        if prefix:
+            ttls[prefix] = float(ttl)
+    return ttls
+
+
+class CacheEntry:
+    def __init__(self, status, headers, body, ttl, routed_to):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.routed_to = routed_to
+        self.stored = time.monotonic()
+        self.expires = self.stored + ttl
+
+    def age(self):
+        return time.monotonic() - self.stored
+
+
+class _Flight:
+    """Запрос к инстансу, которого ждут одновременные промахи."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class ResponseCache:
+    """LRU-кэш ответов с ограничением по байтам и схлопыванием промахов."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024,
+                 max_entry_bytes=1024 * 1024, default_ttl=0.0,
+                 route_ttls=None, wait_timeout=30.0):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.default_ttl = default_ttl
+        self.route_ttls = dict(route_ttls or {})
+        # Сколько ждать ответа ведущего, прежде чем идти к инстансу самому
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._bytes = 0
+        self._counts = dict.fromkeys(
+            ("hits", "misses", "coalesced", "bypassed", "stored",
+             "uncacheable", "evicted", "expired"), 0
+        )
+
+    # --- поиск ---
+
+    def lookup(self, key, request_cache_control=""):
+        """
+        Возвращает (состояние, запись, flight):
+          HIT, запись       — свежий ответ из кэша;
+          COALESCED, запись — ответ ведущего, которого дождались;
+          MISS, flight      — промах, этот запрос ведущий: после ответа
+                              инстанса нужно вызвать complete(key, flight, …);
+          BYPASS            — кэш не участвует (no-store в запросе или
+                              ведущий не смог поделиться ответом).
+        Запрос с no-cache / max-age=0 не берёт ответ из кэша,
+        но обновляет его.
+        """
+        directives = parse_cache_control(request_cache_control)
+        if "no-store" in directives:
+            self._count("bypassed")
+            return "BYPASS", None, None
+        max_age = None
+        if "no-cache" in directives:
+            max_age = 0.0
+        elif "max-age" in directives:
+            max_age = _seconds(directives["max-age"])
+
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and now >= entry.expires:
+                self._remove(key)
+                self._counts["expired"] += 1
+                entry = None
+            if entry is not None and (max_age is None
+                                      or entry.age() <= max_age):
+                self._entries.move_to_end(key)
+                self._counts["hits"] += 1
+                return "HIT", entry, None
+
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._counts["misses"] += 1
+                return "MISS", None, flight
+
+        # Ответ уже запрошен другим потоком — ждём его
+        flight.done.wait(self.wait_timeout)
+        if flight.entry is None:
+            self._count("misses")
+            return "BYPASS", None, None
+        self._count("coalesced")
+        return "COALESCED", flight.entry, None
+
+    # --- сохранение ---
+
+    def ttl_for(self, path, response_cache_control):
+        """Время жизни ответа в секундах; 0 — не кэшировать."""
+        directives = parse_cache_control(response_cache_control)
+        if {"no-store", "no-cache", "private"} & directives.keys():
+            return 0.0
+        for name in ("s-maxage", "max-age"):
+            if name in directives:
+                return _seconds(directives[name])
+        matches = [p for p in self.route_ttls if path.startswith(p)]
+        if matches:
+            return self.route_ttls[max(matches, key=len)]
+        return self.default_ttl
+
+    def cacheable(self, path, status, headers):
+        """
+        TTL ответа по статусу и заголовкам (список пар) или 0, если
+        сохранять его нельзя. Тело при этом ещё не прочитано.
+        """
+        names = {name.lower(): value for name, value in headers}
+        if status not in CACHEABLE_STATUSES:
+            return 0.0
+        if "set-cookie" in names or "vary" in names:
+            return 0.0
+        length = names.get("content-length")
+        if length is None or not length.isdigit() \
+                or int(length) > self.max_entry_bytes:
+            return 0.0
+        return self.ttl_for(path, names.get("cache-control"))
+
+    def complete(self, key, flight, entry=None):
+        """
+        Ведущий запрос завершён: entry — запись для кэша (None, если
+        ответ некэшируемый или инстанс не ответил). Будит ждущих.
+        """
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if entry is None:
+                self._counts["uncacheable"] += 1
+            else:
+                self._store(key, entry)
+        flight.entry = entry
+        flight.done.set()
+
+    def _store(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += len(entry.body)
+        self._counts["stored"] += 1
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counts["evicted"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = (self._counts["hits"] + self._counts["misses"]
+                       + self._counts["coalesced"])
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": round(
+                    (self._counts["hits"] + self._counts["coalesced"])
+                    / lookups, 4
+                ) if lookups else 0.0,
+                **self._counts,
+            }
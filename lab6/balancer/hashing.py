@@ -0,0 +1,116 @@
+import bisect
+import hashlib
+import math
+from urllib.parse import parse_qs
+
+# ------------------------------------------------------
+# Привязка запросов к инстансам по ключу
+#
+# Ключ — атрибут запроса (сегмент пути, заголовок, параметр строки
+# запроса). Один и тот же ключ всегда попадает на один инстанс, пока
+# тот доступен, так что кэши и шардированное состояние инстансов
+# (например, несколько kv_store) работают с локальностью.
+#
+# HashRing — кольцо с виртуальными узлами: каждый инстанс занимает
+# vnodes * вес точек, ключ уходит к ближайшей точке по часовой
+# стрелке. rendezvous() — хеширование по наибольшему весу: ключ уходит
+# к инстансу с максимальным hash(ключ, инстанс). В обоих случаях при
+# добавлении или удалении одного из N инстансов переезжает ~1/N ключей,
+# а недоступный инстанс пропускается — его ключи расходятся по
+# остальным, не задевая чужие.
+# ------------------------------------------------------
+
+VNODES = 160
+
+
+def hash64(value):
+    """Стабильный между процессами 64-битный хеш строки."""
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    """Консистентное кольцо хешей с виртуальными узлами."""
+
+    def __init__(self, vnodes=VNODES):
+        self.vnodes = vnodes
+        self._members = {}
+        self._points = []   # отсортированные хеши точек
+        self._owners = []   # инстанс каждой точки
+
+    def members(self):
+        return dict(self._members)
+
+    def rebuild(self, weights):
+        """Состав кольца: {url: вес}; вес умножает число точек."""
+        self._members = dict(weights)
+        ring = sorted(
+            (hash64(f"{url}#{i}"), url)
+            for url, weight in self._members.items()
+            for i in range(self.vnodes * max(1, int(weight)))
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [url for _, url in ring]
+
+    def lookup(self, key, candidates=None):
+        """
+        Инстанс для ключа; если задан candidates — первый по часовой
+        стрелке из них. None, если подходящих инстансов нет.
+        """
+        if not self._points:
+            return None
+        allowed = None if candidates is None else set(candidates)
+        start = bisect.bisect(self._points, hash64(key))
+        seen = set()
+        for i in range(len(self._points)):
+            url = self._owners[(start + i) % len(self._points)]
+            if allowed is None or url in allowed:
+                return url
+            seen.add(url)
+            if len(seen) == len(self._members):
+                break
+        return None
+
+
+def rendezvous(key, candidates, weights=None):
+    """Инстанс с наибольшим весом hash(ключ, инстанс) среди candidates."""
+    best, best_score = None, -1.0
+    for url in candidates:
+        # Взвешенный вариант: -w / ln(u), u ∈ (0, 1)
+        u = (hash64(f"{key}#{url}") + 1) / 2 ** 64
+        weight = (weights or {}).get(url, 1)
+        score = weight / -math.log(u)
+        if score > best_score:
+            best, best_score = url, score
+    return best
+
+
+def make_key_extractor(spec):
+    """
+    Функция (path, headers, query_string) -> ключ или None по описанию:
+      path          — весь путь;
+      path:N        — N-й сегмент пути (с нуля: /users/42 -> path:1 = 42);
+      header:Имя    — значение заголовка;
+      query:имя     — параметр строки запроса.
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "path" and not arg:
+        return lambda path, headers, query: path
+    if kind == "path" and arg.isdigit():
+        index = int(arg)
+
+        def by_segment(path, headers, query):
+            segments = [s for s in path.split("/") if s]
+            return segments[index] if index < len(segments) else None
+        return by_segment
+    if kind == "header" and arg:
+        return lambda path, headers, query: headers.get(arg)
+    if kind == "query" and arg:
+        def by_query(path, headers, query):
+            values = parse_qs(query).get(arg)
+            return values[0] if values else None
+        return by_query
+    raise ValueError(
+        f"Неизвестный ключ хеширования: {spec!r}, ожидается path, "
+        f"path:N, header:Имя или query:имя"
+    )
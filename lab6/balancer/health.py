@@ -0,0 +1,184 @@
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# ------------------------------------------------------
+# Обнаружение отказов инстансов
+#
+# Активные проверки: HealthChecker раз в interval секунд опрашивает
+# /health всех инстансов параллельно (не больше parallelism проверок
+# одновременно), так что обход занимает ~timeout, а не N * timeout.
+#
+# Пассивные сигналы: каждый проксируемый запрос сообщает об успехе
+# или отказе автомату CircuitBreakers. После threshold отказов подряд
+# инстанс выводится из ротации (open) на время backoff, затем
+# пропускает пробные запросы (half_open): успех возвращает инстанс
+# в ротацию, отказ снова выводит его — с вдвое большим backoff.
+# ------------------------------------------------------
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Breaker:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0         # сколько раз подряд открывался
+        self.retry_at = 0.0     # когда open перейдёт в half_open
+        self.trials = 0         # пробных запросов в полёте
+        self.trial_started = 0.0
+
+
+class CircuitBreakers:
+    """Автоматы «предохранитель» по URL инстанса."""
+
+    def __init__(self, threshold=3, backoff=1.0, max_backoff=30.0,
+                 trials=1, trial_timeout=5.0):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.trials = trials
+        self.trial_timeout = trial_timeout
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def _get(self, url):
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            breaker = self._breakers[url] = _Breaker()
+        return breaker
+
+    def _refresh(self, breaker, now):
+        if breaker.state == OPEN and now >= breaker.retry_at:
+            breaker.state = HALF_OPEN
+            breaker.trials = 0
+        elif (breaker.state == HALF_OPEN and breaker.trials
+              and now - breaker.trial_started > self.trial_timeout):
+            # Пробный запрос потерялся (его так и не отправили или
+            # ответ не учли) — разрешаем следующий
+            breaker.trials = 0
+
+    def available(self, url):
+        """Можно ли сейчас отправить запрос на инстанс."""
+        with self._lock:
+            breaker = self._get(url)
+            self._refresh(breaker, time.monotonic())
+            if breaker.state == CLOSED:
+                return True
+            return breaker.state == HALF_OPEN and breaker.trials < self.trials
+
+    def on_start(self, url):
+        """Запрос отправлен: в half_open он считается пробным."""
+        with self._lock:
+            breaker = self._get(url)
+            if breaker.state == HALF_OPEN:
+                breaker.trials += 1
+                breaker.trial_started = time.monotonic()
+
+    def on_cancel(self, url):
+        """Запрос прерван не по вине инстанса: пробный — не в счёт."""
+        with self._lock:
+            breaker = self._get(url)
+            if breaker.state == HALF_OPEN and breaker.trials:
+                breaker.trials -= 1
+
+    def record_success(self, url):
+        with self._lock:
+            breaker = self._get(url)
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.opened = 0
+            breaker.trials = 0
+
+    def record_failure(self, url):
+        with self._lock:
+            breaker = self._get(url)
+            breaker.failures += 1
+            if breaker.state == HALF_OPEN or (
+                breaker.state == CLOSED and breaker.failures >= self.threshold
+            ):
+                breaker.opened += 1
+                backoff = min(
+                    self.max_backoff,
+                    self.backoff * 2 ** (breaker.opened - 1),
+                )
+                breaker.state = OPEN
+                breaker.retry_at = time.monotonic() + backoff
+                breaker.trials = 0
+
+    def forget(self, url):
+        with self._lock:
+            self._breakers.pop(url, None)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for url, breaker in self._breakers.items():
+                self._refresh(breaker, now)
+                result[url] = {
+                    "state": breaker.state,
+                    "failures": breaker.failures,
+                    "retry_in": round(max(0.0, breaker.retry_at - now), 3)
+                    if breaker.state == OPEN else 0.0,
+                }
+            return result
+
+
+def probe(url, timeout):
+    """GET /health; True, если инстанс ответил 200."""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(
+        parts.hostname, parts.port or 80, timeout=timeout
+    )
+    try:
+        conn.request("GET", "/health")
+        return conn.getresponse().status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        conn.close()
+
+
+class HealthChecker:
+    """
+    Периодические параллельные проверки /health.
+
+    get_instances() — текущий список URL, on_result(url, ok) —
+    вызывается с результатом каждой проверки.
+    """
+
+    def __init__(self, get_instances, on_result, interval=5.0, timeout=1.0,
+                 parallelism=16):
+        self.get_instances = get_instances
+        self.on_result = on_result
+        self.interval = interval
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=parallelism, thread_name_prefix="health"
+        )
+
+    def sweep(self):
+        """Одна проверка всех инстансов; возвращает {url: ok}."""
+        urls = self.get_instances()
+        results = dict(zip(
+            urls,
+            self._executor.map(lambda url: probe(url, self.timeout), urls),
+        ))
+        for url, ok in results.items():
+            self.on_result(url, ok)
+        return results
+
+    def start(self):
+        def loop():
+            while True:
+                self.sweep()
+                time.sleep(self.interval)
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
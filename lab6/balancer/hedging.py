@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import deque
+
+# ------------------------------------------------------
+# Хвостовая задержка: хеджирование и повторы
+#
+# Идемпотентный запрос (GET/HEAD/OPTIONS без тела), на который
+# инстанс не ответил за hedge-задержку, дублируется на другой инстанс;
+# клиенту уходит тот ответ, что пришёл первым. Задержка — перцентиль
+# времени ответа за последние window запросов, так что дублируется
+# лишь самый медленный хвост. Запрос, упавший с ошибкой соединения
+# или по таймауту, повторяется на другом инстансе.
+#
+# Хеджи и повторы — лишняя нагрузка на инстансы, поэтому оба берут
+# жетон из общего RetryBudget: каждый обычный запрос добавляет ratio
+# жетона, плюс min_per_second жетонов в секунду для малого трафика.
+# Когда жетонов нет, запрос идёт без хеджа и без повтора — лавины
+# повторов при общей деградации не будет.
+# ------------------------------------------------------
+
+
+class LatencyWindow:
+    """
+    Скользящее окно последних задержек и их перцентиль. Перцентиль
+    спрашивается на каждом запросе, поэтому окно сортируется не при
+    каждом вызове, а раз в refresh_every новых замеров; между
+    пересчётами отдаётся сохранённое значение, без замка.
+    """
+
+    def __init__(self, size=1000, min_samples=20, refresh_every=50):
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+        self._added = 0
+        self._cached = {}   # q -> (перцентиль, _added при расчёте)
+
+    def add(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+            self._added += 1
+
+    def percentile(self, q):
+        """q-перцентиль в секундах; None, пока замеров меньше min_samples."""
+        cached = self._cached.get(q)
+        if cached is not None and self._added - cached[1] < self.refresh_every:
+            return cached[0]
+
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+            added = self._added
+        value = ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+        self._cached[q] = (value, added)
+        return value
+
+
+class RetryBudget:
+    """Общий запас жетонов на хеджи и повторы."""
+
+    def __init__(self, ratio=0.1, min_per_second=10.0, max_tokens=100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._refilled = time.monotonic()
+
+    def deposit(self):
+        """Обычный запрос: пополняет запас на ratio жетона."""
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """Берёт жетон на хедж или повтор; False — запас исчерпан."""
+        now = time.monotonic()
+        with self._lock:
+            self._tokens = min(
+                self.max_tokens,
+                self._tokens + (now - self._refilled) * self.min_per_second,
+            )
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def balance(self):
+        with self._lock:
+            return round(self._tokens, 2)
+
+
+class HedgeStats:
+    """Счётчики: сколько хеджей и повторов отправлено и выиграло."""
+
+    FIELDS = (
+        "requests", "hedges", "hedge_wins", "retries", "retry_wins",
+        "budget_exhausted",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
@@ -0,0 +1,178 @@
+import bisect
+import threading
+
+# ------------------------------------------------------
+# Метрики балансировщика в формате Prometheus
+#
+# Запись идёт на горячем пути каждого запроса, поэтому без замков:
+# у каждого потока свой «осколок» счётчиков и гистограмм, и пишет
+# в него только этот поток. Замок берётся один раз при первом
+# обращении потока и при сборе (/metrics), который суммирует осколки.
+# Осколки завершившихся потоков (werkzeug заводит поток на
+# соединение) сливаются в общий архив, так что их число не растёт.
+#
+# Гистограммы задержек — логарифмические корзины с шагом 2^(1/4)
+# от 0.25 мс до ~46 с (в духе HDR): соседние границы отличаются
+# на 19%, так что перцентиль по ним точен примерно до ±10%.
+# ------------------------------------------------------
+
+BOUNDS = [0.00025 * 2 ** (i / 4) for i in range(71)]
+
+# Сколько осколков копится, прежде чем сливать осколки мёртвых потоков
+FOLD_THRESHOLD = 64
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}     # (имя, метки) -> число
+        self.histograms = {}   # (имя, метки) -> [корзины..., +Inf, сумма]
+
+    def merge_into(self, counters, histograms):
+        for key, value in list(self.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        for key, buckets in list(self.histograms.items()):
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(buckets)
+            else:
+                for i, value in enumerate(list(buckets)):
+                    total[i] += value
+
+
+class Metrics:
+    """Счётчики и гистограммы с метками; метки — кортеж пар."""
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []          # (поток, осколок)
+        self._retired = _Shard()   # сумма осколков завершившихся потоков
+        self._meta = {}            # имя -> (тип, описание)
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                if len(self._shards) >= FOLD_THRESHOLD:
+                    self._fold_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_dead(self):
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                shard.merge_into(self._retired.counters,
+                                 self._retired.histograms)
+        self._shards = alive
+
+    # --- запись (без замков) ---
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        buckets = histograms.get(key)
+        if buckets is None:
+            buckets = histograms[key] = [0] * (len(self.bounds) + 2)
+        buckets[bisect.bisect_left(self.bounds, value)] += 1
+        buckets[-1] += value
+
+    # --- сбор ---
+
+    def collect(self):
+        """Сумма по всем потокам: ({ключ: число}, {ключ: корзины})."""
+        counters, histograms = {}, {}
+        with self._lock:
+            self._fold_dead()
+            self._retired.merge_into(counters, histograms)
+            for _, shard in self._shards:
+                shard.merge_into(counters, histograms)
+        return counters, histograms
+
+    def quantiles(self, histograms, name, labels, qs):
+        """Перцентили гистограммы (линейно внутри корзины), в секундах."""
+        buckets = histograms.get((name, labels))
+        if not buckets:
+            return None
+        counts = buckets[:-1]
+        total = sum(counts)
+        if not total:
+            return None
+        result = []
+        for q in qs:
+            rank = q * total
+            seen = 0
+            for i, count in enumerate(counts):
+                if seen + count >= rank and count:
+                    low = self.bounds[i - 1] if i else 0.0
+                    high = (self.bounds[i] if i < len(self.bounds)
+                            else self.bounds[-1])
+                    result.append(low + (high - low) * (rank - seen) / count)
+                    break
+                seen += count
+        return result
+
+    def render(self, gauges=()):
+        """
+        Текст для /metrics. gauges — пары ((имя, метки), значение),
+        которые вычисляются в момент сбора (в работе, доступность).
+        """
+        counters, histograms = self.collect()
+        lines = []
+        by_name = {}
+        for (name, labels), value in list(counters.items()) + list(gauges):
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), buckets in histograms.items():
+            by_name.setdefault(name, []).append((labels, buckets))
+
+        for name in sorted(by_name):
+            kind, help_text = self._meta.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name], key=lambda x: x[0]):
+                if kind != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.bounds + [None], value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound is None else f"{bound:.6g}"
+                    lines.append(
+                        f"{name}_bucket{_labels(labels + (('le', le),))} "
+                        f"{cumulative}"
+                    )
+                lines.append(f"{name}_sum{_labels(labels)} "
+                             f"{_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
@@ -0,0 +1,152 @@
+import http.client
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+# ------------------------------------------------------
+# Пулы keep-alive соединений от балансировщика к инстансам
+#
+# На каждый инстанс — свой пул из не более чем size соединений
+# http.client. Соединение после ответа возвращается в пул и
+# переиспользуется следующим запросом, так что TCP-рукопожатие
+# происходит один раз, а не на каждый проксируемый запрос.
+# Свободные соединения старше idle_timeout секунд закрываются.
+# ------------------------------------------------------
+
+# Ошибки, после которых соединение нельзя вернуть в пул
+CONNECTION_ERRORS = (OSError, http.client.HTTPException)
+
+
+class PoolTimeout(Exception):
+    """Все соединения пула заняты дольше допустимого."""
+
+
+class ConnectionPool:
+    """Пул соединений к одному инстансу (http://host:port)."""
+
+    def __init__(self, url, size=10, idle_timeout=30.0, timeout=2.0):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (соединение, время возврата в пул)
+        self._in_use = 0
+        self._closed = False
+
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def _prune(self, now):
+        """Закрывает свободные соединения, простоявшие дольше idle_timeout."""
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            conn.close()
+            self.discarded += 1
+
+    def acquire(self, timeout=None):
+        """
+        Соединение из пула или новое, если лимит не исчерпан.
+        Возвращает (соединение, было ли оно переиспользовано).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout(f"Пул {self.url} закрыт")
+
+                self._prune(time.monotonic())
+                if self._idle:
+                    # Берём самое свежее: старые быстрее уйдут по таймауту
+                    conn, _ = self._idle.pop()
+                    self._in_use += 1
+                    self.reused += 1
+                    return conn, True
+
+                if self._in_use < self.size:
+                    self._in_use += 1
+                    self.created += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"Нет свободных соединений к {self.url}")
+                self._cond.wait(remaining)
+
+        return http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout
+        ), False
+
+    def release(self, conn, reusable=True):
+        """Возвращает соединение в пул; сломанное — закрывает."""
+        with self._cond:
+            self._in_use -= 1
+            if reusable and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                conn.close()
+                self.discarded += 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            self._prune(time.monotonic())
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+            }
+
+    def close(self):
+        """Закрывает свободные соединения; занятые закроются при возврате."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.popleft()[0].close()
+                self.discarded += 1
+            self._cond.notify_all()
+
+
+class PoolManager:
+    """Пулы соединений по URL инстанса."""
+
+    def __init__(self, size=10, idle_timeout=30.0, timeout=2.0):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def add(self, url):
+        with self._lock:
+            if url not in self._pools:
+                self._pools[url] = ConnectionPool(
+                    url, self.size, self.idle_timeout, self.timeout
+                )
+            return self._pools[url]
+
+    def remove(self, url):
+        with self._lock:
+            pool = self._pools.pop(url, None)
+        if pool is not None:
+            pool.close()
+
+    def get(self, url):
+        """Пул инстанса; создаётся при первом обращении."""
+        pool = self._pools.get(url)
+        return pool if pool is not None else self.add(url)
+
+    def stats(self):
+        with self._lock:
+            pools = list(self._pools.items())
+        return {url: pool.stats() for url, pool in pools}
@@ -0,0 +1,144 @@
+from pool import CONNECTION_ERRORS
+
+# ------------------------------------------------------
+# Прозрачное проксирование с потоковой передачей тел
+#
+# Тело запроса клиента отправляется инстансу кусками по CHUNK_SIZE
+# байт, тело ответа так же кусками отдаётся клиенту — ни то, ни другое
+# не собирается в памяти целиком, сколько бы мегабайт ни было.
+# Статус и заголовки ответа передаются как есть, кроме hop-by-hop
+# заголовков, которые относятся к одному TCP-соединению.
+# ------------------------------------------------------
+
+CHUNK_SIZE = 64 * 1024
+
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade",
+}
+
+
+def forwarded_headers(headers, client_ip, host):
+    """Заголовки запроса для инстанса: без hop-by-hop, с X-Forwarded-*."""
+    # Host и длину тела выставляет http.client
+    skip = HOP_BY_HOP | {"host", "content-length"}
+    result = [
+        (name, value) for name, value in headers
+        if name.lower() not in skip
+    ]
+    result.append(("X-Forwarded-For", client_ip))
+    result.append(("X-Forwarded-Host", host))
+    return result
+
+
+def response_headers(resp):
+    """Заголовки ответа инстанса для клиента."""
+    return [
+        (name, value) for name, value in resp.getheaders()
+        if name.lower() not in HOP_BY_HOP
+    ]
+
+
+def _send(conn, method, path, headers, body, length, chunked):
+    conn.putrequest(method, path, skip_accept_encoding=True)
+    for name, value in headers:
+        conn.putheader(name, value)
+    if chunked:
+        conn.putheader("Transfer-Encoding", "chunked")
+    elif length is not None:
+        conn.putheader("Content-Length", str(length))
+    conn.endheaders()
+
+    if chunked:
+        while True:
+            chunk = body.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            conn.send(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        conn.send(b"0\r\n\r\n")
+    elif length:
+        remaining = length
+        while remaining:
+            chunk = body.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ConnectionError("клиент оборвал тело запроса")
+            conn.send(chunk)
+            remaining -= len(chunk)
+
+    return conn.getresponse()
+
+
+def open_upstream(pool, method, path, headers, body=None, length=None,
+                  chunked=False):
+    """
+    Отправляет запрос инстансу и читает статус с заголовками ответа.
+    Возвращает (соединение, ответ); тело ответа читает UpstreamBody.
+
+    Запрос без тела на переиспользованном соединении, которое инстанс
+    успел закрыть, повторяется на новом; запрос с телом повторить
+    нельзя — оно уже прочитано у клиента.
+    """
+    while True:
+        conn, reused = pool.acquire()
+        try:
+            return conn, _send(conn, method, path, headers, body, length,
+                               chunked)
+        except CONNECTION_ERRORS:
+            pool.release(conn, reusable=False)
+            if reused and not length and not chunked:
+                continue
+            raise
+
+
+class UpstreamBody:
+    """
+    Тело ответа инстанса как итератор кусков для Flask Response.
+
+    Когда ответ дочитан или клиент ушёл (сервер вызывает close()),
+    соединение возвращается в пул, а on_done(outcome) получает исход:
+    True — ответ дочитан, False — ошибка чтения из инстанса, None —
+    клиент ушёл раньше (инстанс в этом не виноват). Недочитанное
+    соединение закрывается: в нём остались байты чужого ответа.
+    """
+
+    def __init__(self, pool, conn, resp, on_done):
+        self.pool = pool
+        self.conn = conn
+        self.resp = resp
+        self.on_done = on_done
+        self._finished = False
+
+    def __iter__(self):
+        outcome = False
+        try:
+            while True:
+                # read1 отдаёт то, что уже пришло: read(n) ждал бы n байт,
+                # собирая их из нескольких chunked-кусков
+                chunk = self.resp.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                try:
+                    yield chunk
+                except GeneratorExit:
+                    outcome = None  # клиент закрыл соединение
+                    raise
+            # read1 не закрывает ответ, дочитанный ровно до Content-Length,
+            # а с незакрытым ответом соединение не примет новый запрос
+            self.resp.read()
+            outcome = True
+        finally:
+            self._finish(outcome)
+
+    def _finish(self, outcome):
+        if self._finished:
+            return
+        self._finished = True
+        self.pool.release(
+            self.conn, reusable=outcome is True and not self.resp.will_close
+        )
+        self.on_done(outcome)
+
+    def close(self):
+        # Итерация могла и не начаться (например, ответ на HEAD); если
+        # ответ не дочитан, значит, клиент ушёл, не дождавшись конца
+        self._finish(True if self.resp.isclosed() else None)
@@ -0,0 +1,251 @@
+import math
+import random
+import threading
+import time
+
+from hashing import VNODES, HashRing, rendezvous
+
+# ------------------------------------------------------
+# Стратегии балансировки
+#
+# Стратегия выбирает инстанс из списка доступных (candidates);
+# key — ключ запроса для стратегий с привязкой (None, если ключа нет).
+# Учёт незавершённых запросов и задержек общий для всех стратегий
+# и живёт в BackendStats, поэтому стратегию можно сменить на лету:
+# запросы, начатые при старой стратегии, завершатся в тех же счётчиках.
+#
+# Выбор и отметка о начале запроса делаются под одним замком —
+# иначе несколько потоков разом выберут один и тот же «свободный»
+# инстанс.
+# ------------------------------------------------------
+
+# Время затухания peak-EWMA: вклад старых замеров падает в e раз
+# за EWMA_DECAY секунд
+EWMA_DECAY = 10.0
+
+
+class BackendStats:
+    """Незавершённые запросы и peak-EWMA задержки по инстансам."""
+
+    def __init__(self, decay=EWMA_DECAY):
+        self.decay = decay
+        self._lock = threading.Lock()
+        self._outstanding = {}
+        self._ewma = {}
+        self._updated = {}
+
+    def outstanding(self, url):
+        return self._outstanding.get(url, 0)
+
+    def latency(self, url, default=0.0):
+        """Сглаженная задержка инстанса в секундах (default — замеров
+        ещё нет)."""
+        return self._ewma.get(url, default)
+
+    def acquire(self, strategy, candidates, key=None):
+        """Выбирает инстанс стратегией и отмечает начало запроса к нему."""
+        with self._lock:
+            url = strategy.choose(candidates, self, key)
+            self._outstanding[url] = self._outstanding.get(url, 0) + 1
+            return url
+
+    def release(self, url, latency):
+        """Отмечает конец запроса и учитывает его задержку."""
+        now = time.monotonic()
+        with self._lock:
+            self._outstanding[url] = max(0, self._outstanding.get(url, 0) - 1)
+
+            # Peak EWMA: всплеск задержки учитывается сразу целиком,
+            # а снижение — плавно, с весом, зависящим от времени
+            previous = self._ewma.get(url)
+            if previous is None or latency > previous:
+                self._ewma[url] = latency
+            else:
+                elapsed = now - self._updated.get(url, now)
+                weight = math.exp(-elapsed / self.decay)
+                self._ewma[url] = previous * weight + latency * (1 - weight)
+            self._updated[url] = now
+
+    def forget(self, url):
+        with self._lock:
+            self._outstanding.pop(url, None)
+            self._ewma.pop(url, None)
+            self._updated.pop(url, None)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                url: {
+                    "outstanding": self._outstanding.get(url, 0),
+                    "latency_ms": round(self._ewma.get(url, 0.0) * 1000, 3),
+                }
+                for url in set(self._outstanding) | set(self._ewma)
+            }
+
+
+class RoundRobin:
+    """По кругу среди доступных инстансов."""
+
+    name = "round_robin"
+
+    def __init__(self, weights):
+        self._counter = 0
+
+    def choose(self, candidates, stats, key=None):
+        url = candidates[self._counter % len(candidates)]
+        self._counter += 1
+        return url
+
+
+class WeightedRoundRobin:
+    """
+    Плавный взвешенный round robin (как в nginx): инстанс с весом 3
+    получает втрое больше запросов, и они не идут подряд пачкой.
+    """
+
+    name = "weighted_round_robin"
+
+    def __init__(self, weights):
+        self.weights = weights
+        self._current = {}
+
+    def choose(self, candidates, stats, key=None):
+        total = 0
+        best = None
+        for url in candidates:
+            weight = self.weights.get(url, 1)
+            total += weight
+            self._current[url] = self._current.get(url, 0) + weight
+            if best is None or self._current[url] > self._current[best]:
+                best = url
+        self._current[best] -= total
+        return best
+
+
+class LeastOutstanding:
+    """Инстанс с наименьшим числом незавершённых запросов."""
+
+    name = "least_outstanding"
+
+    def __init__(self, weights):
+        pass
+
+    def choose(self, candidates, stats, key=None):
+        # Случайный порядок — чтобы при равенстве не грузить первый
+        start = random.randrange(len(candidates))
+        ordered = candidates[start:] + candidates[:start]
+        return min(ordered, key=stats.outstanding)
+
+
+class PeakEwma:
+    """
+    Минимальная ожидаемая задержка: peak-EWMA инстанса, умноженная
+    на (незавершённые запросы + 1). Инстанс без замеров считается
+    не быстрее самого медленного из кандидатов — иначе с нулевой
+    ценой на него уходили бы все запросы до его первого ответа.
+    """
+
+    name = "peak_ewma"
+
+    def __init__(self, weights):
+        pass
+
+    def choose(self, candidates, stats, key=None):
+        unsampled = max(
+            (stats.latency(url, None) for url in candidates
+             if stats.latency(url, None) is not None),
+            default=1.0,
+        )
+        start = random.randrange(len(candidates))
+        ordered = candidates[start:] + candidates[:start]
+        return min(
+            ordered,
+            key=lambda url: (stats.latency(url, unsampled)
+                             * (stats.outstanding(url) + 1)),
+        )
+
+
+class PowerOfTwoChoices:
+    """
+    Два случайных инстанса, из них — с меньшим числом незавершённых
+    запросов. Почти так же хорошо, как least_outstanding, но не гонит
+    весь поток на один только что освободившийся инстанс.
+    """
+
+    name = "p2c"
+
+    def __init__(self, weights):
+        pass
+
+    def choose(self, candidates, stats, key=None):
+        if len(candidates) == 1:
+            return candidates[0]
+        a, b = random.sample(candidates, 2)
+        return a if stats.outstanding(a) <= stats.outstanding(b) else b
+
+
+class ConsistentHash:
+    """
+    Кольцо хешей с виртуальными узлами (hashing.HashRing): запросы
+    с одним ключом идут на один инстанс. Кольцо строится по всем
+    зарегистрированным инстансам (weights) и перестраивается при смене
+    состава; недоступные пропускаются по часовой стрелке.
+    Запрос без ключа — как p2c.
+    """
+
+    name = "consistent_hash"
+
+    def __init__(self, weights, vnodes=VNODES):
+        self.weights = weights
+        self.ring = HashRing(vnodes)
+        self._fallback = PowerOfTwoChoices(weights)
+
+    def choose(self, candidates, stats, key=None):
+        if key is None:
+            return self._fallback.choose(candidates, stats)
+        if self.ring.members() != self.weights:
+            self.ring.rebuild(self.weights)
+        return (self.ring.lookup(key, candidates)
+                or self._fallback.choose(candidates, stats))
+
+
+class Rendezvous:
+    """
+    Rendezvous (HRW) хеширование: ключ уходит к доступному инстансу
+    с наибольшим hash(ключ, инстанс) с учётом веса. Кольцо не нужно,
+    но выбор стоит O(N). Запрос без ключа — как p2c.
+    """
+
+    name = "rendezvous"
+
+    def __init__(self, weights):
+        self.weights = weights
+        self._fallback = PowerOfTwoChoices(weights)
+
+    def choose(self, candidates, stats, key=None):
+        if key is None:
+            return self._fallback.choose(candidates, stats)
+        return rendezvous(key, candidates, self.weights)
+
+
+STRATEGIES = {
+    cls.name: cls
+    for cls in (
+        RoundRobin,
+        WeightedRoundRobin,
+        LeastOutstanding,
+        PeakEwma,
+        PowerOfTwoChoices,
+        ConsistentHash,
+        Rendezvous,
+    )
+}
+
+
+def make_strategy(name, weights):
+    if name not in STRATEGIES:
+        raise ValueError(
+            f"Неизвестная стратегия: {name!r}, "
+            f"ожидается одна из {tuple(STRATEGIES)}"
+        )
+    return STRATEGIES[name](weights)
@@ -0,0 +1,1080 @@
+import asyncio
+import hashlib
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request
+from werkzeug.wrappers import Response as WsgiResponse
+
+import async_proxy
+import balancer
+import health
+import hedging
+from cache import CacheEntry, ResponseCache
+from hashing import HashRing, make_key_extractor, rendezvous
+from health import CircuitBreakers
+from hedging import LatencyWindow, RetryBudget
+from metrics import Metrics
+from pool import ConnectionPool, PoolTimeout
+from proxy import open_upstream
+from strategies import (
+    BackendStats, LeastOutstanding, PeakEwma, PowerOfTwoChoices, RoundRobin,
+    WeightedRoundRobin,
+)
+
+KEYS = [f"user:{i}" for i in range(20000)]
+NODES = [f"http://10.0.0.{i}:5000" for i in range(1, 11)]
+
+
+def ring_router(nodes):
+    ring = HashRing()
+    ring.rebuild({url: 1 for url in nodes})
+    return lambda key: ring.lookup(key)
+
+
+def rendezvous_router(nodes):
+    return lambda key: rendezvous(key, nodes)
+
+
+ROUTERS = [ring_router, rendezvous_router]
+
+
+def assignment(router, nodes):
+    route = router(nodes)
+    return {key: route(key) for key in KEYS}
+
+
+@pytest.mark.parametrize("router", ROUTERS)
+def test_add_moves_about_one_nth_of_keys(router):
+    """Новый инстанс забирает ~1/N ключей, и только себе."""
+    new = "http://10.0.0.11:5000"
+    before = assignment(router, NODES)
+    after = assignment(router, NODES + [new])
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    share = len(moved) / len(KEYS)
+    assert 0.5 / 11 < share < 1.5 / 11
+    assert all(after[key] == new for key in moved)
+
+
+@pytest.mark.parametrize("router", ROUTERS)
+def test_remove_moves_only_keys_of_removed(router):
+    """Ключи удалённого инстанса расходятся, остальные на местах."""
+    removed = NODES[3]
+    before = assignment(router, NODES)
+    after = assignment(router, [url for url in NODES if url != removed])
+
+    moved = {key for key in KEYS if before[key] != after[key]}
+    assert moved == {key for key in KEYS if before[key] == removed}
+    # Ключи удалённого не сваливаются на одного соседа
+    assert len(Counter(after[key] for key in moved)) > len(NODES) // 2
+
+
+@pytest.mark.parametrize("router", ROUTERS)
+def test_load_skew(router):
+    """Нагрузка инстансов отличается от средней не больше чем на 25%."""
+    load = Counter(assignment(router, NODES).values())
+    assert set(load) == set(NODES)
+    mean = len(KEYS) / len(NODES)
+    assert max(load.values()) / mean < 1.25
+    assert min(load.values()) / mean > 0.75
+
+
+def test_ring_skips_unavailable():
+    """Недоступный инстанс пропускается, чужие ключи не двигаются."""
+    ring = HashRing()
+    ring.rebuild({url: 1 for url in NODES})
+    down = NODES[0]
+    alive = NODES[1:]
+    for key in KEYS[:2000]:
+        owner = ring.lookup(key)
+        fallback = ring.lookup(key, alive)
+        assert fallback in alive
+        if owner != down:
+            assert fallback == owner
+    assert ring.lookup("key", []) is None
+
+
+def test_ring_weights():
+    """Вес 2 — примерно вдвое больше ключей."""
+    ring = HashRing()
+    ring.rebuild({NODES[0]: 2, NODES[1]: 1})
+    load = Counter(ring.lookup(key) for key in KEYS)
+    assert 0.6 < load[NODES[0]] / len(KEYS) < 0.75
+
+
+def test_key_extractors():
+    headers = {"X-User": "alice"}
+    assert make_key_extractor("path")("/a/b", headers, "") == "/a/b"
+    assert make_key_extractor("path:1")("/users/42/x", headers, "") == "42"
+    assert make_key_extractor("path:5")("/users/42", headers, "") is None
+    assert make_key_extractor("header:X-User")("/", headers, "") == "alice"
+    assert make_key_extractor("query:id")("/", headers, "a=1&id=7") == "7"
+    assert make_key_extractor("query:id")("/", headers, "a=1") is None
+    for spec in ("cookie:x", "path:x", "header:"):
+        with pytest.raises(ValueError):
+            make_key_extractor(spec)
+
+
+@pytest.fixture
+def hashed_balancer():
+    """Балансировщик с consistent_hash и 10 «доступными» инстансами."""
+    saved = dict(balancer.instance_status)
+    hash_key = balancer.HASH_KEY
+    for url in saved:
+        balancer.unregister_instance(url)
+    for url in NODES:
+        balancer.register_instance(url)
+        balancer.instance_status[url] = True
+    balancer.set_strategy("consistent_hash", "path:1")
+    balancer.app.config["TESTING"] = True
+    yield balancer.app.test_client()
+    for url in list(balancer.instances):
+        balancer.unregister_instance(url)
+    for url, ok in saved.items():
+        balancer.register_instance(url)
+        balancer.instance_status[url] = ok
+    balancer.set_strategy(balancer.STRATEGY, hash_key)
+
+
+def routes(keys):
+    return {key: balancer.get_next_instance(key=key) for key in keys}
+
+
+def test_ui_add_remove_moves_few_keys(hashed_balancer):
+    """Добавление и удаление через web UI двигает ~1/N ключей."""
+    keys = KEYS[:5000]
+    before = routes(keys)
+    assert routes(keys) == before  # один ключ — один инстанс
+
+    hashed_balancer.post(
+        "/add_instance", data={"ip": "10.0.0.11", "port": "5000"}
+    )
+    balancer.instance_status["http://10.0.0.11:5000"] = True
+    after_add = routes(keys)
+    moved = sum(before[key] != after_add[key] for key in keys)
+    assert moved / len(keys) < 1.5 / 11
+
+    hashed_balancer.post(
+        "/remove_instance",
+        data={"index": str(balancer.instances.index(NODES[0]))},
+    )
+    after_remove = routes(keys)
+    moved = {key for key in keys if after_add[key] != after_remove[key]}
+    assert moved == {key for key in keys if after_add[key] == NODES[0]}
+
+    # Скрипты удаляют инстанс по адресу, а не по индексу
+    hashed_balancer.post(
+        "/remove_instance", data={"url": "http://10.0.0.11:5000"}
+    )
+    assert "http://10.0.0.11:5000" not in balancer.instances
+
+
+def test_strategy_endpoint_hash_key(hashed_balancer):
+    response = hashed_balancer.post(
+        "/strategy", json={"name": "rendezvous", "hash_key": "header:X-User"}
+    )
+    assert response.get_json() == {
+        "strategy": "rendezvous", "hash_key": "header:X-User"
+    }
+    response = hashed_balancer.post(
+        "/strategy", json={"name": "rendezvous", "hash_key": "cookie:x"}
+    )
+    assert response.status_code == 400
+    assert balancer.HASH_KEY == "header:X-User"
+
+
+# ------------------------------------------------------
+# Стратегии балансировки
+# ------------------------------------------------------
+
+def test_round_robin_and_weighted():
+    stats = BackendStats()
+    a, b, c = NODES[:3]
+    rr = RoundRobin({})
+    assert [rr.choose([a, b, c], stats) for _ in range(6)] == [a, b, c] * 2
+
+    wrr = WeightedRoundRobin({a: 3, b: 1})
+    picks = [wrr.choose([a, b], stats) for _ in range(8)]
+    assert Counter(picks) == {a: 6, b: 2}
+    assert b in picks[:4] and b in picks[4:]  # не пачкой подряд
+
+
+def test_least_outstanding_and_p2c():
+    stats = BackendStats()
+    a, b, c = NODES[:3]
+    lo = LeastOutstanding({})
+    stats.acquire(lo, [a])
+    stats.acquire(lo, [b])
+    assert stats.acquire(lo, [a, b, c]) == c
+    stats.release(a, 0.01)
+    assert stats.acquire(lo, [a, b, c]) == a  # освободившийся
+
+    p2c = PowerOfTwoChoices({})
+    assert p2c.choose([b], stats) == b
+    # Из двух кандидатов — с меньшим числом незавершённых
+    assert {p2c.choose([a, NODES[3]], stats) for _ in range(20)} == \
+        {NODES[3]}
+
+
+def test_backend_stats_acquire_is_atomic():
+    stats = BackendStats()
+    strategy = LeastOutstanding({})
+    candidates = NODES[:4]
+
+    def work():
+        for _ in range(200):
+            stats.acquire(strategy, candidates)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Выбор и отметка под одним замком: ни один выбор не потерян,
+    # и нагрузка разошлась поровну
+    assert [stats.outstanding(url) for url in candidates] == [400] * 4
+
+
+def test_strategy_switch_at_runtime(backends, monkeypatch):
+    first = backends(EchoBackend)
+    second = backends(EchoBackend)
+    monkeypatch.setitem(balancer.instance_weights, first, 3)
+    client = balancer.app.test_client()
+    try:
+        # Запрос, начатый при одной стратегии, завершается при другой
+        started = balancer.get_next_instance()
+        response = client.post("/strategy",
+                               json={"name": "weighted_round_robin"})
+        assert response.get_json()["strategy"] == "weighted_round_robin"
+        balancer.finish_request(started, time.perf_counter(), True)
+        assert balancer.backend_stats.outstanding(started) == 0
+
+        routed = Counter()
+        for _ in range(8):
+            response = client.get("/process")
+            assert response.data == b"/process"
+            routed[response.headers["X-Routed-To"]] += 1
+        assert routed == {first: 6, second: 2}
+
+        response = client.post("/strategy", json={"name": "fastest"})
+        assert response.status_code == 400
+        assert "fastest" in response.get_json()["error"]
+        assert client.get("/strategy").get_json()["strategy"] == \
+            "weighted_round_robin"
+    finally:
+        balancer.set_strategy(balancer.STRATEGY)
+
+
+def test_peak_ewma_unsampled_instance_is_not_free():
+    stats = BackendStats()
+    strategy = PeakEwma({})
+    fast, slow, new = NODES[:3]
+    stats.release(fast, 0.1)
+    stats.release(slow, 0.2)
+
+    # Инстанс без замеров стоит как самый медленный (0.2 с), так что
+    # до его первого ответа на него не уходят все запросы подряд
+    chosen = Counter(
+        stats.acquire(strategy, [fast, slow, new]) for _ in range(6)
+    )
+    assert chosen[fast] >= 3
+    assert 1 <= chosen[new] <= 2
+
+
+def test_failure_counts_as_penalty_latency(monkeypatch):
+    monkeypatch.setattr(balancer, "backend_stats", BackendStats())
+    url = NODES[0]
+    try:
+        balancer.finish_request(url, time.perf_counter(), False)
+        assert balancer.backend_stats.latency(url) == \
+            balancer.FAILURE_PENALTY
+        balancer.finish_request(url, time.perf_counter(), True)
+        assert balancer.backend_stats.latency(url) > 1  # снижается плавно
+    finally:
+        balancer.breakers.forget(url)
+
+
+# ------------------------------------------------------
+# Кэш ответов
+# ------------------------------------------------------
+
+def make_entry(body=b"x", ttl=60):
+    return CacheEntry(200, [("Content-Length", str(len(body)))], body, ttl,
+                      NODES[0])
+
+
+def fill(cache, key, entry):
+    state, _, flight = cache.lookup(key)
+    assert state == "MISS"
+    cache.complete(key, flight, entry)
+
+
+def test_cache_ttl_from_headers_and_routes():
+    cache = ResponseCache(default_ttl=0, route_ttls={"/api": 5, "/api/x": 9})
+    assert cache.ttl_for("/api/x/1", "") == 9
+    assert cache.ttl_for("/api/y", "") == 5
+    assert cache.ttl_for("/other", "") == 0
+    assert cache.ttl_for("/other", "public, max-age=30") == 30
+    assert cache.ttl_for("/api", "max-age=30, s-maxage=3") == 3
+    for value in ("no-store", "no-cache", "private, max-age=60"):
+        assert cache.ttl_for("/api", value) == 0
+
+    ok = [("Content-Length", "2")]
+    assert cache.cacheable("/api", 200, ok) == 5
+    assert cache.cacheable("/api", 500, ok) == 0
+    assert cache.cacheable("/api", 200, ok + [("Set-Cookie", "a=1")]) == 0
+    assert cache.cacheable("/api", 200, ok + [("Vary", "Cookie")]) == 0
+    assert cache.cacheable("/api", 200, []) == 0  # длина неизвестна
+
+
+def test_cache_lru_and_expiry():
+    cache = ResponseCache(max_bytes=10)
+    fill(cache, "/a", make_entry(b"aaaa"))
+    fill(cache, "/b", make_entry(b"bbbb"))
+    assert cache.lookup("/a")[0] == "HIT"  # /a теперь самый свежий
+    fill(cache, "/c", make_entry(b"cccc"))
+    assert cache.lookup("/b")[0] == "MISS"
+    assert cache.lookup("/a")[0] == "HIT"
+    assert cache.stats()["evicted"] == 1
+
+    fill(cache, "/old", make_entry(b"o", ttl=0.01))
+    time.sleep(0.02)
+    assert cache.lookup("/old")[0] == "MISS"
+
+
+def test_cache_request_directives():
+    cache = ResponseCache()
+    fill(cache, "/a", make_entry())
+    assert cache.lookup("/a", "no-store")[0] == "BYPASS"
+    state, _, flight = cache.lookup("/a", "no-cache")
+    assert state == "MISS"  # обновляет запись
+    cache.complete("/a", flight, make_entry(b"new"))
+    assert cache.lookup("/a", "max-age=60")[1].body == b"new"
+
+
+@pytest.fixture
+def cached_balancer():
+    """Балансировщик с кэшем и одним медленным инстансом, считающим вызовы."""
+    calls = Counter()
+
+    @Request.application
+    def backend(request):
+        calls[request.path] += 1
+        time.sleep(0.2)
+        cache_control = request.args.get("cc", "")
+        return WsgiResponse(f"{request.path} {calls[request.path]}",
+                            headers={"Cache-Control": cache_control})
+
+    server = make_server("127.0.0.1", 0, backend, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    saved = dict(balancer.instance_status)
+    for inst in saved:
+        balancer.unregister_instance(inst)
+    balancer.register_instance(url)
+    balancer.instance_status[url] = True
+    balancer.response_cache = ResponseCache(route_ttls={"/cached": 60})
+    yield balancer.app.test_client(), calls
+
+    balancer.response_cache = None
+    balancer.unregister_instance(url)
+    for inst, ok in saved.items():
+        balancer.register_instance(inst)
+        balancer.instance_status[inst] = ok
+    server.shutdown()
+
+
+def test_cache_coalesces_concurrent_misses(cached_balancer):
+    client, calls = cached_balancer
+    results = []
+
+    def get():
+        response = client.get("/cached/item")
+        results.append((response.data, response.headers["X-Cache"]))
+
+    threads = [threading.Thread(target=get) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls["/cached/item"] == 1
+    assert {body for body, _ in results} == {b"/cached/item 1"}
+    assert sorted(state for _, state in results) == \
+        ["COALESCED"] * 9 + ["MISS"]
+    assert client.get("/cached/item").headers["X-Cache"] == "HIT"
+    stats = balancer.response_cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 9, 1)
+
+
+def test_cache_respects_cache_control(cached_balancer):
+    client, calls = cached_balancer
+    client.get("/cached/x?cc=no-store")
+    response = client.get("/cached/x?cc=no-store")
+    assert response.data == b"/cached/x 2"
+    assert response.headers["X-Cache"] == "MISS"
+
+    # Маршрута нет в CACHE_ROUTES, но max-age разрешает кэш
+    client.get("/other?cc=max-age=60")
+    response = client.get("/other?cc=max-age=60")
+    assert response.headers["X-Cache"] == "HIT"
+    assert calls["/other"] == 1
+
+    # Без max-age и TTL маршрута ответ не кэшируется
+    client.get("/plain")
+    client.get("/plain")
+    assert calls["/plain"] == 2
+
+
+# ------------------------------------------------------
+# Метрики
+# ------------------------------------------------------
+
+def test_metrics_sum_over_threads():
+    """Осколки потоков, в том числе завершившихся, суммируются точно."""
+    m = Metrics()
+
+    def work():
+        for i in range(1000):
+            m.inc("requests", (("route", "/a"),))
+            m.observe("latency", (("route", "/a"),), (i % 100 + 1) / 1000)
+
+    for _ in range(3):  # потоки завершаются — их осколки в архиве
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    counters, histograms = m.collect()
+    assert counters[("requests", (("route", "/a"),))] == 24000
+    assert sum(histograms[("latency", (("route", "/a"),))][:-1]) == 24000
+
+    p50, p99 = m.quantiles(histograms, "latency", (("route", "/a"),),
+                           (0.5, 0.99))
+    assert 0.045 < p50 < 0.055
+    assert 0.090 < p99 < 0.110
+
+
+def requests_total(text, route):
+    line = (f'balancer_requests_total{{route="{route}",method="GET",'
+            f'code="200"}}')
+    for row in text.splitlines():
+        if row.startswith(line + " "):
+            return int(float(row.split()[-1]))
+    return 0
+
+
+def test_metrics_endpoint(cached_balancer):
+    client, _ = cached_balancer
+    # Метрики общие для всех тестов — сравниваем приращения
+    before = client.get("/metrics").get_data(as_text=True)
+    # Тело нужно дочитать: иначе запрос к инстансу не считается успешным
+    assert client.get("/process/1").data == b"/process/1 1"
+    assert client.get("/process/2").data == b"/process/2 1"
+    # Неизвестные маршруты сводятся к одной метке
+    assert client.get("/random/a").data == b"/random/a 1"
+    assert client.get("/other-random").data == b"/other-random 1"
+    text = client.get("/metrics").get_data(as_text=True)
+
+    assert "# TYPE balancer_requests_total counter" in text
+    for route in ("/process", "other"):
+        assert requests_total(text, route) - \
+            requests_total(before, route) == 2
+    assert "/random" not in text
+    assert 'balancer_requests_in_flight{route="/process"} 0' in text
+    inst = balancer.instances[0]
+    assert (f'balancer_backend_requests_total{{backend="{inst}",'
+            f'outcome="ok"}} 4') in text
+    assert (f'balancer_backend_request_duration_seconds_count'
+            f'{{backend="{inst}"}} 4') in text
+    assert f'balancer_backend_up{{backend="{inst}"}} 1' in text
+
+    latency = client.get("/latency").get_json()
+    assert set(latency[inst]) == {"p50_ms", "p95_ms", "p99_ms"}
+    assert 150 < latency[inst]["p50_ms"] < 300  # инстанс отвечает за 0.2 с
+
+
+# ------------------------------------------------------
+# Инстансы для тестов прокси
+# ------------------------------------------------------
+
+class EchoBackend(BaseHTTPRequestHandler):
+    """Инстанс для тестов прокси: HTTP/1.1 с keep-alive, отвечает путём."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    """
+    Подменяет инстансы балансировщика тестовыми. start(handler)
+    запускает http.server с этим обработчиком и добавляет его как
+    доступный инстанс; start(None) добавляет адрес, на котором никто
+    не слушает. Возвращает URL.
+    """
+    # Фоновые проверки /health не меняют доступность тестовых инстансов
+    monkeypatch.setattr(balancer.health_checker, "on_result",
+                        lambda url, ok: None)
+    saved = dict(balancer.instance_status)
+    for url in saved:
+        balancer.unregister_instance(url)
+    servers = []
+
+    def start(handler):
+        if handler is None:
+            url = f"http://127.0.0.1:{free_port()}"
+        else:
+            server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            servers.append(server)
+            url = f"http://127.0.0.1:{server.server_port}"
+        balancer.register_instance(url)
+        balancer.instance_status[url] = True
+        return url
+
+    yield start
+    for url in list(balancer.instances):
+        balancer.unregister_instance(url)
+    for url, ok in saved.items():
+        balancer.register_instance(url)
+        balancer.instance_status[url] = ok
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def random_bytes(size, seed=1):
+    return random.Random(seed).randbytes(size)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+# ------------------------------------------------------
+# Пулы соединений
+# ------------------------------------------------------
+
+class ClosingBackend(EchoBackend):
+    """Закрывает соединение после ответа, не предупреждая клиента."""
+
+    def do_GET(self):
+        super().do_GET()
+        self.close_connection = True
+
+
+def get_via(pool, path="/process"):
+    conn, reused = pool.acquire()
+    conn.request("GET", path)
+    body = conn.getresponse().read()
+    pool.release(conn)
+    return body, reused
+
+
+def test_pool_reuses_and_prunes_idle(backends):
+    pool = ConnectionPool(backends(EchoBackend), size=2, idle_timeout=0.2)
+    assert get_via(pool) == (b"/process", False)
+    assert get_via(pool) == (b"/process", True)
+    assert pool.stats() == {"size": 2, "in_use": 0, "idle": 1,
+                            "created": 1, "reused": 1, "discarded": 0}
+
+    time.sleep(0.3)  # дольше idle_timeout
+    assert pool.stats()["idle"] == 0
+    assert pool.stats()["discarded"] == 1
+    assert get_via(pool) == (b"/process", False)
+    pool.close()
+
+
+def test_pool_timeout_when_full_or_closed():
+    pool = ConnectionPool(NODES[0], size=1, timeout=0.05)
+    conn, _ = pool.acquire()  # соединяется лениво, при первом запросе
+    start = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.monotonic() - start >= 0.05
+
+    # Освободившееся соединение достаётся ждущему
+    waiter = threading.Timer(0.02, pool.release, (conn,))
+    waiter.start()
+    assert pool.acquire(timeout=1)[1] is True
+    waiter.join()
+
+    pool.close()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+
+def test_pool_stats_and_remove_instance(backends):
+    url = backends(EchoBackend)
+    client = balancer.app.test_client()
+    for _ in range(3):
+        assert client.get("/process").data == b"/process"
+    stats = client.get("/pool_stats").get_json()[url]
+    assert (stats["in_use"], stats["idle"], stats["created"],
+            stats["reused"]) == (0, 1, 1, 2)
+
+    pool = balancer.pools.get(url)
+    client.post("/remove_instance", data={"url": url})
+    assert url not in client.get("/pool_stats").get_json()
+    assert pool.stats()["idle"] == 0
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+
+def test_open_upstream_retries_stale_connection(backends):
+    pool = ConnectionPool(backends(ClosingBackend))
+    assert get_via(pool) == (b"/process", False)
+    time.sleep(0.05)  # инстанс уже закрыл соединение, лежащее в пуле
+
+    conn, resp = open_upstream(pool, "GET", "/again", [])
+    assert resp.read() == b"/again"
+    pool.release(conn)
+    stats = pool.stats()
+    assert (stats["created"], stats["reused"], stats["discarded"]) == \
+        (2, 1, 1)
+    pool.close()
+
+
+# ------------------------------------------------------
+# Прозрачное проксирование потоком
+# ------------------------------------------------------
+
+class StreamingBackend(EchoBackend):
+    """
+    GET отдаёт chunked-ответ: первый кусок сразу, второй — после
+    release; POST отвечает длиной и суммой прочитанного тела.
+    """
+
+    release = None
+    tail = (b"second",)  # куски после release
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Backend", "stream")
+        self.end_headers()
+        for chunk in (b"first", None, *self.tail, b""):
+            if chunk is None:
+                self.release.wait(5)
+                continue
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        data = self.rfile.read(length)
+        body = f"{len(data)} {hashlib.sha256(data).hexdigest()}".encode()
+        self.send_response(201)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_proxy_streams_response_chunks(backends, monkeypatch):
+    monkeypatch.setattr(StreamingBackend, "release", threading.Event())
+    url = backends(StreamingBackend)
+    client = balancer.app.test_client()
+    response = client.get("/stream", buffered=False)
+    assert response.status_code == 200
+    assert response.headers["X-Routed-To"] == url
+    assert response.headers["X-Backend"] == "stream"
+    assert "Transfer-Encoding" not in response.headers
+
+    # Первый кусок доходит до клиента, пока инстанс ещё не ответил
+    chunks = response.iter_encoded()
+    assert next(chunks) == b"first"
+    StreamingBackend.release.set()
+    assert b"".join(chunks) == b"second"
+    response.close()
+    assert balancer.pools.get(url).stats()["idle"] == 1
+
+    # Соединение пригодно для следующего запроса (ответ с Content-Length)
+    for data in (b"x", b"yz"):
+        response = client.post("/upload", data=data)
+        assert response.data.startswith(b"%d " % len(data))
+    stats = balancer.pools.get(url).stats()
+    assert (stats["created"], stats["reused"], stats["discarded"]) == \
+        (1, 2, 0)
+
+
+def test_client_abort_is_not_backend_failure(backends, monkeypatch):
+    monkeypatch.setattr(StreamingBackend, "release", threading.Event())
+    url = backends(StreamingBackend)
+    client = balancer.app.test_client()
+
+    # Клиенты уходят посреди ответа чаще, чем нужно для срабатывания
+    for _ in range(balancer.BREAKER_THRESHOLD + 1):
+        response = client.get("/stream", buffered=False)
+        assert next(response.iter_encoded()) == b"first"
+        response.close()
+
+    assert balancer.breakers.snapshot()[url] == {
+        "state": "closed", "failures": 0, "retry_in": 0.0
+    }
+    stats = balancer.pools.get(url).stats()
+    assert stats["in_use"] == 0 and stats["idle"] == 0  # недочитанные
+    counters, _ = balancer.metrics.collect()
+    assert counters[("balancer_backend_requests_total",
+                     (("backend", url), ("outcome", "aborted")))] == \
+        balancer.BREAKER_THRESHOLD + 1
+    StreamingBackend.release.set()
+
+
+def test_proxy_streams_request_body(backends):
+    backends(StreamingBackend)
+    data = random_bytes(3 * 1024 * 1024)
+    response = balancer.app.test_client().post("/upload", data=data)
+    assert response.status_code == 201
+    assert response.data.decode() == \
+        f"{len(data)} {hashlib.sha256(data).hexdigest()}"
+
+
+# ------------------------------------------------------
+# Предохранитель
+# ------------------------------------------------------
+
+class FakeTime:
+    """Подменяет модуль time: monotonic() возвращает now."""
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+
+def test_breaker_transitions(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(health, "time", clock)
+    breakers = CircuitBreakers(threshold=3, backoff=1, max_backoff=3,
+                               trials=1, trial_timeout=5)
+    url = NODES[0]
+
+    def state():
+        return breakers.snapshot()[url]
+
+    # closed: считаются отказы подряд, успех обнуляет счёт
+    breakers.record_failure(url)
+    breakers.record_failure(url)
+    breakers.record_success(url)
+    breakers.record_failure(url)
+    breakers.record_failure(url)
+    assert state() == {"state": "closed", "failures": 2, "retry_in": 0.0}
+    assert breakers.available(url)
+
+    # closed -> open на threshold-м отказе
+    breakers.record_failure(url)
+    assert state() == {"state": "open", "failures": 3, "retry_in": 1.0}
+    assert not breakers.available(url)
+
+    # open -> half_open по истечении backoff: один пробный запрос
+    clock.now += 1
+    assert breakers.available(url)
+    assert state()["state"] == "half_open"
+    breakers.on_start(url)
+    assert not breakers.available(url)
+    # Пробный запрос, не учтённый за trial_timeout, считается потерянным
+    clock.now += 5.1
+    assert breakers.available(url)
+
+    # Неудачная проба: снова open, backoff удваивается до max_backoff
+    for retry_in in (2.0, 3.0, 3.0):
+        breakers.on_start(url)
+        breakers.record_failure(url)
+        assert state()["state"] == "open"
+        assert state()["retry_in"] == retry_in
+        clock.now += retry_in
+        assert breakers.available(url)
+
+    # Удачная проба закрывает автомат и сбрасывает backoff
+    breakers.on_start(url)
+    breakers.record_success(url)
+    assert state() == {"state": "closed", "failures": 0, "retry_in": 0.0}
+    for _ in range(3):
+        breakers.record_failure(url)
+    assert state()["retry_in"] == 1.0
+
+    breakers.forget(url)
+    assert url not in breakers.snapshot()
+
+
+def test_breaker_takes_failing_instance_out_of_rotation(backends):
+    live = backends(EchoBackend)
+    dead = backends(None)
+    client = balancer.app.test_client()
+
+    # Отказы соединения с dead повторяются на live, пока предохранитель
+    # не выведет dead из ротации
+    for i in range(2 * balancer.BREAKER_THRESHOLD):
+        response = client.get(f"/process/{i}")
+        assert response.data == f"/process/{i}".encode()
+        assert response.headers["X-Routed-To"] == live
+    assert balancer.breakers.snapshot()[dead]["state"] == "open"
+    assert balancer.available_instances() == [live]
+
+
+def test_pool_timeout_is_not_backend_failure(backends, monkeypatch):
+    url = backends(EchoBackend)
+    pool = balancer.pools.get(url)
+    monkeypatch.setattr(pool, "size", 1)
+    monkeypatch.setattr(pool, "timeout", 0.05)
+    conn, _ = pool.acquire()  # единственное соединение занято
+    client = balancer.app.test_client()
+
+    # Переполнен пул балансировщика: 503 без отказа инстанса
+    for _ in range(balancer.BREAKER_THRESHOLD):
+        assert client.get("/process").status_code == 503
+        assert client.post("/process", data=b"x").status_code == 503
+    assert balancer.breakers.snapshot()[url]["failures"] == 0
+    assert balancer.backend_stats.outstanding(url) == 0
+
+    pool.release(conn, reusable=False)
+    assert client.get("/process").status_code == 200
+
+
+# ------------------------------------------------------
+# Хеджирование и бюджет повторов
+# ------------------------------------------------------
+
+def test_latency_window_percentile_cache():
+    window = LatencyWindow(size=100, min_samples=3, refresh_every=5)
+    window.add(0.1)
+    window.add(0.2)
+    assert window.percentile(0.5) is None
+    window.add(0.3)
+    assert window.percentile(0.5) == 0.2
+
+    # До refresh_every новых замеров отдаётся сохранённый перцентиль
+    for _ in range(4):
+        window.add(1.0)
+    assert window.percentile(0.5) == 0.2
+    window.add(1.0)
+    assert window.percentile(0.5) == 1.0
+    assert window.percentile(0.0) == 0.1  # у каждого q свой расчёт
+
+
+def test_retry_budget(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(hedging, "time", clock)
+    budget = RetryBudget(ratio=0.5, min_per_second=2, max_tokens=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    budget.deposit()  # два запроса по 0.5 — один жетон
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    clock.now += 0.5  # min_per_second пополняет запас со временем
+    assert budget.withdraw()
+    clock.now += 60
+    assert budget.balance() == 0
+    assert budget.withdraw() and budget.withdraw()  # не больше max_tokens
+    assert not budget.withdraw()
+
+
+class SlowBackend(EchoBackend):
+    """Отвечает, только когда release установлен (или через 5 с)."""
+
+    release = None
+
+    def do_GET(self):
+        self.release.wait(5)
+        super().do_GET()
+
+
+def test_hedge_goes_to_other_instance(backends, monkeypatch):
+    monkeypatch.setattr(balancer, "HEDGING", True)
+    monkeypatch.setattr(SlowBackend, "release", threading.Event())
+    monkeypatch.setattr(balancer, "retry_budget", RetryBudget())
+    # Hedge-задержка — 50 мс, пока замеры не сдвинут перцентиль
+    window = LatencyWindow(min_samples=1)
+    window.add(0.05)
+    monkeypatch.setattr(balancer, "upstream_latency", window)
+    slow = backends(SlowBackend)
+    fast = backends(EchoBackend)
+    client = balancer.app.test_client()
+    before = balancer.hedge_stats.snapshot()
+
+    # Round robin отправит один из двух запросов сначала на slow
+    for i in range(2):
+        start = time.perf_counter()
+        response = client.get(f"/process/{i}")
+        assert response.data == f"/process/{i}".encode()
+        assert response.headers["X-Routed-To"] == fast
+        assert time.perf_counter() - start < 2
+
+    after = balancer.hedge_stats.snapshot()
+    assert after["hedges"] - before["hedges"] >= 1
+    assert after["hedge_wins"] - before["hedge_wins"] >= 1
+    assert balancer.retry_budget.balance() < 100
+
+    # Проигравшая попытка дочитывается и не считается отказом
+    SlowBackend.release.set()
+    wait_for(lambda: balancer.backend_stats.outstanding(slow) == 0)
+    assert balancer.breakers.snapshot()[slow]["failures"] == 0
+
+
+def test_retry_budget_limits_retries(backends, monkeypatch):
+    # Без хеджей жетоны тратятся только на повторы
+    monkeypatch.setattr(balancer, "HEDGING", False)
+    dead = backends(None)
+    client = balancer.app.test_client()
+    before = balancer.hedge_stats.snapshot()
+
+    # Другого инстанса нет — жетон на повтор не берётся
+    budget = RetryBudget(ratio=0, min_per_second=0, max_tokens=1)
+    monkeypatch.setattr(balancer, "retry_budget", budget)
+    assert client.get("/process").status_code == 500
+    assert budget.balance() == 1
+
+    # Жетонов нет — запрос не повторяется на живом инстансе
+    live = backends(EchoBackend)
+    monkeypatch.setattr(balancer, "retry_budget", RetryBudget(
+        ratio=0, min_per_second=0, max_tokens=0))
+    statuses = []
+    for _ in range(2):
+        response = client.get("/process")
+        statuses.append(response.status_code)
+        if response.status_code == 200:
+            assert response.headers["X-Routed-To"] == live
+    assert sorted(statuses) == [200, 500]
+    after = balancer.hedge_stats.snapshot()
+    assert after["budget_exhausted"] - before["budget_exhausted"] == 1
+    assert after["retries"] == before["retries"]
+    assert balancer.breakers.snapshot()[dead]["failures"] == 2
+
+
+# ------------------------------------------------------
+# Асинхронный движок
+# ------------------------------------------------------
+
+@pytest.fixture
+def async_port():
+    """Запускает async_proxy.serve в отдельном потоке; порт прокси."""
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    task = loop.create_task(async_proxy.serve("127.0.0.1", port, ready.set))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert ready.wait(5)
+    yield port
+    # Соединения пулов закрываются в их цикле, пока он ещё работает
+    for url in list(async_proxy.pools):
+        async_proxy.remove_pool(url)
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(5)
+
+
+def fetch(conn, path):
+    conn.request("GET", path)
+    response = conn.getresponse()
+    return response.status, response.read(), response.getheader(
+        "X-Routed-To")
+
+
+def test_async_proxy_keep_alive_and_retry(backends, async_port):
+    live = backends(EchoBackend)
+    dead = backends(None)
+    retries = balancer.hedge_stats.snapshot()["retries"]
+    conn = HTTPConnection("127.0.0.1", async_port, timeout=5)
+
+    # Отказ соединения с dead повторяется на live в том же запросе
+    for i in range(4):
+        assert fetch(conn, f"/process/{i}") == (200, f"/process/{i}".encode(),
+                                                live)
+    assert balancer.hedge_stats.snapshot()["retries"] > retries
+    conn.close()
+
+    # Одно клиентское соединение — одно соединение с инстансом
+    stats = async_proxy.pool_stats()[live]
+    assert stats["created"] == 1 and stats["reused"] == 3
+    assert async_proxy.pool_stats()[dead]["created"] == 0
+
+
+def test_async_proxy_remove_instance_closes_pool(backends, async_port):
+    url = backends(EchoBackend)
+    conn = HTTPConnection("127.0.0.1", async_port, timeout=5)
+    assert fetch(conn, "/process")[0] == 200
+    pool = async_proxy.pools[url]
+    wait_for(lambda: pool.stats()["idle"] == 1)
+
+    balancer.app.test_client().post("/remove_instance", data={"url": url})
+    assert url not in async_proxy.pools
+    wait_for(lambda: pool.closed and pool.stats()["idle"] == 0)
+    assert fetch(conn, "/process")[0] == 503
+    conn.close()
+
+
+def test_async_proxy_rejects_bad_content_length(backends, async_port):
+    backends(EchoBackend)
+    for value in (b"abc", b"-5", b"1e3"):
+        with socket.create_connection(("127.0.0.1", async_port)) as sock:
+            sock.sendall(b"POST /process HTTP/1.1\r\nHost: x\r\n"
+                         b"Content-Length: " + value + b"\r\n\r\n")
+            reply = sock.makefile("rb").read()
+        assert reply.startswith(b"HTTP/1.1 400 Bad Request\r\n")
+        assert b"Connection: close" in reply
+
+
+def test_async_client_abort_is_not_backend_failure(backends, async_port,
+                                                    monkeypatch):
+    monkeypatch.setattr(StreamingBackend, "release", threading.Event())
+    # После release инстанс шлёт 4 МиБ — запись ушедшему клиенту падает
+    monkeypatch.setattr(StreamingBackend, "tail", (b"x" * 65536,) * 64)
+    url = backends(StreamingBackend)
+
+    for _ in range(balancer.BREAKER_THRESHOLD + 1):
+        with socket.create_connection(("127.0.0.1", async_port)) as sock:
+            sock.sendall(b"GET /stream HTTP/1.1\r\nHost: x\r\n\r\n")
+            received = b""
+            while b"first" not in received:
+                received += sock.recv(4096)
+    StreamingBackend.release.set()
+
+    wait_for(lambda: async_proxy.pool_stats()[url]["in_use"] == 0, 5)
+    assert balancer.breakers.snapshot()[url]["failures"] == 0
+    counters, _ = balancer.metrics.collect()
+    assert counters[("balancer_backend_requests_total",
+                     (("backend", url), ("outcome", "aborted")))] == \
+        balancer.BREAKER_THRESHOLD + 1
@@ -1,5 +1,11 @@
 from flask import Flask, jsonify
+import os
+import random
 import sys
+import threading
+import time
+
+from keepalive import serve
 
 app = Flask(__name__)
 
@@ -12,6 +18,33 @@ if len(sys.argv) != 2:
 
 PORT = int(sys.argv[1])
 
+# 2. Искусственная нагрузка для опытов с балансировщиком:
+# задержка обработки /process и число одновременно обрабатываемых
+# запросов (0 — без ограничения, остальные ждут в очереди)
+DELAY_MS = float(os.getenv("INSTANCE_DELAY_MS", "0"))
+WORKERS = int(os.getenv("INSTANCE_WORKERS", "0"))
+workers = threading.BoundedSemaphore(WORKERS) if WORKERS else None
+
+# 3. Редкие «зависания» (как паузы GC): с вероятностью STALL_RATE
+# запрос к /process ждёт ещё STALL_MS сверх обычной задержки
+STALL_RATE = float(os.getenv("INSTANCE_STALL_RATE", "0"))
+STALL_MS = float(os.getenv("INSTANCE_STALL_MS", "0"))
+
+# 4. Отказы: с вероятностью FAILURE_RATE /process отвечает 500
+FAILURE_RATE = float(os.getenv("INSTANCE_FAILURE_RATE", "0"))
+
+
+def simulate_work():
+    if STALL_RATE and random.random() < STALL_RATE:
+        time.sleep(STALL_MS / 1000)
+    if not DELAY_MS:
+        return
+    if workers is None:
+        time.sleep(DELAY_MS / 1000)
+        return
+    with workers:
+        time.sleep(DELAY_MS / 1000)
+
 
 @app.route("/health")
 def health():
@@ -25,6 +58,12 @@ def health():
 @app.route("/process")
 def process():
     """Маршрут обработки основных запросов."""
+    simulate_work()
+    if FAILURE_RATE and random.random() < FAILURE_RATE:
+        return jsonify({
+            "error": "Искусственный отказ",
+            "instance": PORT
+        }), 500
     return jsonify({
         "message": "Запрос обработан",
         "instance": PORT
@@ -33,4 +72,8 @@ def process():
 
 if __name__ == "__main__":
     print(f"Запуск серверного инстанса на порту {PORT}")
-    app.run(host="127.0.0.1", port=PORT)
+    # Вместо app.run: встроенный сервер Flask закрывает соединение
+    # после каждого ответа, а балансировщик держит пул keep-alive.
+    # Несколько процессов и портов: python prefork.py app_instance.py
+    # --ports 5001-5003 --workers 4
+    serve(app, "127.0.0.1", PORT)
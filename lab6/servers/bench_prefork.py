@@ -0,0 +1,170 @@
+"""
+Масштабирование prefork.py по числу процессов.
+
+Для каждого значения --workers приложение запускается через
+prefork.py (--threads потоков в процессе), после чего --connections
+keep-alive соединений asyncio шлют запросы подряд --duration секунд.
+Печатаются пропускная способность, p50/p99 и ускорение относительно
+первой строки.
+
+По умолчанию нагрузка — POST /analyze из РГЗ с текстом в --words
+слов: разбор текста занимает процессор, и с потоками одного процесса
+его ограничивает GIL, а процессы работают параллельно (ускорение
+не больше числа ядер). Для приложения, которое в основном ждёт,
+например app_instance.py с INSTANCE_DELAY_MS, важнее --threads.
+
+Запуск: python bench_prefork.py [--workers 1,2,4] [--threads 8]
+        [--connections 32] [--duration 5] [--words 2000]
+        python bench_prefork.py --app app_instance.py --path /process
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RGZ_APP = os.path.join(HERE, "..", "..", "RGZ", "app.py")
+
+WORDS = ("мир", "текст", "анализ", "слово", "запрос", "сервер",
+         "процесс", "поток", "данные", "ответ", "balancer", "worker")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Порт {port} не открылся")
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q))
+    return sorted_values[index]
+
+
+def make_request(method, path, body):
+    head = (f"{method} {path} HTTP/1.1\r\nHost: bench\r\n"
+            f"Connection: keep-alive\r\n")
+    if body is not None:
+        head += (f"Content-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n")
+    return head.encode() + b"\r\n" + (body or b"")
+
+
+async def client(port, request, deadline, latencies, errors):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(
+                    "127.0.0.1", port
+                )
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b"\r\n\r\n")
+            lower = head.lower()
+            length = int(lower.split(b"content-length:")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            if head.startswith(b"HTTP/1.1 200"):
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[0] += 1
+            if b"connection: close" in lower:
+                writer.close()
+                writer = None
+        except (OSError, EOFError, IndexError, ValueError):
+            errors[0] += 1
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(port, request, connections, duration):
+    latencies, errors = [], [0]
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, request, deadline, latencies, errors)
+        for _ in range(connections)
+    ))
+    return time.perf_counter() - start, sorted(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--app", default=RGZ_APP,
+                        help="файл приложения[:имя объекта]")
+    parser.add_argument("--path", default="/analyze")
+    parser.add_argument("--words", type=int, default=2000,
+                        help="слов в тексте для POST /analyze")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    if args.path == "/analyze":
+        rng = random.Random(1)
+        text = " ".join(rng.choice(WORDS) for _ in range(args.words))
+        body = json.dumps({"text": text}, ensure_ascii=False).encode()
+        request = make_request("POST", args.path, body)
+    else:
+        request = make_request("GET", args.path, None)
+
+    print(f"{args.app} {args.path}, ядер: {os.cpu_count()}, "
+          f"{args.connections} соединений, {args.duration:g} с на замер")
+    print(f"{'процессов':>9} {'потоков':>8} {'зап/с':>8} {'p50, мс':>8} "
+          f"{'p99, мс':>8} {'ошибок':>7} {'ускорение':>10}")
+    print("-" * 64)
+    base = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "prefork.py"), args.app,
+             "--ports", str(port), "--workers", str(workers),
+             "--threads", str(args.threads)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            # Корпус со снимком разрешает только один процесс, а /corpus
+            # в замере не участвует
+            env={**os.environ, "RGZ_CORPUS_SNAPSHOT": ""},
+        )
+        try:
+            wait_port(port)
+            asyncio.run(run_load(port, request, args.connections, 1))
+            elapsed, latencies, errors = asyncio.run(
+                run_load(port, request, args.connections, args.duration)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        rps = len(latencies) / elapsed
+        base = base or rps
+        if latencies:
+            p50 = percentile(latencies, 0.50) * 1000
+            p99 = percentile(latencies, 0.99) * 1000
+        else:
+            p50 = p99 = float("nan")
+        print(f"{workers:>9} {args.threads:>8} {rps:>8.0f} {p50:>8.1f} "
+              f"{p99:>8.1f} {errors:>7} {rps / base:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
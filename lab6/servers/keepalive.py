@@ -0,0 +1,203 @@
+import socket
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import (
+    ServerHandler, WSGIRequestHandler, WSGIServer, make_server
+)
+
+# ------------------------------------------------------
+# WSGI-сервер с keep-alive для инстансов
+#
+# Встроенный сервер Flask (werkzeug) закрывает соединение после каждого
+# ответа, поэтому пул соединений балансировщика с ним бесполезен.
+# Здесь стандартный wsgiref доработан до HTTP/1.1: приложение читает
+# тело запроса прямо из сокета в пределах Content-Length (или
+# декодированное из Transfer-Encoding: chunked), остаток дочитывается
+# после ответа, и соединение с ответом, у которого есть
+# Content-Length, остаётся открытым для следующего запроса.
+# ------------------------------------------------------
+
+# Сколько секунд ждать следующего запроса по открытому соединению
+IDLE_TIMEOUT = 60
+CHUNK_SIZE = 64 * 1024
+# Предел длины строки размера чанка и строки трейлера
+MAX_CHUNK_LINE = 4096
+
+
+class LimitedInput:
+    """wsgi.input: ровно length байт тела запроса из сокета."""
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def drain(self):
+        """Дочитывает тело, не прочитанное приложением."""
+        while self.remaining:
+            if not self.read(CHUNK_SIZE):
+                raise ConnectionError("клиент оборвал тело запроса")
+
+
+class ChunkedInput:
+    """wsgi.input: тело запроса с Transfer-Encoding: chunked без
+    служебных строк; после последнего чанка — пустые строки."""
+
+    def __init__(self, rfile):
+        self.rfile = rfile
+        self.remaining = 0  # байт текущего чанка ещё не прочитано
+        self.started = False
+        self.done = False
+
+    def _line(self):
+        line = self.rfile.readline(MAX_CHUNK_LINE)
+        if not line.endswith(b"\n"):
+            raise ConnectionError("оборванное chunked-тело запроса")
+        return line
+
+    def _next_chunk(self):
+        """Есть ли ещё данные тела; при необходимости читает заголовок
+        следующего чанка (и трейлеры после последнего)."""
+        if self.remaining or self.done:
+            return not self.done
+        if self.started and self._line().strip():
+            raise ConnectionError("нет CRLF после чанка")
+        self.started = True
+        try:
+            size = int(self._line().split(b";", 1)[0], 16)
+        except ValueError:
+            raise ConnectionError("некорректный размер чанка")
+        if size < 0:
+            raise ConnectionError("некорректный размер чанка")
+        if size == 0:
+            while self._line().strip():
+                pass  # трейлеры приложению не передаются
+            self.done = True
+            return False
+        self.remaining = size
+        return True
+
+    def _read(self, size, line):
+        parts = []
+        while size != 0 and self._next_chunk():
+            limit = self.remaining if size < 0 else min(size, self.remaining)
+            data = (self.rfile.readline(limit) if line
+                    else self.rfile.read(limit))
+            if not data:
+                raise ConnectionError("клиент оборвал тело запроса")
+            self.remaining -= len(data)
+            parts.append(data)
+            if size > 0:
+                size -= len(data)
+            if line and data.endswith(b"\n"):
+                break
+        return b"".join(parts)
+
+    def read(self, size=-1):
+        return self._read(-1 if size is None else size, line=False)
+
+    def readline(self, size=-1):
+        return self._read(-1 if size is None else size, line=True)
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def drain(self):
+        """Дочитывает тело, не прочитанное приложением."""
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+class KeepAliveServerHandler(ServerHandler):
+    http_version = "1.1"
+
+    def close(self):
+        # Без Content-Length клиент читает ответ до закрытия соединения
+        if self.headers is None or "Content-Length" not in self.headers:
+            self.request_handler.close_connection = True
+        super().close()
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = IDLE_TIMEOUT
+    # Заголовки и тело уходят отдельными записями: без TCP_NODELAY
+    # вторая ждёт ACK первой (алгоритм Нейгла + отложенный ACK)
+    disable_nagle_algorithm = True
+    # Обработчик ответа; подклассы могут менять заголовки
+    server_handler_class = KeepAliveServerHandler
+
+    def handle(self):
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+            while not self.close_connection:
+                self.handle_one_request()
+        except (ConnectionError, socket.timeout):
+            pass
+
+    def handle_one_request(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+
+        environ = self.get_environ()
+        coding = self.headers.get("Transfer-Encoding")
+        if coding is None:
+            body = LimitedInput(
+                self.rfile, int(self.headers.get("Content-Length") or 0)
+            )
+        elif coding.strip().lower() == "chunked":
+            # Transfer-Encoding важнее Content-Length; длина тела
+            # неизвестна, и приложение читает wsgi.input до конца
+            body = ChunkedInput(self.rfile)
+            environ.pop("CONTENT_LENGTH", None)
+            environ["wsgi.input_terminated"] = True
+        else:
+            # Другие кодировки (gzip, ...) разобрать нельзя — где
+            # кончается тело, неизвестно; send_error закрывает соединение
+            self.send_error(501, "Unsupported Transfer-Encoding")
+            return
+
+        handler = self.server_handler_class(
+            body, self.wfile, self.get_stderr(), environ,
+            multithread=True,
+        )
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        body.drain()
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve(app, host, port):
+    """Запускает app на host:port, каждое соединение — в своём потоке."""
+    server = make_server(
+        host, port, app,
+        server_class=ThreadingWSGIServer,
+        handler_class=KeepAliveRequestHandler,
+    )
+    server.serve_forever()
@@ -0,0 +1,442 @@
+"""
+Запуск WSGI-приложения в нескольких процессах (pre-fork).
+
+Главный процесс открывает порты, загружает приложение и порождает
+--workers процессов на каждый порт; все процессы порта принимают
+соединения с общего сокета. В каждом процессе не больше --threads
+потоков, и соединение принимает только процесс со свободным потоком,
+поэтому нагрузка сама расходится по процессам. Соединения keep-alive,
+как в keepalive.py: поток занят соединением, пока клиент его держит.
+Если же все потоки процесса заняты, а новые соединения ждут в очереди
+порта, ответ уходит с Connection: close и поток освобождается.
+
+Сигналы главному процессу:
+  HUP        — плавный перезапуск: файл приложения загружается заново,
+               запускаются новые процессы, старые перестают принимать
+               соединения, дообслуживают начатые запросы и выходят;
+               порты всё это время открыты. Если новая версия не
+               загрузилась, работают старые процессы.
+  TERM, INT  — плавная остановка (не дольше --graceful-timeout с).
+Упавший процесс перезапускается.
+
+Приложение — файл и имя объекта в нём (по умолчанию app). Файл
+загружается отдельно для каждого порта с sys.argv = [файл, порт],
+так что app_instance.py, который берёт порт из командной строки,
+на каждом порту отвечает своим номером. Процесс, завершившийся
+штатно, выполняет обработчики atexit приложения.
+
+Приложение, состояние которого может принадлежать только одному
+процессу (например, корпус RGZ, сохраняемый в файл снимка), объявляет
+PREFORK_SINGLE_PROCESS = True. Такое приложение запускается одним
+процессом на одном порту (--workers 1) и загружается в самом рабочем
+процессе, а при перезапуске новый процесс стартует после выхода
+старого — так он читает снимок, записанный при выходе.
+
+Запуск: python prefork.py app_instance.py --ports 5001-5003
+        [--workers 4] [--threads 8] [--host 127.0.0.1]
+        python prefork.py ../../RGZ/app.py:app --ports 5001 --workers 1
+        RGZ_CORPUS_SNAPSHOT= python prefork.py ../../RGZ/app.py:app \\
+            --ports 5001,5002,5003
+"""
+import argparse
+import atexit
+import importlib.util
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer
+
+from keepalive import (
+    IDLE_TIMEOUT, KeepAliveRequestHandler, KeepAliveServerHandler
+)
+
+# Как часто процесс проверяет, не пора ли остановиться, с
+POLL_INTERVAL = 0.5
+
+# Сколько при остановке ждать следующего запроса по keep-alive
+# соединению (он получит ответ с Connection: close), прежде чем
+# закрыть соединение как простаивающее, с
+IDLE_GRACE = 1.0
+
+
+def log(message):
+    print(f"[prefork {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+def parse_ports(spec):
+    """'5001-5003,5010' -> [5001, 5002, 5003, 5010]."""
+    ports = []
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        ports.extend(range(int(first), int(last or first) + 1))
+    return ports
+
+
+def load_app(target, port):
+    """'путь/app.py:имя' -> объект приложения, загруженный для порта."""
+    path, _, name = target.partition(":")
+    return getattr(load_module(path, port), name or "app")
+
+
+def load_module(path, port):
+    """Модуль приложения, загруженный для порта."""
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    module_name = f"{os.path.splitext(os.path.basename(path))[0]}_{port}"
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sys.argv = [path, str(port)]
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+    return module
+
+
+def listen(host, port, backlog=1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    # Соединение может забрать другой процесс: accept не должен ждать
+    sock.setblocking(False)
+    return sock
+
+
+# ------------------------------------------------------
+# Рабочий процесс
+# ------------------------------------------------------
+
+class PreforkServerHandler(KeepAliveServerHandler):
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        if self.request_handler.server.should_close():
+            # Клиент узнает из ответа, что соединение больше не нужно
+            self.headers["Connection"] = "close"
+            self.request_handler.close_connection = True
+
+
+class PreforkRequestHandler(KeepAliveRequestHandler):
+    """
+    Соединение keep-alive, которое можно закрыть при остановке:
+    ответ на очередной запрос уходит с Connection: close, а
+    соединение без запросов закрывается через IDLE_GRACE с.
+    """
+    server_handler_class = PreforkServerHandler
+
+    def setup(self):
+        super().setup()
+        self.busy = False
+        with self.server.lock:
+            self.server.handlers.add(self)
+
+    def parse_request(self):
+        # Строка запроса прочитана: с этого момента запрос дообслуживается
+        with self.server.lock:
+            self.busy = True
+        return super().parse_request()
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        finally:
+            with self.server.lock:
+                self.busy = False
+                if self.server.draining:
+                    self.close_connection = True
+
+    def finish(self):
+        with self.server.lock:
+            self.server.handlers.discard(self)
+        super().finish()
+
+
+class WorkerServer(WSGIServer):
+    """WSGIServer на унаследованном сокете, с ограниченным пулом потоков."""
+
+    def __init__(self, sock, server_name, app, threads):
+        super().__init__(sock.getsockname(), PreforkRequestHandler,
+                         bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_name = server_name
+        self.server_port = sock.getsockname()[1]
+        self.setup_environ()
+        self.set_app(app)
+        self.threads = threads
+        self.slots = threading.Semaphore(threads)
+        self.active = 0
+        self.executor = ThreadPoolExecutor(threads)
+        self.lock = threading.Lock()
+        self.handlers = set()
+        self.draining = False
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            if not self.slots.acquire(timeout=POLL_INTERVAL):
+                continue
+            conn = None
+            try:
+                ready, _, _ = select.select([self.socket], [], [],
+                                            POLL_INTERVAL)
+                if ready:
+                    conn, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                pass   # соединение досталось другому процессу
+            if conn is None:
+                self.slots.release()
+                continue
+            self.executor.submit(self.serve_connection, conn, address)
+
+    def serve_connection(self, conn, address):
+        with self.lock:
+            self.active += 1
+        try:
+            self.finish_request(conn, address)
+        except Exception:
+            self.handle_error(conn, address)
+        finally:
+            self.shutdown_request(conn)
+            with self.lock:
+                self.active -= 1
+            self.slots.release()
+
+    def should_close(self):
+        """Закрыть ли соединение после текущего ответа."""
+        if self.draining:
+            return True
+        if self.active < self.threads:
+            return False
+        # Все потоки заняты: держать соединение, только если
+        # в очереди порта никто не ждёт
+        ready, _, _ = select.select([self.socket], [], [], 0)
+        return bool(ready)
+
+    def drain(self, timeout):
+        """Закрывает простаивающие соединения и ждёт начатые запросы."""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.draining = True
+        time.sleep(min(IDLE_GRACE, timeout))
+        with self.lock:
+            for handler in self.handlers:
+                if not handler.busy:
+                    try:
+                        handler.connection.shutdown(socket.SHUT_RD)
+                    except OSError:
+                        pass
+        for _ in range(self.threads):
+            if not self.slots.acquire(
+                    timeout=max(0.0, deadline - time.monotonic())):
+                return False
+        return True
+
+
+def worker_main(sock, server_name, app, threads, graceful_timeout):
+    server = WorkerServer(sock, server_name, app, threads)
+
+    def stop(signum, frame):
+        server.stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    server.run()
+    if not server.drain(graceful_timeout):
+        log("не все запросы завершились за отведённое время")
+
+
+# ------------------------------------------------------
+# Главный процесс
+# ------------------------------------------------------
+
+class Master:
+    def __init__(self, target, host, ports, workers, threads,
+                 graceful_timeout):
+        self.target = target
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.sockets = {port: listen(host, port) for port in ports}
+        self.server_name = socket.getfqdn(host)
+        self.apps, self.single_process = self.load()
+        self.children = {}   # pid -> порт (текущее поколение)
+        self.retiring = {}   # pid -> срок, после которого KILL
+        self.signals = []
+
+    def load(self):
+        """
+        Загружает приложение для каждого порта; возвращает
+        ({порт: приложение}, PREFORK_SINGLE_PROCESS). ValueError, если
+        приложению одного процесса назначено больше.
+        """
+        path, _, name = self.target.partition(":")
+        modules = {port: load_module(path, port) for port in self.sockets}
+        single = any(getattr(module, "PREFORK_SINGLE_PROCESS", False)
+                     for module in modules.values())
+        if single and (self.workers > 1 or len(self.sockets) > 1):
+            raise ValueError(
+                f"{path}: состояние приложения принадлежит одному "
+                f"процессу (PREFORK_SINGLE_PROCESS), нужны --workers 1 "
+                f"и один порт"
+            )
+        apps = {port: getattr(module, name or "app")
+                for port, module in modules.items()}
+        return apps, single
+
+    def spawn(self, port):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                for other, sock in self.sockets.items():
+                    if other != port:
+                        sock.close()
+                # Приложение одного процесса загружается заново: копия
+                # из главного процесса не видит, что успел записать
+                # предыдущий рабочий процесс
+                app = (load_app(self.target, port) if self.single_process
+                       else self.apps[port])
+                worker_main(self.sockets[port], self.server_name, app,
+                            self.threads, self.graceful_timeout)
+            except BaseException:
+                code = 1
+                traceback.print_exc()
+            finally:
+                if code == 0:
+                    # os._exit не вызывает обработчики atexit, а
+                    # приложение в них сохраняет состояние
+                    atexit._run_exitfuncs()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = port
+
+    def spawn_all(self):
+        for port in self.sockets:
+            for _ in range(self.workers):
+                self.spawn(port)
+
+    def retire(self, pids):
+        deadline = time.monotonic() + self.graceful_timeout + 1
+        for pid in pids:
+            self.retiring[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def wait_retired(self):
+        while self.retiring:
+            time.sleep(0.1)
+            self.reap()
+            self.kill_overdue()
+
+    def reload(self):
+        try:
+            self.apps, self.single_process = self.load()
+        except Exception as exc:
+            log(f"новая версия не загрузилась, работают прежние "
+                f"процессы: {exc!r}")
+            return
+        old = list(self.children)
+        self.children = {}
+        if self.single_process:
+            # Новый процесс стартует, когда старый сохранил состояние
+            # и вышел; соединения тем временем ждут в очереди порта
+            self.retire(old)
+            self.wait_retired()
+            self.spawn_all()
+        else:
+            self.spawn_all()
+            self.retire(old)
+        log(f"перезапуск: {len(self.children)} новых процессов, "
+            f"{len(old)} завершаются")
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            port = self.children.pop(pid, None)
+            if port is not None:
+                log(f"процесс {pid} (порт {port}) завершился с кодом "
+                    f"{os.waitstatus_to_exitcode(status)}, перезапуск")
+                time.sleep(0.1)
+                self.spawn(port)
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def run(self):
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda s, f: self.signals.append(s))
+        self.spawn_all()
+        log(f"{self.target}: порты {sorted(self.sockets)}, по "
+            f"{self.workers} процессов на порт, по {self.threads} "
+            f"потоков в процессе")
+        while True:
+            time.sleep(POLL_INTERVAL)
+            signals, self.signals = self.signals, []
+            if signal.SIGTERM in signals or signal.SIGINT in signals:
+                break
+            if signal.SIGHUP in signals:
+                self.reload()
+            self.reap()
+            self.kill_overdue()
+
+        log("остановка")
+        self.retire(list(self.children))
+        self.children = {}
+        self.wait_retired()
+        for sock in self.sockets.values():
+            sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("target", help="файл приложения[:имя объекта]")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ports", default="5000",
+                        help="порты: 5001-5003 или 5001,5002")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="процессов на порт")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="потоков (одновременных соединений) "
+                             "в процессе")
+    parser.add_argument("--graceful-timeout", type=float,
+                        default=IDLE_TIMEOUT / 2,
+                        help="сколько ждать начатые запросы при "
+                             "перезапуске и остановке, с")
+    args = parser.parse_args()
+
+    try:
+        master = Master(args.target, args.host, parse_ports(args.ports),
+                        args.workers, args.threads, args.graceful_timeout)
+    except ValueError as exc:
+        parser.error(str(exc))
+    master.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import keepalive
+
+
+def received(environ, start_response):
+    """
+    Отвечает телом запроса: read() целиком, построчно (?lines) или
+    не читает его вовсе (?ignore).
+    """
+    stream = environ["wsgi.input"]
+    query = environ.get("QUERY_STRING")
+    if query == "lines":
+        body = b"|".join(stream)
+    elif query == "ignore":
+        body = b""
+    else:
+        body = stream.read()
+    start_response("200 OK", [("Content-Length", str(len(body)))])
+    return [body]
+
+
+@pytest.fixture(scope="module")
+def port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    threading.Thread(target=keepalive.serve,
+                     args=(received, "127.0.0.1", port), daemon=True).start()
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return port
+        except ConnectionRefusedError:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+
+
+def exchange(port, data):
+    """Отправляет data и читает всё до закрытия соединения сервером."""
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(data)
+        return sock.makefile("rb").read()
+
+
+def bodies(reply):
+    """Тела ответов (все с Content-Length) по порядку."""
+    result = []
+    while reply:
+        head, _, rest = reply.partition(b"\r\n\r\n")
+        length = int(head.lower().split(b"content-length: ")[1]
+                     .split(b"\r\n")[0])
+        result.append(rest[:length])
+        reply = rest[length:]
+    return result
+
+
+CLOSE = b"GET / HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+
+
+def test_chunked_body_with_extensions_and_trailers(port):
+    request = (
+        b"POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n"
+        b"Content-Length: 3\r\n\r\n"   # Transfer-Encoding важнее
+        b"5;name=value\r\nhello\r\n"
+        b"7\r\n, world\r\n"
+        b"0\r\nX-Checksum: 42\r\nX-Other: 1\r\n\r\n"
+    )
+    # За телом — следующий запрос в том же соединении
+    assert bodies(exchange(port, request + CLOSE)) == [b"hello, world", b""]
+
+
+def test_chunked_body_read_by_lines(port):
+    request = (
+        b"POST /?lines HTTP/1.1\r\nHost: x\r\n"
+        b"Transfer-Encoding: chunked\r\n\r\n"
+        b"4\r\nab\nc\r\n3\r\nd\ne\r\n0\r\n\r\n"
+    )
+    assert bodies(exchange(port, request + CLOSE)) == [b"ab\n|cd\n|e", b""]
+
+
+def test_unread_chunked_body_is_drained(port):
+    request = (
+        b"POST /?ignore HTTP/1.1\r\nHost: x\r\n"
+        b"Transfer-Encoding: chunked\r\n\r\n"
+        b"3\r\nabc\r\n0\r\n\r\n"
+    )
+    assert bodies(exchange(port, request + CLOSE)) == [b"", b""]
+
+
+def test_unsupported_transfer_encoding(port):
+    reply = exchange(port, b"POST / HTTP/1.1\r\nHost: x\r\n"
+                           b"Transfer-Encoding: gzip\r\n\r\nxx")
+    assert reply.startswith(b"HTTP/1.1 501 ")
+
+
+def test_malformed_chunk_closes_connection(port):
+    reply = exchange(port, b"POST / HTTP/1.1\r\nHost: x\r\n"
+                           b"Transfer-Encoding: chunked\r\n\r\nzz\r\n" + CLOSE)
+    assert b"200 OK" not in reply
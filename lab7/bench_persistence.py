@@ -0,0 +1,116 @@
+"""
+Бенчмарк задержки записи для режимов сохранения kv_store.
+
+Для каждого размера хранилища (по умолчанию 1k … 1M ключей) заполняет
+словарь, затем замеряет задержку одной операции set + сохранение
+в режимах log (журнал) и snapshot (перезапись data.json).
+
+SnapshotPersistence перезаписывает файл в фоновом потоке, и append()
+только будит его, поэтому в режиме snapshot замеряется синхронный
+write_snapshot — сама перезапись, которую делает этот поток.
+
+Запуск: python bench_persistence.py [--sizes 1000,10000] [--writes 2000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from persistence import LogPersistence, SnapshotPersistence, write_snapshot
+
+
+def percentile(values, p):
+    """Перцентиль по отсортированной выборке (ближайший ранг)."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+    return ordered[index]
+
+
+def measure(persistence, data, writes):
+    """Возвращает список задержек одной записи в микросекундах."""
+    latencies = []
+
+    def snapshot():
+        # Части снимка (значения, сроки) — здесь одна на всё хранилище
+        return [(dict(data), {})]
+
+    if isinstance(persistence, SnapshotPersistence):
+        def save(records):
+            write_snapshot(persistence.data_file, snapshot(),
+                           persistence.snapshot_format)
+    else:
+        def save(records):
+            persistence.append(records, snapshot)
+
+    for i in range(writes):
+        key = f"bench:{i}"
+        value = {"n": i, "payload": "x" * 32}
+        start = time.perf_counter()
+        data[key] = value
+        save([{"op": "set", "key": key, "value": value}])
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def run(size, writes, fsync, snapshot_limit):
+    """Замер для одного размера хранилища в обоих режимах."""
+    rows = []
+    base = {f"key:{i}": i for i in range(size)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "data.json")
+        log = LogPersistence(
+            data_file,
+            os.path.join(tmp, "data.log"),
+            fsync=fsync,
+            # Уплотнение в бенчмарке не нужно: меряем чистую запись
+            compact_bytes=1 << 62,
+        )
+        data, _, _, _ = log.load()
+        data.update(base)
+        rows.append(("log", size, writes, measure(log, data, writes)))
+        log.close()
+
+    if size <= snapshot_limit:
+        # Полная перезапись на больших размерах идёт секундами на запись,
+        # поэтому число операций уменьшаем
+        snapshot_writes = max(3, min(writes, 2_000_000 // size))
+        with tempfile.TemporaryDirectory() as tmp:
+            snap = SnapshotPersistence(os.path.join(tmp, "data.json"))
+            data = dict(base)
+            rows.append(
+                ("snapshot", size, snapshot_writes,
+                 measure(snap, data, snapshot_writes))
+            )
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--fsync", default="never",
+                        choices=["always", "interval", "never"])
+    parser.add_argument("--snapshot-limit", type=int, default=100_000,
+                        help="максимальный размер для режима snapshot")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    print(f"fsync={args.fsync}")
+    print(f"{'режим':10} {'ключей':>9} {'записей':>8} "
+          f"{'mean, мкс':>11} {'p50, мкс':>10} {'p99, мкс':>10}")
+    print("-" * 63)
+    for size in sizes:
+        for mode, n, count, lat in run(size, args.writes, args.fsync,
+                                       args.snapshot_limit):
+            print(f"{mode:10} {n:>9} {count:>8} "
+                  f"{statistics.mean(lat):>11.1f} "
+                  f"{percentile(lat, 50):>10.1f} "
+                  f"{percentile(lat, 99):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
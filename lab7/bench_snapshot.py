@@ -0,0 +1,108 @@
+"""
+Бенчмарк холодного старта хранилища: JSON-снимок против бинарного (mmap).
+
+Для каждого размера создаётся снимок в обоих форматах, затем в отдельном
+процессе замеряется время открытия StorageEngine, время чтения 100 ключей
+и пиковое потребление памяти процессом (VmHWM из /proc, иначе ru_maxrss).
+
+Запуск: python bench_snapshot.py [--sizes 10000,100000,1000000]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from persistence import LogPersistence
+from snapshot import json_to_binary
+from storage import StorageEngine
+
+
+def peak_rss_mb():
+    """
+    Пиковый RSS процесса в МБ. ru_maxrss в Linux наследуется от родителя
+    через fork, поэтому сначала пробуем VmHWM — он сбрасывается при exec.
+    """
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(data_dir, snapshot_format, touch):
+    """Выполняется в дочернем процессе: печатает замеры одной строкой JSON."""
+    start = time.perf_counter()
+    persistence = LogPersistence(
+        os.path.join(data_dir, "data.json"),
+        os.path.join(data_dir, f"{snapshot_format}.log"),
+        fsync="never",
+        snapshot_format=snapshot_format,
+    )
+    engine = StorageEngine(persistence)
+    startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(touch):
+        engine.get(f"key:{i * 7919 % touch}")
+    reads = time.perf_counter() - start
+
+    print(json.dumps({
+        "startup_ms": startup * 1000,
+        "reads_ms": reads * 1000,
+        "max_rss_mb": peak_rss_mb(),
+        "resident_keys": engine.stats()["resident_keys"],
+    }))
+    persistence.close()
+
+
+def measure(data_dir, snapshot_format, touch):
+    output = subprocess.check_output([
+        sys.executable, __file__, "--child", data_dir, snapshot_format,
+        str(touch),
+    ])
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--touch", type=int, default=100,
+                        help="сколько ключей прочитать после старта")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        data_dir, snapshot_format, touch = args.child
+        child(data_dir, snapshot_format, int(touch))
+        return
+
+    print(f"{'формат':7} {'ключей':>9} {'старт, мс':>10} "
+          f"{'чтение, мс':>11} {'RSS, МБ':>8} {'в памяти':>9}")
+    print("-" * 59)
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_file = os.path.join(tmp, "data.json")
+            with open(data_file, "w", encoding="utf-8") as f:
+                json.dump(
+                    {f"key:{i}": {"n": i, "payload": "x" * 64}
+                     for i in range(size)},
+                    f,
+                )
+            json_to_binary(data_file, os.path.join(tmp, "data.kvs"))
+
+            for snapshot_format in ("json", "binary"):
+                r = measure(tmp, snapshot_format, min(args.touch, size))
+                print(f"{snapshot_format:7} {size:>9} "
+                      f"{r['startup_ms']:>10.1f} {r['reads_ms']:>11.2f} "
+                      f"{r['max_rss_mb']:>8.1f} {r['resident_keys']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Бенчмарк пропускной способности StorageEngine в зависимости от числа потоков.
+
+Каждый поток выполняет смесь операций (по умолчанию 80% get, 20% set)
+над общим набором ключей. Для сравнения замеряется хранилище с одним
+шардом (один общий замок) и с несколькими шардами.
+
+Запуск: python bench_storage.py [--threads 1,2,4,8,16] [--shards 1,16]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from persistence import LogPersistence
+from storage import StorageEngine
+
+
+def run(shards, threads, ops, keys, write_ratio):
+    """Возвращает число операций в секунду."""
+    with tempfile.TemporaryDirectory() as tmp:
+        persistence = LogPersistence(
+            os.path.join(tmp, "data.json"),
+            os.path.join(tmp, "data.log"),
+            fsync="never",
+        )
+        engine = StorageEngine(persistence, shards=shards)
+        engine.set_many({f"key:{i}": i for i in range(keys)})
+
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(n):
+            rnd = random.Random(n)
+            names = [f"key:{rnd.randrange(keys)}" for _ in range(ops)]
+            writes = [rnd.random() < write_ratio for _ in range(ops)]
+            barrier.wait()
+            for name, write in zip(names, writes):
+                if write:
+                    engine.set(name, n)
+                else:
+                    engine.get(name)
+
+        pool = [threading.Thread(target=worker, args=(n,))
+                for n in range(threads)]
+        for t in pool:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        persistence.close()
+        return threads * ops / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", default="1,2,4,8,16")
+    parser.add_argument("--shards", default="1,16")
+    parser.add_argument("--ops", type=int, default=20000,
+                        help="операций на поток")
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{'шардов':>7} {'потоков':>8} {'ops/sec':>12}")
+    print("-" * 29)
+    for shards in (int(s) for s in args.shards.split(",")):
+        for threads in (int(t) for t in args.threads.split(",")):
+            rate = run(shards, threads, args.ops, args.keys, args.write_ratio)
+            print(f"{shards:>7} {threads:>8} {rate:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Бенчмарк: HTTP/JSON против RESP-интерфейса (tcp_server.py) на том же
+хранилище.
+
+Сервер запускается отдельным процессом (этот же скрипт с --serve):
+kv_store импортируется с временной папкой данных, HTTP обслуживается
+многопоточным werkzeug (он закрывает соединение после каждого ответа,
+так что http.client переподключается на каждый запрос), RESP —
+tcp_server.RespServer.
+Rate limit на время замера выключается.
+
+Клиенты — потоки, у каждого своё соединение. Для RESP команды
+отправляются пачками по --pipeline штук; задержка одной команды
+считается как время ответа на всю пачку.
+
+Запуск: python bench_tcp.py [--ops 20000] [--clients 4] [--pipeline 1,16,64]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def serve(data_dir, http_port, tcp_port):
+    """Выполняется в дочернем процессе: HTTP и RESP поверх одного store."""
+    os.environ["KV_DATA_DIR"] = data_dir
+    os.environ["KV_FSYNC"] = "never"
+
+    from werkzeug.serving import make_server
+
+    import kv_store
+    from tcp_server import RespServer
+
+    kv_store.limiter.enabled = False
+    RespServer(kv_store.store, "127.0.0.1", tcp_port).start_in_thread()
+
+    server = make_server("127.0.0.1", http_port, kv_store.app, threaded=True)
+    print("ready", flush=True)
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q))
+    return sorted_values[index]
+
+
+def run_clients(clients, worker):
+    """Запускает clients потоков, возвращает (время, все задержки)."""
+    latencies = [[] for _ in range(clients)]
+    threads = [
+        threading.Thread(target=worker, args=(n, latencies[n]))
+        for n in range(clients)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, sorted(x for part in latencies for x in part)
+
+
+# ------------------------------------------------------
+# HTTP-клиент
+# ------------------------------------------------------
+
+def http_worker(port, ops, keys):
+    def worker(n, latencies):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        for i in range(ops):
+            start = time.perf_counter()
+            conn.request("GET", f"/get/key:{(n * ops + i) % keys}")
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+        conn.close()
+    return worker
+
+
+# ------------------------------------------------------
+# RESP-клиент
+# ------------------------------------------------------
+
+def encode_command(*args):
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        arg = arg.encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def read_replies(sock, count, buf):
+    """
+    Дочитывает count ответов (bulk string или $-1). Возвращает остаток
+    буфера — ответы могут прийти частями.
+    """
+    while count:
+        end = buf.find(b"\r\n")
+        if end == -1:
+            buf += sock.recv(65536)
+            continue
+        length = int(buf[1:end]) if buf[:1] == b"$" else -1
+        total = end + 2 + (length + 2 if length >= 0 else 0)
+        if len(buf) < total:
+            buf += sock.recv(65536)
+            continue
+        buf = buf[total:]
+        count -= 1
+    return buf
+
+
+def resp_worker(port, ops, keys, pipeline):
+    def worker(n, latencies):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buf = b""
+        for batch_start in range(0, ops, pipeline):
+            batch = range(batch_start, min(ops, batch_start + pipeline))
+            payload = b"".join(
+                encode_command("GET", f"key:{(n * ops + i) % keys}")
+                for i in batch
+            )
+            start = time.perf_counter()
+            sock.sendall(payload)
+            buf = read_replies(sock, len(batch), buf)
+            latency = time.perf_counter() - start
+            latencies.extend([latency] * len(batch))
+        sock.close()
+    return worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ops", type=int, default=20000,
+                        help="операций на клиента")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--pipeline", default="1,16,64")
+    parser.add_argument("--serve", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        data_dir, http_port, tcp_port = args.serve
+        serve(data_dir, int(http_port), int(tcp_port))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "data.json"), "w", encoding="utf-8") as f:
+            json.dump({f"key:{i}": f"value-{i}" for i in range(args.keys)}, f)
+
+        http_port, tcp_port = free_port(), free_port()
+        server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", tmp,
+             str(http_port), str(tcp_port)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        try:
+            server.stdout.readline()
+
+            runs = [("http", 1, http_worker(http_port, args.ops, args.keys))]
+            for pipeline in (int(p) for p in args.pipeline.split(",")):
+                runs.append((
+                    "resp", pipeline,
+                    resp_worker(tcp_port, args.ops, args.keys, pipeline),
+                ))
+
+            print(f"{'протокол':8} {'конвейер':>9} {'оп/с':>10} "
+                  f"{'p50, мс':>9} {'p99, мс':>9}")
+            print("-" * 49)
+            for name, pipeline, worker in runs:
+                elapsed, latencies = run_clients(args.clients, worker)
+                total = args.clients * args.ops
+                print(f"{name:8} {pipeline:>9} {total / elapsed:>10.0f} "
+                      f"{percentile(latencies, 0.50) * 1000:>9.3f} "
+                      f"{percentile(latencies, 0.99) * 1000:>9.3f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from bisect import bisect_left, bisect_right, insort
+
+# ------------------------------------------------------
+# Упорядоченный индекс ключей для prefix- и range-запросов
+#
+# Ключи хранятся в списке отсортированных блоков длиной до 2 * load.
+# Поиск блока — бинарный поиск по максимумам блоков, вставка и удаление
+# сдвигают не больше одного блока, поэтому индекс обновляется
+# инкрементально и никогда не перестраивается целиком.
+# ------------------------------------------------------
+
+
+class SortedKeyIndex:
+    """Отсортированное множество строк-ключей."""
+
+    def __init__(self, load=512):
+        self._load = load
+        self._blocks = []
+        self._maxes = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, key):
+        """Добавляет ключ, которого ещё нет в индексе."""
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return
+
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            block = self._blocks[pos]
+            block.append(key)
+            self._maxes[pos] = key
+        else:
+            block = self._blocks[pos]
+            insort(block, key)
+        self._len += 1
+
+        if len(block) > 2 * self._load:
+            half = block[self._load:]
+            del block[self._load:]
+            self._blocks.insert(pos + 1, half)
+            self._maxes[pos] = block[-1]
+            self._maxes.insert(pos + 1, half[-1])
+
+    def remove(self, key):
+        """Удаляет ключ; KeyError, если его нет."""
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            raise KeyError(key)
+
+        block = self._blocks[pos]
+        i = bisect_left(block, key)
+        if block[i] != key:
+            raise KeyError(key)
+
+        del block[i]
+        self._len -= 1
+        if block:
+            self._maxes[pos] = block[-1]
+        else:
+            del self._blocks[pos]
+            del self._maxes[pos]
+
+    def irange(self, start=None, inclusive=True):
+        """
+        Ключи по возрастанию, начиная со start (или с начала).
+        inclusive=False пропускает сам start — для продолжения по курсору.
+        """
+        if start is None:
+            pos, i = 0, 0
+        else:
+            search = bisect_left if inclusive else bisect_right
+            pos = search(self._maxes, start)
+            if pos == len(self._maxes):
+                return
+            i = search(self._blocks[pos], start)
+
+        # Индексы вместо срезов: копировать хвост списка блоков
+        # на каждой странице было бы O(n)
+        for b in range(pos, len(self._blocks)):
+            block = self._blocks[b]
+            for j in range(i, len(block)):
+                yield block[j]
+            i = 0
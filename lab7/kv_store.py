@@ -1,34 +1,144 @@
-import json
+import atexit
 import os
+from functools import wraps
 from flask import Flask, request, jsonify
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
+from persistence import LogPersistence, SnapshotPersistence
+from replication import (
+    ROLE_FOLLOWER,
+    ROLE_LEADER,
+    ROLE_STANDALONE,
+    ROLES,
+    ReplicationFollower,
+    ReplicationLeader,
+    parse_address,
+)
+from storage import StorageEngine
+
 app = Flask(__name__)
 
 # ------------------------------------------------------
 # 1. Корректный путь к data.json, чтобы он был внутри lab7/
 # ------------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(BASE_DIR, "data.json")
+# Папку с данными можно переопределить (бенчмарки, реплики)
+DATA_DIR = os.getenv("KV_DATA_DIR", BASE_DIR)
+DATA_FILE = os.path.join(DATA_DIR, "data.json")
+LOG_FILE = os.path.join(DATA_DIR, "data.log")
+
+# Режим сохранения: "log" — журнал + фоновое уплотнение,
+# "snapshot" — перезапись data.json при каждой записи (как раньше)
+PERSISTENCE_MODE = os.getenv("KV_PERSISTENCE", "log")
+FSYNC_POLICY = os.getenv("KV_FSYNC", "interval")  # always | interval | never
+FSYNC_INTERVAL_MS = int(os.getenv("KV_FSYNC_INTERVAL_MS", "1000"))
+COMPACT_BYTES = int(os.getenv("KV_COMPACT_BYTES", str(16 * 1024 * 1024)))
+# Формат снимка: "json" — data.json целиком в памяти,
+# "binary" — data.kvs через mmap, значения читаются при первом обращении
+SNAPSHOT_FORMAT = os.getenv("KV_SNAPSHOT_FORMAT", "json")
+
+# Пакетные операции: лимит на размер пакета и учёт rate limit —
+# "batch" (пакет = 1 запрос) или "key" (каждый ключ пакета = 1 запрос)
+MAX_BATCH_SIZE = int(os.getenv("KV_MAX_BATCH_SIZE", "10000"))
+BATCH_RATE_LIMIT = os.getenv("KV_BATCH_RATE_LIMIT", "10 per minute")
+BATCH_LIMIT_MODE = os.getenv("KV_BATCH_LIMIT_MODE", "batch")
+
+# Число шардов хранилища (у каждого свой замок).
+# Ограничения памяти: 0 — без ограничения; делятся между шардами
+# и соблюдаются в каждом шарде отдельно, поэтому должны быть не меньше
+# числа шардов. Политика вытеснения:
+# lru | lfu | random. Истёкшие ключи чистятся раз в KV_SWEEP_INTERVAL с.
+SHARDS = int(os.getenv("KV_SHARDS", "16"))
+MAX_KEYS = int(os.getenv("KV_MAX_KEYS", "0"))
+MAX_MEMORY = int(os.getenv("KV_MAX_MEMORY", "0"))
+EVICTION_POLICY = os.getenv("KV_EVICTION_POLICY", "lru")
+SWEEP_INTERVAL = float(os.getenv("KV_SWEEP_INTERVAL", "1.0"))
+
+# Размер страницы /scan по умолчанию и максимальный
+SCAN_DEFAULT_LIMIT = 100
+SCAN_MAX_LIMIT = int(os.getenv("KV_SCAN_MAX_LIMIT", "1000"))
+
+# TCP-порт RESP-интерфейса (tcp_server.py); пусто — не запускать
+TCP_HOST = os.getenv("KV_TCP_HOST", "127.0.0.1")
+TCP_PORT = os.getenv("KV_TCP_PORT", "")
+
+# Порт HTTP и режим отладки Flask (с автоперезапуском)
+HTTP_PORT = int(os.getenv("KV_PORT", "5000"))
+DEBUG = os.getenv("KV_DEBUG", "1") == "1"
+
+# Репликация: standalone — один процесс; leader — принимает реплики
+# на KV_REPLICATION_ADDR; follower — загружается с ведущего по этому
+# адресу, применяет его поток изменений и обслуживает только чтение
+ROLE = os.getenv("KV_ROLE", ROLE_STANDALONE)
+REPLICATION_HOST, REPLICATION_PORT = parse_address(
+    os.getenv("KV_REPLICATION_ADDR", "127.0.0.1:7379")
+)
+if ROLE not in ROLES:
+    raise ValueError(
+        f"Неизвестная роль KV_ROLE={ROLE!r}, ожидается одна из {ROLES}"
+    )
 
 # ------------------------------------------------------
-# 2. Загрузка данных при старте
+# 2. Загрузка данных при старте (снимок + журнал или снимок ведущего)
 # ------------------------------------------------------
-if os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+replication = None
+if ROLE == ROLE_FOLLOWER:
+    persistence = ReplicationFollower(REPLICATION_HOST, REPLICATION_PORT)
+elif PERSISTENCE_MODE == "snapshot":
+    persistence = SnapshotPersistence(DATA_FILE, SNAPSHOT_FORMAT)
 else:
-    data = {}  # если файла нет — создаём пустой словарь
+    persistence = LogPersistence(
+        DATA_FILE,
+        LOG_FILE,
+        fsync=FSYNC_POLICY,
+        fsync_interval_ms=FSYNC_INTERVAL_MS,
+        compact_bytes=COMPACT_BYTES,
+        snapshot_format=SNAPSHOT_FORMAT,
+    )
 
+if ROLE == ROLE_LEADER:
+    persistence = ReplicationLeader(
+        persistence, REPLICATION_HOST, REPLICATION_PORT
+    )
+if ROLE != ROLE_STANDALONE:
+    replication = persistence
+
+store = StorageEngine(
+    persistence,
+    shards=SHARDS,
+    max_keys=MAX_KEYS,
+    max_memory=MAX_MEMORY,
+    policy=EVICTION_POLICY,
+)
+store.start_sweeper(SWEEP_INTERVAL)
+atexit.register(persistence.close)
 
-def save_data():
-    """Сохранение словаря data в файл data.json."""
-    try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"Ошибка при сохранении данных: {e}")
+
+def parse_ttl(content):
+    """
+    Достаёт необязательный ttl (секунды) из тела запроса.
+    Возвращает (ttl, ошибка).
+    """
+    ttl = content.get("ttl")
+    if ttl is None:
+        return None, None
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0:
+        return None, "Field 'ttl' must be a positive number of seconds"
+    return ttl, None
+
+
+def writable(view):
+    """Маршрут записи: на реплике отвечает 403."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if ROLE == ROLE_FOLLOWER:
+            return jsonify({
+                "error": "Read-only replica, write to the leader",
+                "leader": f"{REPLICATION_HOST}:{REPLICATION_PORT}",
+            }), 403
+        return view(*args, **kwargs)
+    return wrapper
 
 # ------------------------------------------------------
 # 3. Настройка Flask-Limiter
@@ -46,6 +156,7 @@ limiter = Limiter(
 
 @app.route("/set", methods=["POST"])
 @limiter.limit("10 per minute")
+@writable
 def set_value():
     """Сохранить ключ-значение"""
     content = request.json
@@ -53,34 +164,41 @@ def set_value():
     if not content or "key" not in content or "value" not in content:
         return jsonify({"error": "Expected JSON: {key, value}"}), 400
 
+    ttl, error = parse_ttl(content)
+    if error:
+        return jsonify({"error": error}), 400
+
     key = content["key"]
     value = content["value"]
+    if not isinstance(key, str):
+        return jsonify({"error": "Field 'key' must be a string"}), 400
 
-    data[key] = value
-    save_data()
+    store.set(key, value, ttl)
 
-    return jsonify({"status": "OK", "saved": {key: value}})
+    return jsonify({"status": "OK", "saved": {key: value}, "ttl": ttl})
 
 
 @app.route("/get/<key>", methods=["GET"])
 def get_value(key):
     """Получить значение по ключу"""
-    if key not in data:
+    try:
+        value = store.get(key)
+    except KeyError:
         return jsonify({"error": "Key not found"}), 404
 
-    return jsonify({"key": key, "value": data[key]})
+    return jsonify({"key": key, "value": value})
 
 
 @app.route("/delete/<key>", methods=["DELETE"])
 @limiter.limit("10 per minute")
+@writable
 def delete_value(key):
     """Удалить ключ"""
-    if key not in data:
+    try:
+        removed_value = store.delete(key)
+    except KeyError:
         return jsonify({"error": "Key not found"}), 404
 
-    removed_value = data.pop(key)
-    save_data()
-
     return jsonify({"status": "deleted", "key": key, "value": removed_value})
 
 
@@ -89,13 +207,183 @@ def exists(key):
     """Проверить наличие ключа"""
     return jsonify({
         "key": key,
-        "exists": key in data
+        "exists": key in store
     })
 
+
+@app.route("/ttl/<key>", methods=["GET"])
+def ttl_value(key):
+    """Оставшееся время жизни ключа в секундах (null — без срока)"""
+    try:
+        remaining = store.ttl(key)
+    except KeyError:
+        return jsonify({"error": "Key not found"}), 404
+
+    return jsonify({"key": key, "ttl": remaining})
+
+
+@app.route("/scan", methods=["GET"])
+def scan():
+    """
+    Ключи по префиксу или диапазону, постранично.
+
+    Параметры: prefix или start/end (end не включается), cursor —
+    значение "cursor" из предыдущей страницы, limit, values=1 —
+    вернуть вместе со значениями.
+    """
+    try:
+        limit = int(request.args.get("limit", SCAN_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= SCAN_MAX_LIMIT:
+        return jsonify({
+            "error": f"Parameter 'limit' must be from 1 to {SCAN_MAX_LIMIT}"
+        }), 400
+
+    with_values = request.args.get("values") in ("1", "true")
+    items, cursor = store.scan(
+        prefix=request.args.get("prefix"),
+        start=request.args.get("start"),
+        end=request.args.get("end"),
+        after=request.args.get("cursor"),
+        limit=limit,
+        with_values=with_values,
+    )
+
+    if with_values:
+        page = {"items": [{"key": k, "value": v} for k, v in items]}
+    else:
+        page = {"keys": [k for k, _ in items]}
+    page["cursor"] = cursor
+    return jsonify(page)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Счётчики хранилища: число ключей, память, вытеснения, истечения"""
+    return jsonify(store.stats())
+
+
+@app.route("/replication", methods=["GET"])
+@limiter.exempt
+def replication_status():
+    """Роль процесса; для реплики — отставание от ведущего"""
+    if replication is None:
+        return jsonify({"role": ROLE_STANDALONE})
+    return jsonify(replication.status())
+
 # ------------------------------------------------------
-# 5. Запуск приложения
+# 5. Пакетные операции MSET / MGET / MDEL
+# ------------------------------------------------------
+
+def batch_cost():
+    """Стоимость запроса для rate limit: 1 за пакет или 1 за каждый ключ."""
+    if BATCH_LIMIT_MODE != "key":
+        return 1
+
+    content = request.get_json(silent=True)
+    if not isinstance(content, dict):
+        return 1
+
+    batch = content.get("items") or content.get("keys") or ()
+    return max(1, len(batch))
+
+
+def valid_keys(keys):
+    """Список ключей-строк, не длиннее MAX_BATCH_SIZE."""
+    return (
+        isinstance(keys, list)
+        and len(keys) <= MAX_BATCH_SIZE
+        and all(isinstance(key, str) for key in keys)
+    )
+
+
+def batch_error(field, example):
+    """Ответ 400 для некорректного тела пакетного запроса."""
+    return jsonify({
+        "error": f"Expected JSON: {{{field}}} (not more than "
+                 f"{MAX_BATCH_SIZE} keys)",
+        "example": example,
+    }), 400
+
+
+@app.route("/mset", methods=["POST"])
+@limiter.limit(BATCH_RATE_LIMIT, cost=batch_cost)
+@writable
+def mset():
+    """Сохранить несколько пар ключ-значение одним запросом"""
+    content = request.get_json(silent=True)
+    items = content.get("items") if isinstance(content, dict) else None
+
+    if (
+        not isinstance(items, dict)
+        or len(items) > MAX_BATCH_SIZE
+        or not all(isinstance(key, str) for key in items)
+    ):
+        return batch_error("items", {"items": {"key1": 1, "key2": 2}})
+
+    ttl, error = parse_ttl(content)
+    if error:
+        return jsonify({"error": error}), 400
+
+    store.set_many(items, ttl)
+
+    return jsonify({"status": "OK", "saved": len(items), "ttl": ttl})
+
+
+@app.route("/mget", methods=["POST"])
+@limiter.limit(BATCH_RATE_LIMIT, cost=batch_cost)
+def mget():
+    """Получить значения нескольких ключей одним запросом"""
+    content = request.get_json(silent=True)
+    keys = content.get("keys") if isinstance(content, dict) else None
+
+    if not valid_keys(keys):
+        return batch_error("keys", {"keys": ["key1", "key2"]})
+
+    values = store.get_many(keys)
+    missing = [key for key in keys if key not in values]
+
+    return jsonify({"values": values, "missing": missing})
+
+
+@app.route("/mdel", methods=["POST", "DELETE"])
+@limiter.limit(BATCH_RATE_LIMIT, cost=batch_cost)
+@writable
+def mdel():
+    """Удалить несколько ключей одним запросом"""
+    content = request.get_json(silent=True)
+    keys = content.get("keys") if isinstance(content, dict) else None
+
+    if not valid_keys(keys):
+        return batch_error("keys", {"keys": ["key1", "key2"]})
+
+    deleted = store.delete_many(keys)
+
+    return jsonify({"status": "deleted", "deleted": deleted})
+
+# ------------------------------------------------------
+# 6. Запуск приложения
 # ------------------------------------------------------
 
 if __name__ == "__main__":
-    print("Key-value хранилище запущено на http://127.0.0.1:5000")
-    app.run(debug=True)
+    print(f"Key-value хранилище запущено на http://127.0.0.1:{HTTP_PORT} "
+          f"({ROLE})")
+
+    # В режиме debug код выполняется дважды: в наблюдающем процессе
+    # и в перезапускаемом дочернем. Фоновые серверы нужны только там,
+    # где обслуживаются запросы и живёт store.
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        if replication is not None:
+            replication.start(store)
+
+        if TCP_PORT:
+            from tcp_server import RespServer
+
+            RespServer(
+                store, TCP_HOST, int(TCP_PORT),
+                read_only=ROLE == ROLE_FOLLOWER,
+            ).start_in_thread()
+            print(f"RESP-интерфейс запущен на {TCP_HOST}:{TCP_PORT}")
+
+    app.run(port=HTTP_PORT, debug=DEBUG)
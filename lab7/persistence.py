@@ -0,0 +1,434 @@
+import json
+import os
+import shutil
+import threading
+from itertools import chain
+
+from snapshot import (
+    BinarySnapshot,
+    base_parts,
+    expires_path,
+    json_to_binary,
+    write_binary_snapshot,
+)
+
+# ------------------------------------------------------
+# Режимы сохранения данных key-value хранилища
+#
+# snapshot — исходный режим: каждая запись целиком перезаписывает data.json.
+# log      — журнал упреждающей записи: каждая запись дописывает одну
+#            строку в data.log, а фоновое уплотнение время от времени
+#            сворачивает журнал в новый снимок data.json.
+#
+# Сроки жизни ключей (TTL) хранятся рядом со снимком в data.expires.json
+# как абсолютное время истечения (time.time()), поэтому переживают рестарт.
+#
+# Формат снимка: json — data.json + data.expires.json, загружается
+# целиком; binary — data.kvs (см. snapshot.py), открывается через mmap,
+# значения читаются лениво. Журнал в обоих случаях одинаковый.
+#
+# Снимок передаётся сюда функцией snapshot(), которая возвращает
+# итератор частей (значения, сроки) — по одной на шард хранилища.
+# Части пишутся в файл по мере получения, так что в каждый момент
+# копируется и блокируется только один шард.
+# ------------------------------------------------------
+
+FSYNC_ALWAYS = "always"      # fsync после каждой записи
+FSYNC_INTERVAL = "interval"  # fsync не чаще, чем раз в N миллисекунд
+FSYNC_NEVER = "never"        # сброс на диск остаётся на усмотрение ОС
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+SNAPSHOT_FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+
+def binary_path(data_file):
+    """Путь к бинарному снимку рядом с data.json: data.kvs."""
+    return os.path.splitext(data_file)[0] + ".kvs"
+
+
+def read_json(path):
+    """Читает JSON-файл. Если файла нет — возвращает пустой словарь."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_snapshot(data_file, fmt=FORMAT_JSON):
+    """
+    Открывает снимок: (значения, сроки, бинарная база).
+
+    Для json база — None, всё загружено в словари. Для binary словари
+    пусты, а данные остаются в отображённом в память data.kvs.
+    Если data.kvs ещё нет, но есть data.json, он конвертируется.
+    """
+    if fmt == FORMAT_JSON:
+        return read_json(data_file), read_json(expires_path(data_file)), None
+
+    kvs_file = binary_path(data_file)
+    if not os.path.exists(kvs_file) and os.path.exists(data_file):
+        json_to_binary(data_file, kvs_file)
+    return {}, {}, BinarySnapshot(kvs_file)
+
+
+class _JsonObjectWriter:
+    """Потоковая запись JSON-объекта: пары ключ-значение по одной."""
+
+    def __init__(self, f):
+        self._f = f
+        self._first = True
+        f.write("{")
+
+    def write(self, key, value):
+        self._f.write("\n    " if self._first else ",\n    ")
+        self._first = False
+        self._f.write(json.dumps(key, ensure_ascii=False))
+        self._f.write(": ")
+        self._f.write(json.dumps(value, ensure_ascii=False))
+
+    def close(self):
+        self._f.write("}" if self._first else "\n}")
+
+
+def write_snapshot(data_file, parts, fmt=FORMAT_JSON):
+    """
+    Записывает снимок из частей (значения, сроки) без сборки общего словаря.
+
+    Оба файла пишутся во временные и подменяются через os.replace.
+    Сроки подменяются первыми: если упасть между файлами, ключ скорее
+    лишится значения, чем станет вечным.
+    """
+    if fmt == FORMAT_BINARY:
+        write_binary_snapshot(binary_path(data_file), parts)
+        return
+
+    exp_file = expires_path(data_file)
+    with open(data_file + ".tmp", "w", encoding="utf-8") as fd, \
+            open(exp_file + ".tmp", "w", encoding="utf-8") as fe:
+        data_writer = _JsonObjectWriter(fd)
+        exp_writer = _JsonObjectWriter(fe)
+        for data, expires in parts:
+            for key, value in data.items():
+                data_writer.write(key, value)
+            for key, expire_at in expires.items():
+                exp_writer.write(key, expire_at)
+        data_writer.close()
+        exp_writer.close()
+
+        for f in (fd, fe):
+            f.flush()
+            os.fsync(f.fileno())
+
+    os.replace(exp_file + ".tmp", exp_file)
+    os.replace(data_file + ".tmp", data_file)
+
+
+def encode_record(record):
+    """Одна запись журнала — одна строка JSON."""
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def apply_record(data, expires, record, deleted=None):
+    """
+    Применяет одну запись журнала к словарям значений и сроков.
+
+    deleted — множество удалённых ключей; нужно, когда под словарями
+    лежит бинарный снимок и удаление должно скрыть ключ из него.
+    """
+    key = record["key"]
+    if record["op"] == "set":
+        data[key] = record["value"]
+        if record.get("expire_at") is not None:
+            expires[key] = record["expire_at"]
+        else:
+            expires.pop(key, None)
+        if deleted is not None:
+            deleted.discard(key)
+    elif record["op"] == "del":
+        data.pop(key, None)
+        expires.pop(key, None)
+        if deleted is not None:
+            deleted.add(key)
+
+
+def replay_log(path, data, expires, deleted=None):
+    """
+    Применяет записи журнала к data, expires и deleted.
+
+    Возвращает смещение конца последней целой записи: всё, что дальше,
+    — недописанный после сбоя хвост, который нужно отрезать.
+    """
+    if not os.path.exists(path):
+        return 0
+
+    valid_end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            apply_record(data, expires, record, deleted)
+            valid_end += len(line)
+    return valid_end
+
+
+class SnapshotPersistence:
+    """
+    Исходный режим: полная перезапись data.json при каждом изменении.
+
+    append() вызывается под замком шарда, поэтому саму перезапись делает
+    фоновый поток: подряд идущие изменения сворачиваются в одну запись.
+    """
+
+    def __init__(self, data_file, snapshot_format=FORMAT_JSON):
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(
+                f"Неизвестный формат снимка: {snapshot_format!r}, "
+                f"ожидается один из {SNAPSHOT_FORMATS}"
+            )
+
+        self.data_file = data_file
+        self.snapshot_format = snapshot_format
+        self._snapshot = None
+        self._dirty = threading.Condition()
+        self._pending = False
+        self._closed = False
+        self._writer = None
+
+    def load(self):
+        """(значения, сроки, удалённые ключи, бинарная база или None)."""
+        data, expires, base = load_snapshot(
+            self.data_file, self.snapshot_format
+        )
+        return data, expires, set(), base
+
+    def append(self, records, snapshot):
+        with self._dirty:
+            self._snapshot = snapshot
+            self._pending = True
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, daemon=True
+                )
+                self._writer.start()
+            self._dirty.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._dirty:
+                while not self._pending and not self._closed:
+                    self._dirty.wait()
+                if not self._pending:
+                    return
+                self._pending = False
+                snapshot = self._snapshot
+
+            try:
+                write_snapshot(
+                    self.data_file, snapshot(), self.snapshot_format
+                )
+            except Exception as e:
+                print(f"Ошибка при сохранении данных: {e}")
+
+    def close(self):
+        """Дожидается последней перезаписи."""
+        with self._dirty:
+            self._closed = True
+            self._dirty.notify()
+        if self._writer is not None:
+            self._writer.join()
+
+
+class LogPersistence:
+    """
+    Журнал упреждающей записи (write-ahead log).
+
+    Запись стоит O(размер изменения), а не O(размер хранилища).
+    При старте состояние восстанавливается как снимок + журнал.
+    Когда журнал вырастает больше compact_bytes, он переименовывается
+    в data.log.old, текущее состояние в фоне записывается в новый
+    снимок, после чего старый журнал удаляется.
+    """
+
+    def __init__(self, data_file, log_file, fsync=FSYNC_INTERVAL,
+                 fsync_interval_ms=1000, compact_bytes=16 * 1024 * 1024,
+                 snapshot_format=FORMAT_JSON):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(
+                f"Неизвестная политика fsync: {fsync!r}, "
+                f"ожидается одна из {FSYNC_POLICIES}"
+            )
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(
+                f"Неизвестный формат снимка: {snapshot_format!r}, "
+                f"ожидается один из {SNAPSHOT_FORMATS}"
+            )
+
+        self.data_file = data_file
+        self.log_file = log_file
+        self.old_log_file = log_file + ".old"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.compact_bytes = compact_bytes
+        self.snapshot_format = snapshot_format
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._log_size = 0
+        self._dirty = False
+        self._compacting = False
+        self._compactor = None
+        self._closed = threading.Event()
+
+    # ------------------------------------------------------
+    # Восстановление при старте
+    # ------------------------------------------------------
+
+    def load(self):
+        """
+        Восстанавливает данные: снимок, затем старый и текущий журнал.
+
+        Возвращает (значения, сроки, удалённые ключи, бинарная база).
+        Для json-снимка база — None и удалённые ключи не нужны.
+        """
+        data, expires, base = load_snapshot(
+            self.data_file, self.snapshot_format
+        )
+        deleted = set() if base is not None else None
+
+        had_old_log = os.path.exists(self.old_log_file)
+        replay_log(self.old_log_file, data, expires, deleted)
+        valid_end = replay_log(self.log_file, data, expires, deleted)
+
+        if had_old_log:
+            # Прошлое уплотнение не завершилось: доводим его до конца
+            # синхронно, всё восстановленное уже есть в data.
+            parts = [(data, expires)]
+            if base is not None:
+                parts = chain(parts, base_parts(base, set(data) | deleted))
+            write_snapshot(self.data_file, parts, self.snapshot_format)
+            os.remove(self.old_log_file)
+            valid_end = 0
+
+            if base is not None:
+                base.close()
+                data, expires, base = load_snapshot(
+                    self.data_file, self.snapshot_format
+                )
+                deleted = set()
+
+        self._file = open(self.log_file, "ab")
+        self._file.truncate(valid_end)
+        self._file.seek(valid_end)
+        self._log_size = valid_end
+
+        if self.fsync == FSYNC_INTERVAL:
+            threading.Thread(target=self._fsync_loop, daemon=True).start()
+
+        return data, expires, deleted or set(), base
+
+    # ------------------------------------------------------
+    # Запись
+    # ------------------------------------------------------
+
+    def append(self, records, snapshot):
+        """
+        Дописывает записи в журнал одним вызовом write.
+
+        Вызывается под замком шарда, поэтому snapshot() здесь не
+        вызывается: уплотнение только переключает журнал, а копии шардов
+        снимает уже фоновый поток. Всё из старого журнала к этому моменту
+        уже применено к шардам, а записи, попавшие и в снимок, и в новый
+        журнал, при восстановлении просто применятся повторно.
+        """
+        chunk = b"".join(encode_record(r) for r in records)
+        start_compaction = False
+
+        with self._lock:
+            self._file.write(chunk)
+            self._file.flush()
+            if self.fsync == FSYNC_ALWAYS:
+                os.fsync(self._file.fileno())
+            else:
+                self._dirty = True
+
+            self._log_size += len(chunk)
+            if self._log_size >= self.compact_bytes and not self._compacting:
+                self._compacting = True
+                self._rotate()
+                start_compaction = True
+
+        if start_compaction:
+            self._compactor = threading.Thread(
+                target=self._compact, args=(snapshot,), daemon=True
+            )
+            self._compactor.start()
+
+    def _fsync_loop(self):
+        """Фоновый fsync для политики interval."""
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if self._dirty and self._file is not None:
+                    os.fsync(self._file.fileno())
+                    self._dirty = False
+
+    # ------------------------------------------------------
+    # Уплотнение журнала
+    # ------------------------------------------------------
+
+    def _rotate(self):
+        """Переключает запись на новый журнал (вызывается под self._lock)."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        if os.path.exists(self.old_log_file):
+            # Предыдущее уплотнение упало — не теряем его журнал
+            with open(self.log_file, "rb") as src, \
+                    open(self.old_log_file, "ab") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.log_file)
+        else:
+            os.replace(self.log_file, self.old_log_file)
+
+        self._file = open(self.log_file, "ab")
+        self._log_size = 0
+        self._dirty = False
+
+    def _compact(self, snapshot):
+        """Записывает снимок и удаляет свёрнутый в него журнал."""
+        try:
+            write_snapshot(
+                self.data_file, snapshot(), self.snapshot_format
+            )
+            os.remove(self.old_log_file)
+        except Exception as e:
+            print(f"Ошибка при уплотнении журнала: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self, snapshot):
+        """Принудительное синхронное уплотнение."""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+            self._rotate()
+        self._compact(snapshot)
+
+    def close(self):
+        """Дожидается уплотнения, сбрасывает журнал на диск и закрывает файл."""
+        self._closed.set()
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
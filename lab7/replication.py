@@ -0,0 +1,363 @@
+import json
+import queue
+import socket
+import threading
+import time
+
+# ------------------------------------------------------
+# Репликация хранилища: ведущий и реплики только для чтения
+#
+# Ведущий (leader) оборачивает обычный persistence: каждая пачка записей
+# журнала, кроме записи на диск, получает номер seq и рассылается
+# подключённым репликам по TCP. Новая реплика сначала получает снимок
+# хранилища (те же части по шардам, что и при уплотнении журнала),
+# затем — все пачки, опубликованные после её подключения.
+#
+# Реплика (follower) вместо диска загружается из этого снимка, а затем
+# применяет поток изменений к своему StorageEngine. При обрыве связи
+# она переподключается и заново синхронизируется по свежему снимку.
+#
+# Протокол — строки JSON:
+#   {"type": "snapshot", "data": {...}, "expires": {...}}  — часть снимка
+#   {"type": "synced", "seq": N, "ts": t}       — снимок передан целиком
+#   {"type": "records", "seq": N, "ts": t, "records": [...]}
+#   {"type": "heartbeat", "seq": N, "ts": t}   — ведущий жив, последний seq
+# ------------------------------------------------------
+
+ROLE_STANDALONE = "standalone"
+ROLE_LEADER = "leader"
+ROLE_FOLLOWER = "follower"
+ROLES = (ROLE_STANDALONE, ROLE_LEADER, ROLE_FOLLOWER)
+
+
+def parse_address(address):
+    """"host:port" -> (host, port)."""
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def encode_message(message):
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+class _Follower:
+    """Подключённая к ведущему реплика: сокет и очередь неотправленного."""
+
+    def __init__(self, sock, address, queue_size):
+        self.sock = sock
+        self.address = f"{address[0]}:{address[1]}"
+        self.queue = queue.Queue(queue_size)
+        self.connected_at = time.time()
+        self.sent_seq = 0
+
+    def drop(self):
+        """Разрывает соединение: поток отправки завершится с ошибкой."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class ReplicationLeader:
+    """
+    Ведущий: persistence, который кроме записи на диск рассылает
+    изменения репликам.
+
+    append() вызывается под замком шарда. Пачка только кладётся в очередь
+    каждой реплики, а отправляют её отдельные потоки, так что медленная
+    реплика не тормозит запись. Если очередь реплики переполнилась,
+    соединение рвётся, и реплика синхронизируется заново.
+    """
+
+    def __init__(self, persistence, host="127.0.0.1", port=7379,
+                 queue_size=100000, heartbeat=1.0):
+        self.persistence = persistence
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._last_ts = time.time()
+        self._followers = []
+        self._snapshot = None
+        self._server = None
+        self._closed = threading.Event()
+
+    def load(self):
+        return self.persistence.load()
+
+    def append(self, records, snapshot):
+        self.persistence.append(records, snapshot)
+
+        # Реплика, подключившаяся после этой проверки, всё равно увидит
+        # пачку: её снимок ждёт замка шарда, который держит вызывающий
+        if not self._followers:
+            with self._lock:
+                self._seq += 1
+                self._last_ts = time.time()
+            return
+
+        payload = json.dumps(records, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._seq += 1
+            self._last_ts = time.time()
+            line = b'{"type": "records", "seq": %d, "ts": %r, "records": ' \
+                   b"%s}\n" % (self._seq, self._last_ts, payload)
+            for follower in self._followers:
+                try:
+                    follower.queue.put_nowait(line)
+                except queue.Full:
+                    follower.drop()
+
+    def compact(self, snapshot):
+        self.persistence.compact(snapshot)
+
+    def start(self, engine):
+        """Начинает принимать реплики; снимки берутся из engine."""
+        self._snapshot = engine.snapshot
+        self._server = socket.create_server((self.host, self.port))
+        self.port = self._server.getsockname()[1]
+        thread = threading.Thread(target=self._accept_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                sock, address = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self._serve, args=(sock, address), daemon=True
+            ).start()
+
+    def _serve(self, sock, address):
+        """Снимок, затем поток изменений одной реплике."""
+        follower = _Follower(sock, address, self.queue_size)
+        with self._lock:
+            self._followers.append(follower)
+            synced = self._seq
+
+        try:
+            # Пачки после synced уже копятся в очереди. Часть из них может
+            # попасть и в снимок — реплика применит их повторно, это безопасно
+            for data, expires in self._snapshot():
+                sock.sendall(encode_message(
+                    {"type": "snapshot", "data": data, "expires": expires}
+                ))
+            sock.sendall(encode_message(
+                {"type": "synced", "seq": synced, "ts": time.time()}
+            ))
+            follower.sent_seq = synced
+
+            while not self._closed.is_set():
+                try:
+                    lines = [follower.queue.get(timeout=self.heartbeat)]
+                except queue.Empty:
+                    with self._lock:
+                        seq, ts = self._seq, self._last_ts
+                    sock.sendall(encode_message(
+                        {"type": "heartbeat", "seq": seq, "ts": ts}
+                    ))
+                    continue
+
+                while len(lines) < 1000:
+                    try:
+                        lines.append(follower.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                sock.sendall(b"".join(lines))
+                follower.sent_seq += len(lines)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._followers.remove(follower)
+            sock.close()
+
+    def status(self):
+        with self._lock:
+            return {
+                "role": ROLE_LEADER,
+                "address": f"{self.host}:{self.port}",
+                "seq": self._seq,
+                "followers": [
+                    {
+                        "address": f.address,
+                        "sent_seq": f.sent_seq,
+                        "queued": f.queue.qsize(),
+                        "connected_seconds": round(
+                            time.time() - f.connected_at, 3
+                        ),
+                    }
+                    for f in self._followers
+                ],
+            }
+
+    def close(self):
+        self._closed.set()
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            for follower in self._followers:
+                follower.drop()
+        self.persistence.close()
+
+
+class ReplicationFollower:
+    """
+    Реплика: persistence, который загружает состояние от ведущего
+    и ничего не пишет на диск.
+
+    load() ждёт ведущего и получает от него снимок, start(engine)
+    запускает поток, применяющий изменения к engine.
+    """
+
+    def __init__(self, host="127.0.0.1", port=7379, connect_timeout=30.0,
+                 retry_interval=0.5, heartbeat=1.0):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        # Без вестей от ведущего дольше этого — соединение считается мёртвым
+        self.dead_after = 5 * heartbeat
+
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+        self._connected = False
+        self._applied_seq = 0
+        self._leader_seq = 0
+        self._leader_ts = time.time()
+        self._last_contact = time.time()
+        self._apply_delay = 0.0
+        self._resyncs = 0
+        self._closed = threading.Event()
+
+    def _messages(self):
+        for line in self._reader:
+            self._last_contact = time.time()
+            yield json.loads(line)
+
+    def _sync(self):
+        """Подключается к ведущему и читает снимок: (значения, сроки)."""
+        sock = socket.create_connection(
+            (self.host, self.port), timeout=self.dead_after
+        )
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+
+        data, expires = {}, {}
+        for message in self._messages():
+            if message["type"] == "snapshot":
+                data.update(message["data"])
+                expires.update(message["expires"])
+            elif message["type"] == "synced":
+                with self._lock:
+                    self._connected = True
+                    self._applied_seq = self._leader_seq = message["seq"]
+                    self._leader_ts = message["ts"]
+                return data, expires
+        raise ConnectionError("ведущий закрыл соединение во время снимка")
+
+    def _disconnect(self):
+        with self._lock:
+            self._connected = False
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def load(self):
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                data, expires = self._sync()
+                return data, expires, set(), None
+            except OSError:
+                self._disconnect()
+                if time.time() >= deadline:
+                    raise
+                time.sleep(self.retry_interval)
+
+    def append(self, records, snapshot):
+        """Реплика не пишет журнал: её состояние — копия ведущего."""
+
+    def compact(self, snapshot):
+        pass
+
+    def start(self, engine):
+        """Запускает поток, применяющий изменения ведущего к engine."""
+        thread = threading.Thread(
+            target=self._follow, args=(engine,), daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _follow(self, engine):
+        while not self._closed.is_set():
+            try:
+                if self._sock is None:
+                    self._resync(engine, *self._sync())
+                self._tail(engine)
+            except (OSError, ValueError):
+                pass
+            self._disconnect()
+            self._closed.wait(self.retry_interval)
+
+    def _tail(self, engine):
+        for message in self._messages():
+            if message["type"] == "records":
+                engine.apply(message["records"])
+                now = time.time()
+                with self._lock:
+                    self._applied_seq = message["seq"]
+                    self._leader_seq = max(self._leader_seq, message["seq"])
+                    self._leader_ts = message["ts"]
+                    self._apply_delay = now - message["ts"]
+            elif message["type"] == "heartbeat":
+                with self._lock:
+                    if message["seq"] > self._leader_seq:
+                        self._leader_seq = message["seq"]
+                        self._leader_ts = message["ts"]
+
+    def _resync(self, engine, data, expires):
+        """Приводит engine к свежему снимку ведущего после обрыва связи."""
+        stale = set()
+        for part, _ in engine.snapshot():
+            stale.update(key for key in part if key not in data)
+
+        records = [{"op": "del", "key": key} for key in stale]
+        for key, value in data.items():
+            record = {"op": "set", "key": key, "value": value}
+            if key in expires:
+                record["expire_at"] = expires[key]
+            records.append(record)
+        engine.apply(records)
+        with self._lock:
+            self._resyncs += 1
+
+    def status(self):
+        """Состояние реплики и её отставание от ведущего."""
+        now = time.time()
+        with self._lock:
+            behind = max(0, self._leader_seq - self._applied_seq)
+            return {
+                "role": ROLE_FOLLOWER,
+                "leader": f"{self.host}:{self.port}",
+                "connected": self._connected,
+                "applied_seq": self._applied_seq,
+                "leader_seq": self._leader_seq,
+                "lag_records": behind,
+                # Сколько прошло с последней неприменённой записи ведущего
+                "lag_seconds": round(now - self._leader_ts, 3)
+                if behind else 0.0,
+                "apply_delay_ms": round(self._apply_delay * 1000, 3),
+                "last_contact_seconds": round(now - self._last_contact, 3),
+                "resyncs": self._resyncs,
+            }
+
+    def close(self):
+        self._closed.set()
+        self._disconnect()
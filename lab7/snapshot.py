@@ -0,0 +1,232 @@
+"""
+Бинарный формат снимка хранилища (data.kvs) с ленивой загрузкой через mmap.
+
+Структура файла:
+    заголовок  — magic b"KVS1", u32 версия, u64 число записей,
+                 u64 смещение индекса;
+    записи     — u32 длина ключа, u32 длина значения, f64 срок истечения
+                 (0 — без срока), ключ (UTF-8), значение (JSON, UTF-8);
+    индекс     — u64 смещения записей, отсортированные по ключу.
+
+Открытие файла читает только заголовок, поэтому время старта не зависит
+от размера снимка. Поиск ключа — бинарный поиск по индексу, значение
+разбирается из JSON только при обращении к нему.
+
+Конвертация из/в data.json:
+    python snapshot.py to-binary data.json data.kvs
+    python snapshot.py to-json data.kvs data.json
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b"KVS1"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQ")
+RECORD = struct.Struct("<IId")
+OFFSET = struct.Struct("<Q")
+
+
+def expires_path(data_file):
+    """Путь к файлу сроков жизни рядом с JSON-снимком: data.expires.json."""
+    return os.path.splitext(data_file)[0] + ".expires.json"
+
+
+class BinarySnapshot:
+    """Снимок только для чтения, отображённый в память."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._mm = None
+        self._count = 0
+        self._index = 0
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count, self._index = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path}: не снимок KVS версии {VERSION}")
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, i):
+        return OFFSET.unpack_from(self._mm, self._index + i * OFFSET.size)[0]
+
+    def _key_at(self, i):
+        offset = self._offset(i)
+        key_len = RECORD.unpack_from(self._mm, offset)[0]
+        start = offset + RECORD.size
+        return self._mm[start:start + key_len]
+
+    def _record_at(self, i):
+        """(ключ, значение, срок) записи с номером i в порядке индекса."""
+        offset = self._offset(i)
+        key_len, value_len, expire_at = RECORD.unpack_from(self._mm, offset)
+        start = offset + RECORD.size
+        key = self._mm[start:start + key_len].decode("utf-8")
+        raw = self._mm[start + key_len:start + key_len + value_len]
+        return key, json.loads(raw), expire_at or None
+
+    def value_at(self, i):
+        """Значение записи с номером i."""
+        return self._record_at(i)[1]
+
+    def bisect(self, key, inclusive=True):
+        """
+        Номер первой записи с ключом >= key
+        (или > key при inclusive=False).
+        """
+        target = key.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = self._key_at(mid)
+            if mid_key < target or (not inclusive and mid_key == target):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def keys(self, start=0):
+        """
+        (ключ, срок, номер) по возрастанию ключа без разбора значений.
+        Значение при необходимости читается через value_at(номер).
+        """
+        for i in range(start, self._count):
+            offset = self._offset(i)
+            key_len, _, expire_at = RECORD.unpack_from(self._mm, offset)
+            begin = offset + RECORD.size
+            key = self._mm[begin:begin + key_len].decode("utf-8")
+            yield key, expire_at or None, i
+
+    def __contains__(self, key):
+        i = self.bisect(key)
+        return i < self._count and self._key_at(i) == key.encode("utf-8")
+
+    def get(self, key):
+        """(значение, срок) по ключу; KeyError, если ключа нет."""
+        i = self.bisect(key)
+        if i < self._count and self._key_at(i) == key.encode("utf-8"):
+            return self._record_at(i)[1:]
+        raise KeyError(key)
+
+    def items(self, start=0):
+        """(ключ, значение, срок) по возрастанию ключа, начиная с номера start."""
+        for i in range(start, self._count):
+            yield self._record_at(i)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._count = 0
+
+
+def write_binary_snapshot(path, parts):
+    """
+    Записывает снимок из частей (значения, сроки).
+
+    Записи идут в файл по мере поступления, в памяти держатся только
+    ключи со смещениями — для сортировки индекса.
+    """
+    tmp_path = path + ".tmp"
+    index = []
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        offset = HEADER.size
+        for data, expires in parts:
+            for key, value in data.items():
+                raw_key = key.encode("utf-8")
+                raw_value = json.dumps(value, ensure_ascii=False).encode("utf-8")
+                f.write(RECORD.pack(
+                    len(raw_key), len(raw_value), expires.get(key) or 0.0
+                ))
+                f.write(raw_key)
+                f.write(raw_value)
+                index.append((raw_key, offset))
+                offset += RECORD.size + len(raw_key) + len(raw_value)
+
+        index.sort()
+        for _, record_offset in index:
+            f.write(OFFSET.pack(record_offset))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), offset))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def base_parts(base, skip, chunk_size=10000):
+    """
+    Части (значения, сроки) из бинарного снимка для записи нового снимка.
+    Ключи из skip (изменённые или удалённые в памяти) пропускаются.
+    """
+    data, expires = {}, {}
+    for key, value, expire_at in base.items():
+        if key in skip:
+            continue
+        data[key] = value
+        if expire_at is not None:
+            expires[key] = expire_at
+        if len(data) >= chunk_size:
+            yield data, expires
+            data, expires = {}, {}
+    if data:
+        yield data, expires
+
+
+def json_to_binary(json_path, binary_path):
+    """Конвертирует data.json (и data.expires.json, если есть) в data.kvs."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    expires = {}
+    if os.path.exists(expires_path(json_path)):
+        with open(expires_path(json_path), "r", encoding="utf-8") as f:
+            expires = json.load(f)
+
+    write_binary_snapshot(binary_path, [(data, expires)])
+
+
+def binary_to_json(binary_path, json_path):
+    """Конвертирует data.kvs в data.json (и data.expires.json)."""
+    snapshot = BinarySnapshot(binary_path)
+    data, expires = {}, {}
+    for key, value, expire_at in snapshot.items():
+        data[key] = value
+        if expire_at is not None:
+            expires[key] = expire_at
+    snapshot.close()
+
+    with open(expires_path(json_path), "w", encoding="utf-8") as f:
+        json.dump(expires, f, indent=4, ensure_ascii=False)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("to-binary", "to-json"):
+        print("Использование:")
+        print("python snapshot.py to-binary data.json data.kvs")
+        print("python snapshot.py to-json data.kvs data.json")
+        sys.exit(1)
+
+    command, src, dst = sys.argv[1:]
+    if command == "to-binary":
+        json_to_binary(src, dst)
+    else:
+        binary_to_json(src, dst)
+    print(f"Готово: {src} -> {dst}")
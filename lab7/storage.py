@@ -0,0 +1,670 @@
+import heapq
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+from index import SortedKeyIndex
+from snapshot import base_parts
+
+# ------------------------------------------------------
+# Хранилище key-value: сроки жизни ключей (TTL) и вытеснение
+#
+# Данные разложены по шардам, у каждого шарда свой замок и свой
+# упорядоченный индекс ключей для prefix- и range-запросов.
+# Ключ с TTL удаляется лениво при чтении и фоновым «чистильщиком»,
+# который снимает истёкшие ключи с вершины кучи сроков.
+# При превышении max_keys или max_memory ключи вытесняются по политике
+# lru / lfu / random, каждая из которых выбирает жертву за O(1).
+# ------------------------------------------------------
+
+POLICY_LRU = "lru"
+POLICY_LFU = "lfu"
+POLICY_RANDOM = "random"
+
+
+def entry_size(key, value):
+    """Приблизительный размер записи в байтах: ключ + значение в JSON."""
+    return (
+        len(key.encode("utf-8"))
+        + len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    )
+
+
+class LRUPolicy:
+    """Least recently used: порядок обращений в OrderedDict."""
+
+    def __init__(self):
+        self._order = OrderedDict()
+
+    def add(self, key):
+        self._order[key] = None
+
+    def touch(self, key):
+        self._order.move_to_end(key)
+
+    def remove(self, key):
+        self._order.pop(key, None)
+
+    def victim(self):
+        return next(iter(self._order))
+
+
+class LFUPolicy:
+    """
+    Least frequently used за O(1): ключи разложены по «корзинам» частот,
+    внутри корзины — порядок LRU. Непустые корзины связаны в список
+    по возрастанию частоты, голова списка — минимальная частота.
+    """
+
+    def __init__(self):
+        self._freq = {}
+        self._buckets = {}
+        self._prev = {}
+        self._next = {}
+        self._min_freq = None
+
+    def _add_bucket(self, freq, after):
+        """Вставляет корзину freq сразу после after (None — в голову)."""
+        nxt = self._min_freq if after is None else self._next[after]
+        self._buckets[freq] = OrderedDict()
+        self._prev[freq] = after
+        self._next[freq] = nxt
+        if nxt is not None:
+            self._prev[nxt] = freq
+        if after is None:
+            self._min_freq = freq
+        else:
+            self._next[after] = freq
+
+    def _drop_bucket(self, freq):
+        prev = self._prev.pop(freq)
+        nxt = self._next.pop(freq)
+        del self._buckets[freq]
+        if nxt is not None:
+            self._prev[nxt] = prev
+        if prev is None:
+            self._min_freq = nxt
+        else:
+            self._next[prev] = nxt
+
+    def _put(self, key, freq, after):
+        if freq not in self._buckets:
+            self._add_bucket(freq, after)
+        self._buckets[freq][key] = None
+        self._freq[key] = freq
+
+    def add(self, key):
+        self._put(key, 1, None)
+
+    def touch(self, key):
+        freq = self._freq[key]
+        bucket = self._buckets[freq]
+        del bucket[key]
+        self._put(key, freq + 1, freq)
+        if not bucket:
+            self._drop_bucket(freq)
+
+    def remove(self, key):
+        freq = self._freq.pop(key, None)
+        if freq is None:
+            return
+
+        bucket = self._buckets[freq]
+        del bucket[key]
+        if not bucket:
+            self._drop_bucket(freq)
+
+    def victim(self):
+        return next(iter(self._buckets[self._min_freq]))
+
+
+class RandomPolicy:
+    """Случайное вытеснение: список ключей + индекс для удаления за O(1)."""
+
+    def __init__(self):
+        self._keys = []
+        self._index = {}
+
+    def add(self, key):
+        self._index[key] = len(self._keys)
+        self._keys.append(key)
+
+    def touch(self, key):
+        pass
+
+    def remove(self, key):
+        index = self._index.pop(key, None)
+        if index is None:
+            return
+
+        last = self._keys.pop()
+        if last != key:
+            self._keys[index] = last
+            self._index[last] = index
+
+    def victim(self):
+        return random.choice(self._keys)
+
+
+POLICIES = {
+    POLICY_LRU: LRUPolicy,
+    POLICY_LFU: LFUPolicy,
+    POLICY_RANDOM: RandomPolicy,
+}
+
+
+class Shard:
+    """
+    Один шард хранилища: свои словари, куча сроков, политика вытеснения
+    и замок. Методы с подчёркиванием вызываются под self.lock.
+
+    base — бинарный снимок (или None), из которого ключи подгружаются
+    в шард при первом обращении. _shadowing — ключи шарда, которые
+    перекрывают запись в base, _deleted — удалённые ключи base.
+    """
+
+    def __init__(self, max_keys=0, max_memory=0, policy=POLICY_LRU,
+                 base=None):
+        self.max_keys = max_keys
+        self.max_memory = max_memory
+        self.base = base
+
+        self.lock = threading.Lock()
+        self._data = {}
+        self._expires = {}
+        self._expiry_heap = []
+        self._sizes = {}
+        self._memory = 0
+        self._policy = POLICIES[policy]()
+        self._shadowing = set()
+        self._deleted = set()
+        self._index = SortedKeyIndex()
+
+        self.evictions = 0
+        self.expirations = 0
+
+    def _claim_base(self, key):
+        """Есть ли ключ в base; снимает с него отметку об удалении."""
+        if key in self._deleted:
+            self._deleted.remove(key)
+            return True
+        return self.base is not None and key in self.base
+
+    def _materialize(self, key, now):
+        """Подгружает ключ из base в шард; False, если его там нет."""
+        if self.base is None or key in self._deleted:
+            return False
+
+        try:
+            value, expire_at = self.base.get(key)
+        except KeyError:
+            return False
+
+        if expire_at is not None and expire_at <= now:
+            self._deleted.add(key)
+            self.expirations += 1
+            return False
+
+        self._insert(key, value, expire_at, entry_size(key, value), True)
+        return True
+
+    def _insert(self, key, value, expire_at, size, in_base=False):
+        if in_base:
+            self._shadowing.add(key)
+        self._data[key] = value
+        self._index.add(key)
+        self._sizes[key] = size
+        self._memory += size
+        self._policy.add(key)
+        if expire_at is not None:
+            self._expires[key] = expire_at
+            heapq.heappush(self._expiry_heap, (expire_at, key))
+
+    def _remove(self, key):
+        value = self._data.pop(key)
+        self._index.remove(key)
+        self._memory -= self._sizes.pop(key)
+        self._expires.pop(key, None)
+        self._policy.remove(key)
+        if key in self._shadowing:
+            self._shadowing.remove(key)
+            self._deleted.add(key)
+        return value
+
+    def _alive(self, key, now):
+        """Есть ли ключ; истёкший ключ удаляется (ленивое истечение)."""
+        if key not in self._data and not self._materialize(key, now):
+            return False
+
+        expire_at = self._expires.get(key)
+        if expire_at is None or expire_at > now:
+            return True
+
+        self._remove(key)
+        self.expirations += 1
+        return False
+
+    def _make_room(self, size, records):
+        """Вытесняет ключи, пока новая запись размера size не поместится."""
+        while self._data and (
+            (self.max_keys and len(self._data) >= self.max_keys)
+            or (self.max_memory and self._memory + size > self.max_memory)
+        ):
+            victim = self._policy.victim()
+            self._remove(victim)
+            self.evictions += 1
+            records.append({"op": "del", "key": victim})
+
+    def _load(self, key, value, expire_at, records):
+        size = entry_size(key, value)
+        self._make_room(size, records)
+        self._insert(key, value, expire_at, size, self._claim_base(key))
+
+    def _set(self, key, value, ttl, records):
+        if key in self._data:
+            self._remove(key)
+
+        size = entry_size(key, value)
+        self._make_room(size, records)
+
+        record = {"op": "set", "key": key, "value": value}
+        expire_at = None
+        if ttl is not None:
+            expire_at = record["expire_at"] = time.time() + ttl
+
+        self._insert(key, value, expire_at, size, self._claim_base(key))
+        records.append(record)
+
+    def _apply(self, record, now, records):
+        """Запись чужого журнала: set с абсолютным сроком или del."""
+        key = record["key"]
+        if record["op"] == "set":
+            if key in self._data:
+                self._remove(key)
+            self._load(key, record["value"], record.get("expire_at"), records)
+        elif self._alive(key, now):
+            self._remove(key)
+
+    def _get(self, key, now):
+        if not self._alive(key, now):
+            raise KeyError(key)
+
+        self._policy.touch(key)
+        return self._data[key]
+
+    def _delete(self, key, now, records):
+        if not self._alive(key, now):
+            raise KeyError(key)
+
+        records.append({"op": "del", "key": key})
+        return self._remove(key)
+
+    def _scan(self, lower, inclusive, stop, limit, now, with_values):
+        """
+        До limit живых ключей шарда по возрастанию, начиная с lower.
+        Истёкшие ключи пропускаются (их удалит чистильщик): удалять их
+        здесь нельзя — индекс обходится итератором.
+        """
+        page = []
+        for key in self._index.irange(lower, inclusive):
+            if stop(key):
+                break
+            expire_at = self._expires.get(key)
+            if expire_at is not None and expire_at <= now:
+                continue
+            page.append((key, self._data[key] if with_values else None))
+            if len(page) >= limit:
+                break
+        return page
+
+    def _sweep(self, now):
+        removed = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expire_at, key = heapq.heappop(heap)
+            # Запись кучи могла устареть: ключ удалён или получил новый срок
+            if self._expires.get(key) == expire_at:
+                self._remove(key)
+                self.expirations += 1
+                removed += 1
+
+        # Устаревшие записи копятся при частой перезаписи ключей с TTL
+        if len(heap) > 2 * len(self._expires) + 1024:
+            self._expiry_heap = [(t, k) for k, t in self._expires.items()]
+            heapq.heapify(self._expiry_heap)
+
+        return removed
+
+
+def split_limit(limit, shards, n):
+    """Доля лимита шарда n: доли отличаются не больше чем на 1."""
+    return limit // shards + (n < limit % shards)
+
+
+class StorageEngine:
+    """
+    Потокобезопасное хранилище из N шардов с TTL и вытеснением.
+
+    Ключ попадает в шард по hash(key) % N, у каждого шарда свой замок,
+    поэтому запись в разные шарды не конкурирует. Изменения передаются
+    в persistence.append() под замком шарда: для одного ключа порядок
+    записей в журнале совпадает с порядком изменений.
+
+    Лимиты max_keys и max_memory делятся между шардами поровну (сумма
+    долей равна лимиту) и соблюдаются по шардам: вытеснение идёт внутри
+    шарда, поэтому при перекосе ключей «горячий» шард вытесняет раньше,
+    чем хранилище в целом наберёт max_keys. Лимит меньше числа шардов
+    не делится — такая конфигурация отклоняется. С бинарным снимком
+    лимиты считают только ключи, загруженные в память.
+    """
+
+    def __init__(self, persistence, shards=16, max_keys=0, max_memory=0,
+                 policy=POLICY_LRU):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Неизвестная политика вытеснения: {policy!r}, "
+                f"ожидается одна из {tuple(POLICIES)}"
+            )
+        if shards < 1:
+            raise ValueError("Число шардов должно быть положительным")
+        limits = (("max_keys", max_keys), ("max_memory", max_memory))
+        for name, limit in limits:
+            if 0 < limit < shards:
+                raise ValueError(
+                    f"{name}={limit} меньше числа шардов ({shards}): лимит "
+                    f"делится между шардами, уменьшите число шардов"
+                )
+
+        self.persistence = persistence
+        self.max_keys = max_keys
+        self.max_memory = max_memory
+        self.policy_name = policy
+
+        data, expires, deleted, self.base = persistence.load()
+
+        self._shards = [
+            Shard(
+                max_keys=split_limit(max_keys, shards, n),
+                max_memory=split_limit(max_memory, shards, n),
+                policy=policy,
+                base=self.base,
+            )
+            for n in range(shards)
+        ]
+
+        for key in deleted:
+            if self.base is not None and key in self.base:
+                self._shard(key)._deleted.add(key)
+
+        now = time.time()
+        records = []
+        for key, value in data.items():
+            expire_at = expires.get(key)
+            if expire_at is not None and expire_at <= now:
+                continue
+            # Лимиты могли уменьшиться с прошлого запуска
+            self._shard(key)._load(key, value, expire_at, records)
+        if records:
+            persistence.append(records, self.snapshot)
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _group(self, keys):
+        """Раскладывает ключи по шардам: {индекс шарда: [ключи]}."""
+        groups = {}
+        n = len(self._shards)
+        for key in keys:
+            groups.setdefault(hash(key) % n, []).append(key)
+        return groups
+
+    @contextmanager
+    def _locked(self, indexes):
+        """Берёт замки нескольких шардов в порядке индексов (без дедлоков)."""
+        with ExitStack() as stack:
+            for index in sorted(indexes):
+                stack.enter_context(self._shards[index].lock)
+            yield
+
+    def snapshot(self):
+        """
+        Копии шардов по одному: (значения, сроки) на каждый шард.
+        Замок шарда держится только на время копирования.
+        Затем идут нетронутые записи бинарной базы, если она есть.
+        """
+        skip = set()
+        for shard in self._shards:
+            with shard.lock:
+                part = dict(shard._data), dict(shard._expires)
+                skip.update(shard._shadowing)
+                skip.update(shard._deleted)
+            yield part
+
+        if self.base is not None:
+            yield from base_parts(self.base, skip)
+
+    # ------------------------------------------------------
+    # Публичный интерфейс
+    # ------------------------------------------------------
+
+    def get(self, key):
+        """Значение ключа; KeyError, если ключа нет или он истёк."""
+        shard = self._shard(key)
+        with shard.lock:
+            return shard._get(key, time.time())
+
+    def __contains__(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            return shard._alive(key, time.time())
+
+    def __len__(self):
+        return self.stats()["keys"]
+
+    def ttl(self, key):
+        """Оставшееся время жизни в секундах или None для вечного ключа."""
+        shard = self._shard(key)
+        with shard.lock:
+            now = time.time()
+            if not shard._alive(key, now):
+                raise KeyError(key)
+
+            expire_at = shard._expires.get(key)
+            return None if expire_at is None else expire_at - now
+
+    def set(self, key, value, ttl=None):
+        """Сохранить ключ; ttl — срок жизни в секундах."""
+        shard = self._shard(key)
+        with shard.lock:
+            records = []
+            shard._set(key, value, ttl, records)
+            self.persistence.append(records, self.snapshot)
+
+    def set_many(self, items, ttl=None):
+        """Сохранить несколько ключей одной записью в журнал."""
+        if not items:
+            return
+
+        groups = self._group(items)
+        with self._locked(groups):
+            records = []
+            for index, keys in groups.items():
+                shard = self._shards[index]
+                for key in keys:
+                    shard._set(key, items[key], ttl, records)
+            self.persistence.append(records, self.snapshot)
+
+    def get_many(self, keys):
+        """Словарь найденных значений для списка ключей."""
+        values = {}
+        now = time.time()
+        for index, group in self._group(dict.fromkeys(keys)).items():
+            shard = self._shards[index]
+            with shard.lock:
+                for key in group:
+                    try:
+                        values[key] = shard._get(key, now)
+                    except KeyError:
+                        pass
+        return values
+
+    def delete(self, key):
+        """Удалить ключ и вернуть его значение; KeyError, если ключа нет."""
+        shard = self._shard(key)
+        with shard.lock:
+            records = []
+            value = shard._delete(key, time.time(), records)
+            self.persistence.append(records, self.snapshot)
+            return value
+
+    def delete_many(self, keys):
+        """Удалить несколько ключей; возвращает список удалённых."""
+        keys = list(dict.fromkeys(keys))
+        groups = self._group(keys)
+        with self._locked(groups):
+            now = time.time()
+            records = []
+            for index, group in groups.items():
+                shard = self._shards[index]
+                for key in group:
+                    try:
+                        shard._delete(key, now, records)
+                    except KeyError:
+                        pass
+            if records:
+                self.persistence.append(records, self.snapshot)
+
+        deleted = {record["key"] for record in records}
+        return [key for key in keys if key in deleted]
+
+    def apply(self, records):
+        """
+        Применяет записи журнала другого хранилища (поток ведущего
+        для реплики). Сроки в записях абсолютные, del отсутствующего
+        ключа ничего не делает, поэтому повторное применение безопасно.
+        """
+        groups = self._group(record["key"] for record in records)
+        with self._locked(groups):
+            now = time.time()
+            evicted = []
+            for record in records:
+                self._shard(record["key"])._apply(record, now, evicted)
+            if evicted:
+                self.persistence.append(evicted, self.snapshot)
+
+    # ------------------------------------------------------
+    # Упорядоченный обход ключей
+    # ------------------------------------------------------
+
+    def scan(self, prefix=None, start=None, end=None, after=None,
+             limit=100, with_values=False):
+        """
+        Страница ключей по возрастанию: (список (ключ, значение), курсор).
+
+        prefix — ключи с этим префиксом; start/end — диапазон
+        [start, end); after — курсор: ключ, после которого продолжать.
+        Каждый шард отдаёт не больше limit ключей за O(log n + limit),
+        затем страницы сливаются. Курсор None — страниц больше нет.
+        """
+        bounds = [k for k in (prefix, start) if k is not None]
+        lower = max(bounds) if bounds else None
+        inclusive = True
+        if after is not None and (lower is None or after >= lower):
+            lower, inclusive = after, False
+
+        def stop(key):
+            return (
+                (end is not None and key >= end)
+                or (prefix is not None and not key.startswith(prefix))
+            )
+
+        now = time.time()
+        pages = []
+        for shard in self._shards:
+            with shard.lock:
+                pages.append(shard._scan(
+                    lower, inclusive, stop, limit, now, with_values
+                ))
+
+        if self.base is not None:
+            pages.append(
+                self._scan_base(lower, inclusive, stop, limit, now, with_values)
+            )
+
+        items = list(islice(heapq.merge(*pages), limit))
+        cursor = items[-1][0] if len(items) == limit else None
+        return items, cursor
+
+    def _scan_base(self, lower, inclusive, stop, limit, now, with_values):
+        """До limit ключей бинарной базы, не перекрытых шардами."""
+        page = []
+        first = self.base.bisect(lower, inclusive) if lower is not None else 0
+        for key, expire_at, i in self.base.keys(first):
+            if stop(key):
+                break
+            if expire_at is not None and expire_at <= now:
+                continue
+
+            shard = self._shard(key)
+            with shard.lock:
+                # Перекрытые ключи шард уже отдал сам, удалённые — скрыты
+                hidden = key in shard._shadowing or key in shard._deleted
+            if hidden:
+                continue
+
+            page.append((key, self.base.value_at(i) if with_values else None))
+            if len(page) >= limit:
+                break
+        return page
+
+    # ------------------------------------------------------
+    # Фоновое удаление истёкших ключей
+    # ------------------------------------------------------
+
+    def sweep(self):
+        """Удаляет все истёкшие ключи; шарды обходятся по одному."""
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                removed += shard._sweep(time.time())
+        return removed
+
+    def start_sweeper(self, interval=1.0):
+        """Запускает фоновый поток, вызывающий sweep() раз в interval секунд."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.sweep()
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """Счётчики хранилища (суммы по шардам)."""
+        resident = hidden = memory = evictions = expirations = 0
+        for shard in self._shards:
+            with shard.lock:
+                resident += len(shard._data)
+                hidden += len(shard._shadowing) + len(shard._deleted)
+                memory += shard._memory
+                evictions += shard.evictions
+                expirations += shard.expirations
+
+        base_keys = len(self.base) if self.base is not None else 0
+        return {
+            "keys": resident + base_keys - hidden,
+            "resident_keys": resident,
+            "base_keys": base_keys,
+            "memory_bytes": memory,
+            "max_keys": self.max_keys,
+            "max_memory": self.max_memory,
+            "policy": self.policy_name,
+            "shards": len(self._shards),
+            "evictions": evictions,
+            "expirations": expirations,
+        }
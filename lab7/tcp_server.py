@@ -0,0 +1,392 @@
+"""
+TCP-интерфейс key-value хранилища в духе протокола Redis (RESP2).
+
+Работает на asyncio поверх того же StorageEngine, что и HTTP-маршруты
+kv_store.py, поэтому данные, журнал и TTL общие. Соединения постоянные,
+команды можно отправлять конвейером (pipelining): сервер разбирает всё,
+что пришло в буфер, выполняет команды по порядку и отправляет ответы
+одной записью.
+
+Поддерживаются и массивы RESP (*2\\r\\n$3\\r\\nGET\\r\\n$1\\r\\na\\r\\n),
+и inline-команды (GET a\\r\\n), так что работает и redis-cli, и telnet.
+
+Команды: PING, GET, SET key value [EX s | PX ms], DEL, EXISTS, MGET,
+MSET, TTL, SCAN cursor [MATCH prefix*] [COUNT n], COMMAND, QUIT.
+
+На реплике (read_only=True) команды записи отвечают -READONLY.
+
+Строковые значения отдаются как есть, остальные (числа, списки,
+объекты, записанные через HTTP) — в виде JSON.
+"""
+import asyncio
+import json
+import threading
+
+MAX_BULK = 512 * 1024 * 1024
+READ_CHUNK = 64 * 1024
+# Длина строки без \r\n (inline-команда, заголовок массива или bulk),
+# после которой соединение закрывается, как в Redis
+MAX_LINE = 64 * 1024
+
+
+class ProtocolError(Exception):
+    """Некорректный запрос — соединение закрывается."""
+
+
+class CommandError(Exception):
+    """Ошибка выполнения команды — клиенту уходит -ERR."""
+
+
+# ------------------------------------------------------
+# Кодирование ответов
+# ------------------------------------------------------
+
+OK = b"+OK\r\n"
+NULL = b"$-1\r\n"
+
+
+def encode_bulk(data):
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def encode_int(n):
+    return b":%d\r\n" % n
+
+
+def encode_error(message):
+    return b"-ERR " + message.encode("utf-8") + b"\r\n"
+
+
+def encode_array(items):
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+def encode_value(value):
+    """Значение хранилища в bulk string: строка как есть, остальное — JSON."""
+    if isinstance(value, str):
+        return encode_bulk(value.encode("utf-8"))
+    return encode_bulk(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+# ------------------------------------------------------
+# Разбор запросов
+# ------------------------------------------------------
+
+def find_line(buf, pos):
+    """Конец строки, начатой в pos, или -1; ProtocolError, если строка
+    длиннее MAX_LINE, а \\r\\n так и не пришёл."""
+    end = buf.find(b"\r\n", pos, pos + MAX_LINE + 2)
+    if end == -1 and len(buf) - pos > MAX_LINE + 1:
+        raise ProtocolError("too big request line")
+    return end
+
+
+def parse_command(buf, pos):
+    """
+    Разбирает одну команду из buf начиная с pos.
+    Возвращает (аргументы, новая позиция) или (None, pos), если команда
+    пришла не целиком.
+    """
+    if pos >= len(buf):
+        return None, pos
+
+    if buf[pos] != ord("*"):
+        # inline-команда: строка аргументов через пробел
+        end = find_line(buf, pos)
+        if end == -1:
+            return None, pos
+        return bytes(buf[pos:end]).split(), end + 2
+
+    begin = pos
+    end = find_line(buf, pos)
+    if end == -1:
+        return None, begin
+    try:
+        count = int(buf[pos + 1:end])
+    except ValueError:
+        raise ProtocolError("invalid multibulk length")
+
+    args = []
+    pos = end + 2
+    for _ in range(count):
+        end = find_line(buf, pos)
+        if end == -1:
+            return None, begin
+        if buf[pos] != ord("$"):
+            raise ProtocolError("expected '$'")
+        try:
+            length = int(buf[pos + 1:end])
+        except ValueError:
+            raise ProtocolError("invalid bulk length")
+        if not 0 <= length <= MAX_BULK:
+            raise ProtocolError("invalid bulk length")
+
+        start = end + 2
+        if len(buf) < start + length + 2:
+            return None, begin
+        args.append(bytes(buf[start:start + length]))
+        pos = start + length + 2
+
+    return args, pos
+
+
+# ------------------------------------------------------
+# Команды
+# ------------------------------------------------------
+
+def _text(arg):
+    try:
+        return arg.decode("utf-8")
+    except UnicodeDecodeError:
+        raise CommandError("keys and values must be UTF-8")
+
+
+def _arity(args, minimum, even=False):
+    if len(args) < minimum or (even and len(args) % 2 != minimum % 2):
+        raise CommandError(
+            f"wrong number of arguments for '{_text(args[0]).lower()}' command"
+        )
+
+
+def cmd_ping(engine, args):
+    return encode_bulk(args[1]) if len(args) > 1 else b"+PONG\r\n"
+
+
+def cmd_get(engine, args):
+    _arity(args, 2)
+    try:
+        return encode_value(engine.get(_text(args[1])))
+    except KeyError:
+        return NULL
+
+
+def cmd_set(engine, args):
+    _arity(args, 3)
+    ttl = None
+    if len(args) == 5 and args[3].upper() in (b"EX", b"PX"):
+        try:
+            ttl = int(args[4])
+        except ValueError:
+            raise CommandError("value is not an integer or out of range")
+        if ttl <= 0:
+            raise CommandError("invalid expire time in 'set' command")
+        if args[3].upper() == b"PX":
+            ttl /= 1000
+    elif len(args) != 3:
+        raise CommandError("syntax error")
+
+    engine.set(_text(args[1]), _text(args[2]), ttl)
+    return OK
+
+
+def cmd_del(engine, args):
+    _arity(args, 2)
+    return encode_int(len(engine.delete_many([_text(a) for a in args[1:]])))
+
+
+def cmd_exists(engine, args):
+    _arity(args, 2)
+    return encode_int(sum(_text(a) in engine for a in args[1:]))
+
+
+def cmd_mget(engine, args):
+    _arity(args, 2)
+    keys = [_text(a) for a in args[1:]]
+    values = engine.get_many(keys)
+    return encode_array([
+        encode_value(values[key]) if key in values else NULL for key in keys
+    ])
+
+
+def cmd_mset(engine, args):
+    _arity(args, 3, even=True)
+    pairs = [_text(a) for a in args[1:]]
+    engine.set_many(dict(zip(pairs[::2], pairs[1::2])))
+    return OK
+
+
+def cmd_ttl(engine, args):
+    _arity(args, 2)
+    try:
+        remaining = engine.ttl(_text(args[1]))
+    except KeyError:
+        return encode_int(-2)
+    return encode_int(-1 if remaining is None else int(remaining))
+
+
+def encode_cursor(key):
+    """
+    Курсор SCAN: "0" — начало и конец обхода, иначе "1" + hex(UTF-8
+    последнего отданного ключа). Ни один ключ (даже "0" или пустой)
+    не даёт курсор "0".
+    """
+    return "0" if key is None else "1" + key.encode("utf-8").hex()
+
+
+def decode_cursor(cursor):
+    """Ключ, после которого продолжать обход, или None для "0"."""
+    if cursor == "0":
+        return None
+    try:
+        if not cursor.startswith("1"):
+            raise ValueError
+        return bytes.fromhex(cursor[1:]).decode("utf-8")
+    except ValueError:
+        raise CommandError("invalid cursor")
+
+
+def cmd_scan(engine, args):
+    """SCAN cursor [MATCH prefix*] [COUNT n]; курсор — см. encode_cursor."""
+    _arity(args, 2)
+    after = decode_cursor(_text(args[1]))
+    prefix, count = None, 10
+    options = args[2:]
+    if len(options) % 2:
+        raise CommandError("syntax error")
+    for name, value in zip(options[::2], options[1::2]):
+        if name.upper() == b"MATCH":
+            pattern = _text(value)
+            if "*" in pattern[:-1] or "?" in pattern or "[" in pattern:
+                raise CommandError("only 'prefix*' patterns are supported")
+            prefix = pattern.rstrip("*")
+        elif name.upper() == b"COUNT":
+            try:
+                count = int(value)
+            except ValueError:
+                raise CommandError("value is not an integer or out of range")
+            if count < 1:
+                raise CommandError("syntax error")
+        else:
+            raise CommandError("syntax error")
+
+    items, next_cursor = engine.scan(
+        prefix=prefix,
+        after=after,
+        limit=count,
+    )
+    return encode_array([
+        encode_bulk(encode_cursor(next_cursor).encode("ascii")),
+        encode_array([encode_bulk(key.encode("utf-8")) for key, _ in items]),
+    ])
+
+
+def cmd_command(engine, args):
+    # redis-cli запрашивает COMMAND DOCS при подключении
+    return encode_array([])
+
+
+COMMANDS = {
+    b"PING": cmd_ping,
+    b"GET": cmd_get,
+    b"SET": cmd_set,
+    b"DEL": cmd_del,
+    b"EXISTS": cmd_exists,
+    b"MGET": cmd_mget,
+    b"MSET": cmd_mset,
+    b"TTL": cmd_ttl,
+    b"SCAN": cmd_scan,
+    b"COMMAND": cmd_command,
+}
+
+
+WRITE_COMMANDS = {b"SET", b"DEL", b"MSET"}
+READONLY = b"-READONLY You can't write against a read only replica.\r\n"
+
+
+def execute(engine, args, read_only=False):
+    """Выполняет одну команду и возвращает закодированный ответ."""
+    name = args[0].upper()
+    if read_only and name in WRITE_COMMANDS:
+        return READONLY
+    handler = COMMANDS.get(name)
+    if handler is None:
+        return encode_error(f"unknown command '{_text(args[0])}'")
+    try:
+        return handler(engine, args)
+    except CommandError as e:
+        return encode_error(str(e))
+
+
+# ------------------------------------------------------
+# Сервер
+# ------------------------------------------------------
+
+class RespServer:
+    """asyncio-сервер RESP поверх StorageEngine."""
+
+    def __init__(self, engine, host="127.0.0.1", port=6380, read_only=False):
+        self.engine = engine
+        self.read_only = read_only
+        self.host = host
+        self.port = port
+        self.loop = None
+        self._server = None
+
+    async def handle(self, reader, writer):
+        buf = bytearray()
+        try:
+            while True:
+                chunk = await reader.read(READ_CHUNK)
+                if not chunk:
+                    break
+                buf += chunk
+
+                # Выполняем все целиком пришедшие команды и отвечаем на
+                # них одной записью — так работает конвейер.
+                replies = []
+                pos = 0
+                closing = False
+                while True:
+                    args, pos = parse_command(buf, pos)
+                    if args is None:
+                        break
+                    if not args:
+                        continue
+                    if args[0].upper() == b"QUIT":
+                        replies.append(OK)
+                        closing = True
+                        break
+                    replies.append(execute(self.engine, args, self.read_only))
+                del buf[:pos]
+
+                writer.write(b"".join(replies))
+                await writer.drain()
+                if closing:
+                    break
+        except ProtocolError as e:
+            writer.write(b"-ERR Protocol error: " + str(e).encode() + b"\r\n")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self.handle, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start_in_thread(self):
+        """Запускает сервер в отдельном потоке со своим event loop."""
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self.start())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self.loop.run_forever()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return thread
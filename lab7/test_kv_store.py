@@ -0,0 +1,639 @@
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from persistence import LogPersistence, SnapshotPersistence
+from snapshot import binary_to_json, json_to_binary
+from storage import StorageEngine
+import tcp_server
+from tcp_server import RespServer
+
+
+THREADS = 8
+OPS_PER_THREAD = 2000
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Отдельная папка для data.json и журнала каждого теста."""
+    return str(tmp_path)
+
+
+def open_log(data_dir, compact_bytes=4096, snapshot_format="json"):
+    return LogPersistence(
+        os.path.join(data_dir, "data.json"),
+        os.path.join(data_dir, "data.log"),
+        fsync="never",
+        compact_bytes=compact_bytes,
+        snapshot_format=snapshot_format,
+    )
+
+
+def state(engine):
+    """Полное состояние хранилища одним словарём."""
+    result = {}
+    for data, _ in engine.snapshot():
+        result.update(data)
+    return result
+
+
+def run_threads(target, count=THREADS):
+    errors = []
+
+    def wrapper(n):
+        try:
+            target(n)
+        except Exception as e:  # pragma: no cover - попадёт в assert ниже
+            errors.append(e)
+
+    threads = [threading.Thread(target=wrapper, args=(n,)) for n in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=60)
+        assert not t.is_alive(), "поток завис — возможен дедлок"
+    assert errors == []
+
+
+@pytest.mark.parametrize("snapshot_format", ["json", "binary"])
+def test_concurrent_writes_survive_restart(data_dir, snapshot_format):
+    """Стресс-тест: параллельные set/delete/get с уплотнением журнала."""
+    engine = StorageEngine(
+        open_log(data_dir, snapshot_format=snapshot_format), shards=8
+    )
+    hot_keys = [f"hot:{i}" for i in range(20)]
+
+    def worker(n):
+        rnd = random.Random(n)
+        for i in range(OPS_PER_THREAD):
+            roll = rnd.random()
+            key = rnd.choice(hot_keys) if roll < 0.3 else f"t{n}:{i % 200}"
+            if roll < 0.6:
+                engine.set(key, {"thread": n, "i": i})
+            elif roll < 0.8:
+                try:
+                    engine.delete(key)
+                except KeyError:
+                    pass
+            else:
+                try:
+                    engine.get(key)
+                except KeyError:
+                    pass
+
+    run_threads(worker)
+    expected = state(engine)
+    engine.persistence.close()
+
+    # Журнал успел несколько раз свернуться в снимок
+    snapshot_file = "data.json" if snapshot_format == "json" else "data.kvs"
+    assert os.path.exists(os.path.join(data_dir, snapshot_file))
+
+    restored = StorageEngine(
+        open_log(data_dir, snapshot_format=snapshot_format), shards=3
+    )
+    assert state(restored) == expected
+    restored.persistence.close()
+
+
+def write_log(path, records, tail=b""):
+    with open(path, "wb") as f:
+        for record in records:
+            f.write(json.dumps(record).encode("utf-8") + b"\n")
+        f.write(tail)
+
+
+def test_log_replays_old_log_then_current(data_dir):
+    """Незавершённое уплотнение: снимок + data.log.old + data.log."""
+    with open(os.path.join(data_dir, "data.json"), "w") as f:
+        json.dump({"a": 1, "b": 1}, f)
+    log_file = os.path.join(data_dir, "data.log")
+    write_log(log_file + ".old", [
+        {"op": "set", "key": "b", "value": 2},
+        {"op": "del", "key": "a"},
+        {"op": "set", "key": "c", "value": 1},
+    ])
+    write_log(log_file, [
+        {"op": "set", "key": "c", "value": 3},
+        {"op": "set", "key": "a", "value": 4},
+    ])
+
+    engine = StorageEngine(open_log(data_dir))
+    assert state(engine) == {"a": 4, "b": 2, "c": 3}
+    # Уплотнение доведено до конца: старый журнал свёрнут в снимок
+    assert not os.path.exists(log_file + ".old")
+    with open(os.path.join(data_dir, "data.json")) as f:
+        assert json.load(f) == {"a": 4, "b": 2, "c": 3}
+    engine.persistence.close()
+
+
+def test_log_truncates_torn_last_record(data_dir):
+    """Недописанная последняя запись журнала отрезается при старте."""
+    log_file = os.path.join(data_dir, "data.log")
+    torn = b'{"op": "set", "key": "b", "val'
+    write_log(log_file, [{"op": "set", "key": "a", "value": 1}], tail=torn)
+    valid_size = os.path.getsize(log_file) - len(torn)
+
+    engine = StorageEngine(open_log(data_dir))
+    assert state(engine) == {"a": 1}
+    assert os.path.getsize(log_file) == valid_size
+
+    # Новые записи идут сразу за последней целой и переживают рестарт
+    engine.set("c", 2)
+    engine.persistence.close()
+    restored = StorageEngine(open_log(data_dir))
+    assert state(restored) == {"a": 1, "c": 2}
+    restored.persistence.close()
+
+
+def test_concurrent_batches_across_shards(data_dir):
+    """Пакеты, задевающие много шардов, не дедлочат и не теряют записи."""
+    engine = StorageEngine(open_log(data_dir), shards=4)
+
+    def worker(n):
+        rnd = random.Random(n)
+        for _ in range(300):
+            keys = [f"k{rnd.randrange(50)}" for _ in range(10)]
+            if rnd.random() < 0.7:
+                engine.set_many({key: n for key in keys})
+            else:
+                engine.delete_many(keys)
+            engine.get_many(keys)
+
+    run_threads(worker)
+    expected = state(engine)
+    engine.persistence.close()
+
+    restored = StorageEngine(open_log(data_dir), shards=4)
+    assert state(restored) == expected
+    restored.persistence.close()
+
+
+def test_eviction_limit_under_concurrency(data_dir):
+    """Лимит max_keys соблюдается при параллельной записи."""
+    engine = StorageEngine(open_log(data_dir), shards=4, max_keys=100)
+
+    run_threads(lambda n: [engine.set(f"{n}:{i}", i) for i in range(500)])
+
+    stats = engine.stats()
+    assert stats["keys"] <= 100
+    assert stats["evictions"] == THREADS * 500 - stats["keys"]
+    engine.persistence.close()
+
+
+def test_max_keys_split_between_shards(data_dir):
+    """Доли шардов в сумме дают max_keys; лимит меньше числа шардов
+    отклоняется."""
+    engine = StorageEngine(open_log(data_dir), shards=4, max_keys=10)
+    for i in range(1000):
+        engine.set(f"k{i}", i)
+    assert engine.stats()["keys"] == 10
+    engine.persistence.close()
+
+    with pytest.raises(ValueError):
+        StorageEngine(open_log(data_dir), shards=16, max_keys=10)
+
+
+def test_ttl_expiry_lazy_and_sweeper(data_dir):
+    """Истёкший ключ снимается чтением или чистильщиком; сроки
+    переживают рестарт."""
+    engine = StorageEngine(open_log(data_dir), shards=2)
+    engine.set("swept", 1, ttl=0.05)
+    engine.set("lazy", 2, ttl=0.05)
+    engine.set("long", 3, ttl=60)
+    engine.set("forever", 4)
+    time.sleep(0.1)
+
+    with pytest.raises(KeyError):
+        engine.get("lazy")
+    assert engine.stats()["expirations"] == 1
+    assert engine.sweep() == 1
+    assert "swept" not in engine
+    assert engine.stats()["expirations"] == 2
+    assert 0 < engine.ttl("long") <= 60
+    assert engine.ttl("forever") is None
+    engine.persistence.close()
+
+    restored = StorageEngine(open_log(data_dir), shards=2)
+    assert state(restored) == {"long": 3, "forever": 4}
+    assert 0 < restored.ttl("long") <= 60
+    restored.persistence.close()
+
+
+def test_lfu_evicts_least_frequent_then_oldest(data_dir):
+    """LFU: вытесняется самый редкий ключ, при равной частоте — давний."""
+    engine = StorageEngine(open_log(data_dir), shards=1, max_keys=3,
+                           policy="lfu")
+    for key in "abc":
+        engine.set(key, key)
+    for key in "aaab":
+        engine.get(key)                   # a: 4, b: 2, c: 1
+
+    engine.set("d", "d")                  # вытесняет c (частота 1)
+    assert set(state(engine)) == {"a", "b", "d"}
+    engine.get("d")                       # d: 2, но b попал в 2 раньше
+    engine.set("e", "e")                  # вытесняет b
+    assert set(state(engine)) == {"a", "d", "e"}
+    engine.set("f", "f")                  # вытесняет e (частота 1)
+    assert set(state(engine)) == {"a", "d", "f"}
+    assert engine.stats()["evictions"] == 3
+    engine.persistence.close()
+
+
+def test_snapshot_mode_under_concurrency(data_dir):
+    """Режим snapshot: фоновая перезапись data.json после параллельной записи."""
+    data_file = os.path.join(data_dir, "data.json")
+    engine = StorageEngine(SnapshotPersistence(data_file), shards=4)
+
+    run_threads(lambda n: [engine.set(f"{n}:{i}", i) for i in range(200)])
+    expected = state(engine)
+    engine.persistence.close()
+
+    restored = StorageEngine(SnapshotPersistence(data_file), shards=4)
+    assert state(restored) == expected
+
+
+def test_binary_snapshot_loads_lazily(data_dir):
+    """Бинарный снимок: в память попадают только затронутые ключи."""
+    data_file = os.path.join(data_dir, "data.json")
+    with open(data_file, "w", encoding="utf-8") as f:
+        json.dump({f"key:{i}": {"n": i} for i in range(1000)}, f)
+
+    engine = StorageEngine(open_log(data_dir, snapshot_format="binary"))
+    stats = engine.stats()
+    assert (stats["keys"], stats["resident_keys"]) == (1000, 0)
+
+    assert engine.get("key:7") == {"n": 7}
+    assert "key:8" in engine
+    engine.delete("key:9")
+    engine.set("key:10", "new")
+    engine.set("extra", 1)
+    stats = engine.stats()
+    assert (stats["keys"], stats["resident_keys"]) == (1000, 4)
+    engine.persistence.close()
+
+    # Удаление и перезапись переживают рестарт поверх того же data.kvs
+    restored = StorageEngine(open_log(data_dir, snapshot_format="binary"))
+    assert "key:9" not in restored
+    assert restored.get("key:10") == "new"
+    assert len(restored) == 1000
+    expected = state(restored)
+    restored.persistence.compact(restored.snapshot)
+    restored.persistence.close()
+
+    # Конвертация обратно в JSON даёт то же состояние
+    kvs_file = os.path.join(data_dir, "data.kvs")
+    json_file = os.path.join(data_dir, "export.json")
+    binary_to_json(kvs_file, json_file)
+    with open(json_file, encoding="utf-8") as f:
+        assert json.load(f) == expected
+
+    json_to_binary(json_file, kvs_file)
+    assert state(StorageEngine(open_log(data_dir, snapshot_format="binary"))) \
+        == expected
+
+
+@pytest.mark.parametrize("snapshot_format", ["json", "binary"])
+def test_scan_pages_match_sorted_keys(data_dir, snapshot_format):
+    """Постраничный /scan отдаёт те же ключи, что и полная сортировка."""
+    data_file = os.path.join(data_dir, "data.json")
+    with open(data_file, "w", encoding="utf-8") as f:
+        json.dump({f"user:{u}:{i}": i for u in range(20) for i in range(30)}, f)
+
+    engine = StorageEngine(
+        open_log(data_dir, snapshot_format=snapshot_format), shards=4
+    )
+    engine.delete_many([f"user:1:{i}" for i in range(0, 30, 3)])
+    engine.set_many({f"user:1:{i}x": "new" for i in range(10)})
+    engine.set("user:1:5", "changed")
+    expected = sorted(k for k in state(engine) if k.startswith("user:1:"))
+
+    keys, cursor = [], None
+    while True:
+        items, cursor = engine.scan(prefix="user:1:", after=cursor, limit=7)
+        keys.extend(key for key, _ in items)
+        if cursor is None:
+            break
+    assert keys == expected
+
+    items, _ = engine.scan(start="user:10:", end="user:11:", limit=1000,
+                           with_values=True)
+    assert items == [(f"user:10:{i}", i) for i in sorted(range(30), key=str)]
+    engine.persistence.close()
+
+
+def test_resp_pipeline(data_dir):
+    """RESP: конвейер из нескольких команд, разрезанный на куски."""
+    engine = StorageEngine(open_log(data_dir))
+    engine.set("json", {"a": 1})
+    server = RespServer(engine, port=0)
+    server.start_in_thread()
+
+    payload = (
+        b"*3\r\n$3\r\nSET\r\n$1\r\na\r\n$5\r\nhello\r\n"
+        b"*2\r\n$3\r\nGET\r\n$1\r\na\r\n"
+        b"GET missing\r\n"
+        b"*2\r\n$3\r\nGET\r\n$4\r\njson\r\n"
+        b"*3\r\n$3\r\nDEL\r\n$1\r\na\r\n$1\r\nb\r\n"
+        b"TTL a\r\n"
+        b"QUIT\r\n"
+    )
+    expected = (
+        b"+OK\r\n$5\r\nhello\r\n$-1\r\n$8\r\n{\"a\": 1}\r\n"
+        b":1\r\n:-2\r\n+OK\r\n"
+    )
+    with socket.create_connection(("127.0.0.1", server.port)) as sock:
+        for i in range(0, len(payload), 7):
+            sock.sendall(payload[i:i + 7])
+        received = b""
+        while chunk := sock.recv(4096):
+            received += chunk
+    assert received == expected
+    engine.persistence.close()
+
+
+def test_resp_scan_cursor_and_line_limit(data_dir):
+    """SCAN не путает курсор с ключом "0"; строка без \\r\\n длиннее
+    MAX_LINE закрывает соединение."""
+    engine = StorageEngine(open_log(data_dir))
+    keys = ["", "0", "00", "1", "a"]
+    engine.set_many({key: key for key in keys})
+    server = RespServer(engine, port=0)
+    server.start_in_thread()
+
+    seen, cursor = [], b"0"
+    with socket.create_connection(("127.0.0.1", server.port)) as sock:
+        stream = sock.makefile("rb")
+        while True:
+            sock.sendall(b"*4\r\n$4\r\nSCAN\r\n$%d\r\n%s\r\n"
+                         b"$5\r\nCOUNT\r\n$1\r\n1\r\n"
+                         % (len(cursor), cursor))
+            assert stream.readline() == b"*2\r\n"
+            stream.readline()
+            cursor = stream.readline().rstrip(b"\r\n")
+            count = int(stream.readline()[1:])
+            for _ in range(count):
+                stream.readline()
+                seen.append(stream.readline().rstrip(b"\r\n").decode())
+            if cursor == b"0":
+                break
+    assert seen == sorted(keys)
+
+    with socket.create_connection(("127.0.0.1", server.port)) as sock:
+        sock.sendall(b"GET " + b"x" * (tcp_server.MAX_LINE + 10))
+        reply = b""
+        while chunk := sock.recv(4096):
+            reply += chunk
+    assert reply.startswith(b"-ERR Protocol error")
+    engine.persistence.close()
+
+
+# ------------------------------------------------------
+# Репликация: ведущий и реплики — отдельные процессы kv_store.py
+# ------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request(
+            method, path,
+            body=body if body is None or isinstance(body, str)
+            else json.dumps(body),
+            headers={"Content-Type": "application/json"},
+        )
+        response = conn.getresponse()
+        data = response.read()
+        if response.getheader("Content-Type") != "application/json":
+            return response.status, data  # например, 429 от Flask-Limiter
+        return response.status, json.loads(data)
+    finally:
+        conn.close()
+
+
+def spawn_store(data_dir, port, **env):
+    """Запускает kv_store.py и ждёт, пока он начнёт отвечать."""
+    process = subprocess.Popen(
+        [sys.executable, "kv_store.py"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, KV_DATA_DIR=data_dir, KV_PORT=str(port),
+                 KV_DEBUG="0", KV_FSYNC="never", **env),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        assert process.poll() is None, "kv_store.py завершился при старте"
+        try:
+            request(port, "GET", "/replication")
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise TimeoutError(f"kv_store.py не поднялся на порту {port}")
+
+
+def wait_synced(port, leader_seq, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, status = request(port, "GET", "/replication")
+        if status["applied_seq"] >= leader_seq and status["lag_records"] == 0:
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f"реплика на порту {port} отстала: {status}")
+
+
+def test_set_rejects_non_string_key(tmp_path):
+    """Ключ не строкой — 400 с описанием ошибки, а не 500."""
+    port = free_port()
+    process = spawn_store(str(tmp_path), port)
+    try:
+        code, body = request(port, "POST", "/set", {"key": 5, "value": "x"})
+        assert code == 400
+        assert "key" in body["error"]
+        assert request(port, "POST", "/set", {"key": "5", "value": "x"})[0] \
+            == 200
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@pytest.fixture
+def store_port(tmp_path):
+    """kv_store.py с высоким лимитом пакетных запросов."""
+    port = free_port()
+    process = spawn_store(str(tmp_path), port,
+                          KV_BATCH_RATE_LIMIT="1000 per minute")
+    yield port
+    process.terminate()
+    process.wait(timeout=10)
+
+
+def test_batch_round_trip(store_port):
+    """MSET/MGET/MDEL по HTTP: сохранённое читается, удалённое пропадает."""
+    items = {"a": 1, "b": {"x": [1, 2]}, "c": "три"}
+    assert request(store_port, "POST", "/mset", {"items": items}) == \
+        (200, {"status": "OK", "saved": 3, "ttl": None})
+
+    code, body = request(store_port, "POST", "/mget",
+                         {"keys": ["a", "b", "c", "nope"]})
+    assert code == 200
+    assert body == {"values": items, "missing": ["nope"]}
+
+    assert request(store_port, "DELETE", "/mdel", {"keys": ["a", "nope"]}) \
+        == (200, {"status": "deleted", "deleted": ["a"]})
+    assert request(store_port, "POST", "/mdel", {"keys": ["c"]})[1] \
+        ["deleted"] == ["c"]
+    assert request(store_port, "POST", "/mget", {"keys": ["a", "b", "c"]}) \
+        == (200, {"values": {"b": {"x": [1, 2]}}, "missing": ["a", "c"]})
+
+    # ttl пакета применяется ко всем ключам
+    request(store_port, "POST", "/mset", {"items": {"t": 1}, "ttl": 60})
+    assert 0 < request(store_port, "GET", "/ttl/t")[1]["ttl"] <= 60
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/mset", "{not json"),
+    ("/mset", {"keys": ["a"]}),
+    ("/mset", {"items": ["a", "b"]}),
+    ("/mset", {"items": {"a": 1}, "ttl": -1}),
+    ("/mget", "{not json"),
+    ("/mget", ["a"]),
+    ("/mget", {"keys": "a"}),
+    ("/mget", {"keys": ["a", 5]}),
+    ("/mdel", {"items": {"a": 1}}),
+    ("/mdel", {"keys": [None]}),
+])
+def test_batch_rejects_malformed_body(store_port, path, body):
+    """Некорректное тело пакетного запроса — 400, а не 500."""
+    code, reply = request(store_port, "POST", path, body)
+    assert code == 400
+    assert reply["error"]
+
+
+@pytest.mark.parametrize("mode, allowed", [("batch", 5), ("key", 1)])
+def test_batch_rate_limit_cost(tmp_path, mode, allowed):
+    """KV_BATCH_LIMIT_MODE=key списывает N единиц за пакет, batch — одну."""
+    port = free_port()
+    process = spawn_store(str(tmp_path), port,
+                          KV_BATCH_RATE_LIMIT="5 per minute",
+                          KV_BATCH_LIMIT_MODE=mode)
+    try:
+        keys = {"keys": ["a", "b", "c"]}
+        codes = [request(port, "POST", "/mget", keys)[0] for _ in range(6)]
+        assert codes == [200] * allowed + [429] * (6 - allowed)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def scan_all(port, query):
+    """Все ключи /scan, проходя по курсору; плюс число страниц."""
+    keys, pages, cursor = [], 0, None
+    while True:
+        path = "/scan?" + query + ("" if cursor is None
+                                   else f"&cursor={cursor}")
+        code, page = request(port, "GET", path)
+        assert code == 200
+        keys += page["keys"]
+        pages += 1
+        cursor = page["cursor"]
+        if cursor is None:
+            return keys, pages
+
+
+def test_scan_endpoint(store_port):
+    """/scan по HTTP: проверка limit, prefix, start/end, values и курсор."""
+    items = {f"user:{i:03}": i for i in range(25)}
+    items.update({"order:1": "a", "order:2": "b", "zeta": None})
+    request(store_port, "POST", "/mset", {"items": items})
+    users = sorted(k for k in items if k.startswith("user:"))
+
+    for limit in ("0", "-1", "abc", "1001"):
+        code, body = request(store_port, "GET", f"/scan?limit={limit}")
+        assert code == 400
+        assert "limit" in body["error"]
+
+    # Страницы по 10 ключей: 10 + 10 + 5, последняя без курсора
+    assert scan_all(store_port, "prefix=user:&limit=10") == (users, 3)
+    assert scan_all(store_port, "limit=1000") == (sorted(items), 1)
+
+    code, page = request(store_port, "GET",
+                         "/scan?start=order:&end=user:001&values=1")
+    assert code == 200
+    assert page == {
+        "items": [
+            {"key": "order:1", "value": "a"},
+            {"key": "order:2", "value": "b"},
+            {"key": "user:000", "value": 0},
+        ],
+        "cursor": None,
+    }
+
+    # Курсор продолжает после указанного ключа, а не с начала префикса
+    assert request(store_port, "GET",
+                   "/scan?prefix=user:&cursor=user:020&limit=3") == \
+        (200, {"keys": ["user:021", "user:022", "user:023"],
+               "cursor": "user:023"})
+
+
+def test_replicas_follow_leader(tmp_path):
+    """Реплики грузятся со снимка ведущего и применяют его изменения."""
+    address = f"127.0.0.1:{free_port()}"
+    leader_port = free_port()
+    processes = []
+    try:
+        os.mkdir(tmp_path / "leader")
+        processes.append(spawn_store(
+            str(tmp_path / "leader"), leader_port,
+            KV_ROLE="leader", KV_REPLICATION_ADDR=address,
+        ))
+        request(leader_port, "POST", "/mset",
+                {"items": {f"k{i}": i for i in range(100)}})
+
+        # Первая реплика стартует со снимка, в котором уже есть k0..k99
+        follower_ports = [free_port(), free_port()]
+        for n, port in enumerate(follower_ports):
+            os.mkdir(tmp_path / f"follower{n}")
+            processes.append(spawn_store(
+                str(tmp_path / f"follower{n}"), port,
+                KV_ROLE="follower", KV_REPLICATION_ADDR=address,
+            ))
+            if n == 0:
+                request(leader_port, "POST", "/set",
+                        {"key": "late", "value": {"a": [1, 2]}, "ttl": 60})
+                request(leader_port, "DELETE", "/delete/k5")
+
+        _, leader = request(leader_port, "GET", "/replication")
+        assert len(leader["followers"]) == 2
+        for port in follower_ports:
+            status = wait_synced(port, leader["seq"])
+            assert status["connected"]
+
+            assert request(port, "GET", "/get/k7") == \
+                (200, {"key": "k7", "value": 7})
+            assert request(port, "GET", "/get/late")[1]["value"] == \
+                {"a": [1, 2]}
+            assert request(port, "GET", "/exists/k5")[1]["exists"] is False
+            assert 0 < request(port, "GET", "/ttl/late")[1]["ttl"] <= 60
+
+            code, _ = request(port, "POST", "/set", {"key": "x", "value": 1})
+            assert code == 403
+            assert request(port, "GET", "/exists/x")[1]["exists"] is False
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
@@ -2,6 +2,8 @@ import asyncio
 import json
 import os
 import glob
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # Папка с транзакциями (должна совпадать с generate_transactions.py)
 TRANSACTIONS_DIR = "transactions"
@@ -9,14 +11,72 @@ TRANSACTIONS_DIR = "transactions"
 # Лимит для предупреждения (в рублях)
 EXPENSE_LIMIT = 10000.0
 
-async def read_transaction_file(filepath):
-    """Асинхронно читает один файл с транзакциями."""
-    # Имитация асинхронной операции ввода-вывода
-    await asyncio.sleep(0.01)
+def positive_int(value):
+    """Положительное целое из строки; ValueError, если это не так."""
+    number = int(value)
+    if number <= 0:
+        raise ValueError(value)
+    return number
+
+def env_positive_int(name, default):
+    """Положительное целое из переменной окружения name."""
+    try:
+        return positive_int(os.getenv(name, default))
+    except ValueError:
+        sys.exit(f"Ошибка: {name} должно быть положительным целым.")
+
+# Сколько файлов читается и разбирается одновременно (потоков в пуле
+# и задач в полёте); можно задать аргументом командной строки
+CONCURRENCY = env_positive_int("LAB8_CONCURRENCY", "32")
+
+# Файлов на одну задачу пула: файлы маленькие, и передача каждого
+# в поток по отдельности стоила бы дороже его разбора
+FILES_PER_TASK = env_positive_int("LAB8_FILES_PER_TASK", "32")
+
+def read_transaction_file(filepath):
+    """Читает один файл с транзакциями (блокирующе, в потоке пула)."""
     with open(filepath, "r", encoding="utf-8") as f:
         return json.load(f)
 
-async def analyze_transactions():
+def aggregate_files(filepaths):
+    """Суммы по категориям для группы файлов — частичный итог."""
+    totals = {}
+    for filepath in filepaths:
+        for tx in read_transaction_file(filepath):
+            cat = tx["category"]
+            totals[cat] = totals.get(cat, 0) + tx["amount"]
+    return totals
+
+def merge_totals(category_totals, partial):
+    for cat, amount in partial.items():
+        category_totals[cat] = category_totals.get(cat, 0) + amount
+
+async def collect_totals(filepaths, concurrency=CONCURRENCY,
+                         files_per_task=FILES_PER_TASK):
+    """
+    Суммы по категориям для всех файлов. Чтение и разбор идут
+    в пуле из concurrency потоков группами по files_per_task файлов;
+    в полёте не больше concurrency групп, частичные итоги
+    складываются по мере готовности.
+    """
+    loop = asyncio.get_running_loop()
+    category_totals = {}
+    pending = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for start in range(0, len(filepaths), files_per_task):
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    merge_totals(category_totals, future.result())
+            group = filepaths[start:start + files_per_task]
+            pending.add(loop.run_in_executor(executor, aggregate_files,
+                                             group))
+        for future in asyncio.as_completed(pending):
+            merge_totals(category_totals, await future)
+    return category_totals
+
+async def analyze_transactions(concurrency=CONCURRENCY):
     """Основная функция анализа."""
     # Ищем все JSON-файлы в папке transactions/
     pattern = os.path.join(TRANSACTIONS_DIR, "transactions_part_*.json")
@@ -28,21 +88,14 @@ async def analyze_transactions():
 
     print(f"Найдено файлов: {len(filepaths)}. Начинаю анализ...")
 
-    # Словарь для агрегации
-    category_totals = {}
-
-    # Читаем все файлы асинхронно 
-    for filepath in sorted(filepaths):
-        transactions = await read_transaction_file(filepath)
-        for tx in transactions:
-            cat = tx["category"]
-            amount = tx["amount"]
-            category_totals[cat] = category_totals.get(cat, 0) + amount
+    # Читаем и разбираем файлы параллельно
+    category_totals = await collect_totals(filepaths, concurrency)
 
-    # Выводим результаты и проверяем лимиты
+    # Выводим результаты и проверяем лимиты; файлы завершаются
+    # в произвольном порядке, поэтому категории — по алфавиту
     print("\nИтоговые расходы по категориям:")
     print("-" * 40)
-    for category, total in category_totals.items():
+    for category, total in sorted(category_totals.items()):
         print(f"{category:15} : {total:10.2f} ₽")
         if total > EXPENSE_LIMIT:
             print(f"ВНИМАНИЕ: расходы в категории \"{category}\" превысили лимит! Сумма: {total:.2f} ₽")
@@ -54,7 +107,15 @@ def main():
         print(f"Папка '{TRANSACTIONS_DIR}' не найдена. Сначала запустите generate_transactions.py")
         return
 
-    asyncio.run(analyze_transactions())
+    concurrency = CONCURRENCY
+    if len(sys.argv) > 1:
+        try:
+            concurrency = positive_int(sys.argv[1])
+        except ValueError:
+            print("Ошибка: число одновременно читаемых файлов должно быть положительным целым.")
+            return
+
+    asyncio.run(analyze_transactions(concurrency))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
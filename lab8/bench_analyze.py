@@ -0,0 +1,133 @@
+"""
+Время анализа транзакций: прежний последовательный цикл против
+параллельного чтения и разбора (collect_totals) с разным числом
+одновременно читаемых файлов.
+
+Файлы создаются во временной папке: --files файлов по --per-file
+транзакций в формате generate_transactions.py. Режимы:
+- прежний цикл — await asyncio.sleep(0.01) и блокирующее чтение
+  каждого файла по очереди, как было в analyze_transactions;
+- последовательно — тот же цикл без sleep (чистая стоимость чтения
+  и разбора);
+- collect_totals с concurrency из --concurrency и --files-per-task
+  файлами на задачу пула.
+Итоги всех режимов сверяются с точностью до копейки.
+
+Только что записанные файлы лежат в кэше страниц, и чтение почти
+ничего не стоит. --io-latency-ms добавляет к чтению каждого файла
+блокирующее ожидание (как у холодного диска или сетевой ФС) —
+именно его перекрывают потоки пула.
+
+Запуск: python bench_analyze.py [--files 10000] [--per-file 10]
+        [--concurrency 1,4,16,64] [--files-per-task 32]
+        [--io-latency-ms 0] [--skip-old]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import analyze_transactions
+from analyze_transactions import aggregate_files, collect_totals
+
+# Как в generate_transactions.py (импорт создал бы папку transactions/)
+CATEGORIES = ["еда", "транспорт", "развлечения", "одежда", "здоровье"]
+
+
+def make_files(directory, files, per_file, seed=1):
+    rng = random.Random(seed)
+    paths = []
+    for number in range(1, files + 1):
+        batch = [{"timestamp": "2025-11-30T17:52:39",
+                  "category": rng.choice(CATEGORIES),
+                  "amount": round(rng.uniform(100, 5000), 2)}
+                 for _ in range(per_file)]
+        path = os.path.join(directory, f"transactions_part_{number}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(batch, f, ensure_ascii=False, indent=2)
+        paths.append(path)
+    return paths
+
+
+async def old_loop(filepaths):
+    """Цикл из прежней analyze_transactions."""
+    category_totals = {}
+    for filepath in sorted(filepaths):
+        await asyncio.sleep(0.01)
+        transactions = analyze_transactions.read_transaction_file(filepath)
+        for tx in transactions:
+            cat = tx["category"]
+            category_totals[cat] = category_totals.get(cat, 0) + tx["amount"]
+    return category_totals
+
+
+async def sequential(filepaths):
+    return aggregate_files(filepaths)
+
+
+def add_io_latency(seconds):
+    """Блокирующая задержка перед чтением каждого файла."""
+    read = analyze_transactions.read_transaction_file
+
+    def slow_read(filepath):
+        time.sleep(seconds)
+        return read(filepath)
+
+    analyze_transactions.read_transaction_file = slow_read
+
+
+def same_totals(first, second):
+    # Порядок сложения разный, поэтому сравнение — до копейки
+    return (first.keys() == second.keys()
+            and all(abs(first[cat] - second[cat]) < 0.01 for cat in first))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--per-file", type=int, default=10)
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--files-per-task", type=int, default=32)
+    parser.add_argument("--io-latency-ms", type=float, default=0)
+    parser.add_argument("--skip-old", action="store_true",
+                        help="не запускать прежний цикл (~files * 10 мс)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_files(directory, args.files, args.per_file)
+        if args.io_latency_ms:
+            add_io_latency(args.io_latency_ms / 1000)
+        print(f"Файлов: {args.files} по {args.per_file} транзакций, "
+              f"ядер: {os.cpu_count()}, "
+              f"задержка чтения: {args.io_latency_ms:g} мс")
+        print(f"{'режим':24} {'время, с':>9} {'файлов/с':>10} {'ускорение':>10}")
+        print("-" * 56)
+
+        modes = []
+        if not args.skip_old:
+            modes.append(("прежний цикл", old_loop))
+        modes.append(("последовательно", sequential))
+        for concurrency in map(int, args.concurrency.split(",")):
+            modes.append((f"collect_totals {concurrency}",
+                          lambda p, c=concurrency: collect_totals(
+                              p, c, args.files_per_task)))
+
+        expected = None
+        baseline = None
+        for name, run in modes:
+            start = time.perf_counter()
+            totals = asyncio.run(run(paths))
+            elapsed = time.perf_counter() - start
+            if expected is None:
+                expected, baseline = totals, elapsed
+            elif not same_totals(totals, expected):
+                raise SystemExit(f"{name}: итоги расходятся с первым режимом")
+            print(f"{name:24} {elapsed:>9.2f} {args.files / elapsed:>10.0f} "
+                  f"{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from analyze_transactions import collect_totals
+from bench_analyze import make_files
+
+
+def sequential_totals(filepaths):
+    """Суммы по категориям обычным циклом по файлам."""
+    totals = {}
+    for filepath in filepaths:
+        with open(filepath, encoding="utf-8") as f:
+            for tx in json.load(f):
+                totals[tx["category"]] = (
+                    totals.get(tx["category"], 0) + tx["amount"]
+                )
+    return totals
+
+
+@pytest.mark.parametrize("concurrency, files_per_task", [
+    (1, 1), (4, 3), (16, 32), (64, 1000),
+])
+def test_collect_totals_matches_sequential_sum(tmp_path, concurrency,
+                                              files_per_task):
+    """Параллельный подсчёт совпадает с последовательным до копейки."""
+    filepaths = make_files(str(tmp_path), 200, 10)
+    expected = sequential_totals(filepaths)
+
+    totals = asyncio.run(collect_totals(filepaths, concurrency,
+                                        files_per_task))
+    assert totals.keys() == expected.keys()
+    for category, total in expected.items():
+        assert round(totals[category], 2) == round(total, 2)
+
+
+@pytest.mark.parametrize("name, value", [
+    ("LAB8_CONCURRENCY", "0"),
+    ("LAB8_CONCURRENCY", "много"),
+    ("LAB8_FILES_PER_TASK", "0"),
+    ("LAB8_FILES_PER_TASK", "-5"),
+])
+def test_rejects_non_positive_env(tmp_path, name, value):
+    """Некорректная настройка — понятное сообщение, а не traceback."""
+    result = subprocess.run(
+        [sys.executable,
+         os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "analyze_transactions.py")],
+        cwd=tmp_path,
+        env=dict(os.environ, **{name: value}),
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    assert result.returncode == 1
+    assert f"{name} должно быть положительным целым" in result.stderr
+    assert "Traceback" not in result.stderr